@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renders data as one server-sent event
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return self.event(data).encode(self.charset)
+
+    @staticmethod
+    def event(data, event_id=None) -> str:
+        lines = []
+        if event_id is not None:
+            lines.append(f'id: {event_id}')
+        lines.append(f'data: {json.dumps(data, cls=JSONEncoder)}')
+        return '\n'.join(lines) + '\n\n'
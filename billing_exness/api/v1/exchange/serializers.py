@@ -1,12 +1,27 @@
 # -*- coding: utf-8 -*-
-from typing import Optional
+from typing import List, Optional
 from rest_framework import serializers
+from django.conf import settings
+from django.core.validators import MinValueValidator
 
 from billing_exness.billing.models import ExchangeRate
+from billing_exness.billing.constants import (
+    AMOUNT_MAX_DIGITS,
+    CURRENCIES,
+    EXCHANGE_CURRENCIES,
+    OHLC_BUCKETS,
+    HOUR
+)
 from billing_exness.billing.exceptions import check_currency
+from billing_exness.billing.quotes import make_quote
 
 
 class ExchangeRateSerializer(serializers.ModelSerializer):
+    rate = serializers.DecimalField(
+        max_digits=AMOUNT_MAX_DIGITS,
+        decimal_places=2,
+        validators=[MinValueValidator(0)]
+    )
 
     class Meta:
         model = ExchangeRate
@@ -34,3 +49,109 @@ class ExchangeRateSerializer(serializers.ModelSerializer):
             currency=self.currency
         )
         return self.instance
+
+
+class ExchangeRateSetSerializer(serializers.Serializer):
+    """
+    Allows to set rates of several currencies at once
+    """
+    rates = serializers.DictField(
+        child=serializers.DecimalField(
+            max_digits=AMOUNT_MAX_DIGITS,
+            decimal_places=2,
+            validators=[MinValueValidator(0)]
+        ),
+        allow_empty=False
+    )
+    created = serializers.DateTimeField(read_only=True)
+
+    def validate_rates(self, rates: dict) -> dict:
+        unknown = set(rates) - set(EXCHANGE_CURRENCIES)
+        if unknown:
+            raise serializers.ValidationError(
+                f"Wrong currencies: {', '.join(sorted(unknown))}"
+            )
+        return rates
+
+    def to_representation(self, instance: List[ExchangeRate]) -> dict:
+        return {
+            'rates': {
+                rate.currency: self.fields['rates'].child.to_representation(
+                    rate.rate
+                )
+                for rate in instance
+            },
+            'created': self.fields['created'].to_representation(
+                instance[0].created
+            ),
+        }
+
+    def save(self, **kwargs) -> List[ExchangeRate]:
+        self.instance = ExchangeRate.publish(self.validated_data['rates'])
+        return self.instance
+
+
+class RateHistoryQuerySerializer(serializers.Serializer):
+    """
+    Validates query params of rate history
+    """
+    bucket = serializers.ChoiceField(choices=OHLC_BUCKETS, default=HOUR)
+    after = serializers.DateTimeField(required=False)
+    before = serializers.DateTimeField(required=False)
+    cursor = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=1000,
+        default=100
+    )
+
+
+class RateHistorySerializer(serializers.Serializer):
+    """
+    Open, high, low and close rates of time bucket
+    """
+    bucket = serializers.DateTimeField()
+    open = serializers.DecimalField(max_digits=None, decimal_places=2)
+    high = serializers.DecimalField(max_digits=None, decimal_places=2)
+    low = serializers.DecimalField(max_digits=None, decimal_places=2)
+    close = serializers.DecimalField(max_digits=None, decimal_places=2)
+
+
+class QuoteSerializer(serializers.Serializer):
+    """
+    Locks rates of currencies for short time. Returned token could be
+    passed with payment to pay with locked rates
+    """
+    currencies = serializers.ListField(
+        child=serializers.ChoiceField(choices=CURRENCIES),
+        allow_empty=False,
+        required=False
+    )
+    token = serializers.CharField(read_only=True)
+    rates = serializers.DictField(
+        child=serializers.DecimalField(max_digits=None, decimal_places=2),
+        read_only=True
+    )
+    expires = serializers.DateTimeField(read_only=True)
+
+    def save(self, **kwargs) -> dict:
+        token, snapshot, expires = make_quote(
+            self.validated_data.get('currencies', CURRENCIES)
+        )
+        self.instance = {
+            'token': token,
+            'rates': snapshot.rates,
+            'expires': expires,
+        }
+        return self.instance
+
+
+class RateStreamQuerySerializer(serializers.Serializer):
+    """
+    Validates query params of rate stream
+    """
+    since = serializers.IntegerField(min_value=0, required=False)
+    timeout = serializers.IntegerField(min_value=0, required=False)
+
+    def validate_timeout(self, timeout: int) -> int:
+        return min(timeout, settings.BILLING_STREAM_TIMEOUT)
@@ -3,9 +3,9 @@ from decimal import Decimal
 
 import pytest
 
-from ..serializers import ExchangeRateSerializer
+from ..serializers import ExchangeRateSerializer, ExchangeRateSetSerializer
 from billing_exness.billing.models import ExchangeRate
-from billing_exness.billing.constants import EUR, CAD
+from billing_exness.billing.constants import USD, EUR, CAD
 from billing_exness.billing.tests.factories import ExchangeRateFactory
 
 pytestmark = pytest.mark.django_db
@@ -68,3 +68,32 @@ class TestExchangeRateSerializer:
                 data={'rate': Decimal("63")},
                 currency=CAD
             )
+
+
+class TestExchangeRateSetSerializer:
+
+    def test_wrong_currency(self):
+        serializer = ExchangeRateSetSerializer(data={
+            'rates': {EUR: Decimal("2"), USD: Decimal("1")}
+        })
+
+        assert not serializer.is_valid()
+        assert 'rates' in serializer.errors
+
+    def test_empty_rates(self):
+        serializer = ExchangeRateSetSerializer(data={'rates': {}})
+
+        assert not serializer.is_valid()
+
+    def test_save_success(self):
+        serializer = ExchangeRateSetSerializer(data={
+            'rates': {EUR: Decimal("2"), CAD: Decimal("3")}
+        })
+
+        assert serializer.is_valid()
+        rates = serializer.save()
+
+        assert len(rates) == 2
+        assert ExchangeRate.of(EUR) == Decimal("2")
+        assert ExchangeRate.of(CAD) == Decimal("3")
+        assert serializer.data['rates'] == {EUR: '2.00', CAD: '3.00'}
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
 from decimal import Decimal
 
 import pytest
+from django.db import connections
 from django.shortcuts import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 
-from billing_exness.billing.constants import USD, EUR
+from billing_exness.billing.constants import USD, EUR, CAD
+from billing_exness.billing.models import ExchangeRate
+from billing_exness.billing.pubsub import RATES_CHANNEL, get_pubsub
 from billing_exness.billing.tests.factories import ExchangeRateFactory
 from billing_exness.users.tests.factories import UserFactory
 
@@ -99,3 +104,239 @@ class TestExhangeRateApiView:
             }
         )
         assert response.status_code == 405
+
+
+class TestExchangeRateSetApiView:
+
+    def test_update_no_permission(self):
+        user = UserFactory.create()
+        client = APIClient()
+        client.force_login(user)
+
+        response = client.put(
+            reverse('api_v1:exchange:rates'),
+            data={'rates': {EUR: '2.00'}},
+            format='json'
+        )
+        assert response.status_code == 403
+
+    def test_update_success(self):
+        user = UserFactory.create(is_staff=True)
+        client = APIClient()
+        client.force_login(user)
+
+        response = client.put(
+            reverse('api_v1:exchange:rates'),
+            data={'rates': {EUR: '2.00', CAD: '1.50'}},
+            format='json'
+        )
+        assert response.status_code == 200
+        assert response.data['rates'] == {EUR: '2.00', CAD: '1.50'}
+
+        response = client.get(reverse(
+            'api_v1:exchange:rate',
+            kwargs={'currency': CAD}
+        ))
+        assert response.data['rate'] == '1.50'
+
+
+class TestExchangeRateHistoryApiView:
+
+    def test_wrong_currency(self):
+        client = APIClient()
+        response = client.get(reverse(
+            'api_v1:exchange:history',
+            kwargs={'currency': USD}
+        ))
+        assert response.status_code == 404
+
+    def test_wrong_bucket(self):
+        client = APIClient()
+        response = client.get(
+            reverse('api_v1:exchange:history', kwargs={'currency': EUR}),
+            {'bucket': 'week'}
+        )
+        assert response.status_code == 400
+
+    def test_cursor_paging(self):
+        start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for hours in range(3):
+            ExchangeRateFactory.create(
+                rate=Decimal(hours + 1),
+                currency=EUR,
+                created=start - timedelta(hours=hours)
+            )
+
+        client = APIClient()
+        response = client.get(
+            reverse('api_v1:exchange:history', kwargs={'currency': EUR}),
+            {'bucket': 'hour', 'limit': 2}
+        )
+        assert response.status_code == 200
+        assert [item['close'] for item in response.data['results']] == [
+            '3.00',
+            '2.00'
+        ]
+        assert response.data['next'] is not None
+
+        response = client.get(response.data['next'])
+        assert response.status_code == 200
+        assert [item['close'] for item in response.data['results']] == [
+            '1.00'
+        ]
+        assert response.data['next'] is None
+
+
+class TestExchangeRateConditionalGet:
+
+    def test_not_modified(self):
+        ExchangeRateFactory.create(rate=Decimal('2.2'), currency=EUR)
+        url = reverse('api_v1:exchange:rate', kwargs={'currency': EUR})
+        client = APIClient()
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert 'Last-Modified' in response
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+    def test_modified(self):
+        ExchangeRateFactory.create(rate=Decimal('2.2'), currency=EUR)
+        url = reverse('api_v1:exchange:rate', kwargs={'currency': EUR})
+        client = APIClient()
+        etag = client.get(url)['ETag']
+
+        ExchangeRateFactory.create(rate=Decimal('2.5'), currency=EUR)
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.data['rate'] == '2.50'
+        assert response['ETag'] != etag
+
+
+class TestQuoteApiView:
+
+    def test_permission_denied(self):
+        client = APIClient()
+        response = client.post(reverse('api_v1:exchange:quote'))
+        assert response.status_code == 401
+
+    def test_rate_not_set(self):
+        client = APIClient()
+        client.force_login(UserFactory.create())
+
+        response = client.post(
+            reverse('api_v1:exchange:quote'),
+            {'currencies': [EUR]},
+            format='json'
+        )
+        assert response.status_code == 400
+
+    def test_quote_success(self):
+        ExchangeRateFactory.create(rate=Decimal('2'), currency=EUR)
+        client = APIClient()
+        client.force_login(UserFactory.create())
+
+        response = client.post(
+            reverse('api_v1:exchange:quote'),
+            {'currencies': [USD, EUR]},
+            format='json'
+        )
+        assert response.status_code == 201
+        assert response.data['rates'] == {USD: '1.00', EUR: '2.00'}
+        for field in ['token', 'expires']:
+            assert field in response.data
+
+
+@pytest.mark.django_db(transaction=True)
+class TestExchangeRateStreamApiView:
+
+    def test_permission_denied(self):
+        client = APIClient()
+        response = client.get(reverse('api_v1:exchange:stream'))
+        assert response.status_code == 401
+
+    def test_current_version(self):
+        version = get_pubsub().version(RATES_CHANNEL)
+        client = APIClient()
+        client.force_login(UserFactory.create())
+
+        response = client.get(reverse('api_v1:exchange:stream'))
+
+        assert response.status_code == 200
+        assert response.data == {'version': version, 'events': []}
+
+    def test_long_poll(self):
+        version = get_pubsub().version(RATES_CHANNEL)
+        ExchangeRateFactory.create(rate=Decimal('2'), currency=EUR)
+        client = APIClient()
+        client.force_login(UserFactory.create())
+
+        response = client.get(
+            reverse('api_v1:exchange:stream'),
+            {'since': version, 'timeout': 0}
+        )
+
+        assert response.status_code == 200
+        assert response.data['version'] == version + 1
+        event, = response.data['events']
+        assert event['rates'][0]['currency'] == EUR
+        assert event['rates'][0]['rate'] == '2.00'
+
+    def test_long_poll_timeout(self):
+        version = get_pubsub().version(RATES_CHANNEL)
+        client = APIClient()
+        client.force_login(UserFactory.create())
+
+        response = client.get(
+            reverse('api_v1:exchange:stream'),
+            {'since': version, 'timeout': 0}
+        )
+
+        assert response.status_code == 200
+        assert response.data == {'version': version, 'events': []}
+
+    def test_connection_closed_before_waiting(self, monkeypatch):
+        pubsub = get_pubsub()
+        wrapper = type(connections['default'])
+        close, listen = wrapper.close, type(pubsub).listen
+        calls = []
+
+        def spy(name, method):
+            def wrapped(self, *args, **kwargs):
+                calls.append(name)
+                return method(self, *args, **kwargs)
+            return wrapped
+
+        monkeypatch.setattr(wrapper, 'close', spy('close', close))
+        monkeypatch.setattr(type(pubsub), 'listen', spy('listen', listen))
+        client = APIClient()
+        client.force_login(UserFactory.create())
+
+        response = client.get(
+            reverse('api_v1:exchange:stream'),
+            {'since': pubsub.version(RATES_CHANNEL), 'timeout': 0}
+        )
+
+        assert response.status_code == 200
+        assert calls[:2] == ['close', 'listen']
+
+    def test_event_stream(self):
+        version = get_pubsub().version(RATES_CHANNEL)
+        ExchangeRate.publish({EUR: Decimal('2'), CAD: Decimal('3')})
+        client = APIClient()
+        client.force_login(UserFactory.create())
+
+        response = client.get(
+            reverse('api_v1:exchange:stream'),
+            {'since': version, 'timeout': 1},
+            HTTP_ACCEPT='text/event-stream'
+        )
+
+        assert response.status_code == 200
+        assert response['Cache-Control'] == 'no-cache'
+        assert response['X-Accel-Buffering'] == 'no'
+        content = b''.join(response.streaming_content).decode()
+        assert content.startswith(f'id: {version + 1}\ndata: ')
+        assert '"currency": "CAD"' in content
@@ -1,9 +1,23 @@
 # -*- coding: utf-8 -*-
 from django.urls import path
 
-from .views import ExchangeRateApiView
+from .views import (
+    ExchangeRateApiView,
+    ExchangeRateSetApiView,
+    ExchangeRateHistoryApiView,
+    QuoteApiView,
+    ExchangeRateStreamApiView
+)
 
 app_name = 'exchange'
 urlpatterns = [
-    path("<str:currency>/", ExchangeRateApiView.as_view(), name="rate")
+    path("", ExchangeRateSetApiView.as_view(), name="rates"),
+    path("quote/", QuoteApiView.as_view(), name="quote"),
+    path("stream/", ExchangeRateStreamApiView.as_view(), name="stream"),
+    path("<str:currency>/", ExchangeRateApiView.as_view(), name="rate"),
+    path(
+        "<str:currency>/history/",
+        ExchangeRateHistoryApiView.as_view(),
+        name="history"
+    ),
 ]
@@ -1,19 +1,39 @@
 # -*- coding: utf-8 -*-
-from typing import Optional
+import time
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
 
-from django.http import Http404
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, StreamingHttpResponse
 from rest_framework import status
 from rest_framework import generics
 from rest_framework import permissions
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
-from billing_exness.billing.constants import EUR
-from billing_exness.billing.models import ExchangeRate
+from billing_exness.billing.constants import EUR, EXCHANGE_CURRENCIES
+from billing_exness.billing.models import ExchangeRate, CurrentRate
+from billing_exness.billing.pubsub import RATES_CHANNEL, BasePubSub, get_pubsub
 from billing_exness.openapi.schema import SecurityRequiredSchema
-from .serializers import ExchangeRateSerializer
+from ..mixins import ConditionalRetrieveMixin, NonAtomicRequestsMixin
+from .serializers import (
+    ExchangeRateSerializer,
+    ExchangeRateSetSerializer,
+    RateHistoryQuerySerializer,
+    RateHistorySerializer,
+    QuoteSerializer,
+    RateStreamQuerySerializer
+)
+from .renderers import EventStreamRenderer
 
 
-class ExchangeRateApiView(generics.RetrieveUpdateAPIView):
+class ExchangeRateApiView(
+    NonAtomicRequestsMixin,
+    ConditionalRetrieveMixin,
+    generics.RetrieveUpdateAPIView
+):
     """
     Retrieves info about rate of currency
     """
@@ -36,15 +56,191 @@ class ExchangeRateApiView(generics.RetrieveUpdateAPIView):
 
     def get_object(self) -> Optional[ExchangeRate]:
         currency: str = self.kwargs['currency'].upper()
+        if currency not in EXCHANGE_CURRENCIES:
+            raise Http404()
+
         try:
-            rate = ExchangeRate.of(currency, as_object=True)
-        except ValueError:
+            current = CurrentRate.objects.select_related(
+                'exchange_rate'
+            ).get(pk=currency)
+        except CurrentRate.DoesNotExist:
             return None
-        except AssertionError:
-            raise Http404()
         else:
-            assert isinstance(rate, ExchangeRate)
-            return rate
+            return current.exchange_rate
+
+    def get_validators(
+        self,
+        instance: Optional[ExchangeRate]
+    ) -> Tuple[Optional[str], Optional[datetime]]:
+        if instance is None:
+            return None, None
+        return f'rate-{instance.pk}', instance.created
 
     def patch(self, request, *args, **kwargs) -> Response:
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class ExchangeRateSetApiView(generics.GenericAPIView):
+    """
+    Sets rates of several currencies at once
+    """
+    serializer_class = ExchangeRateSetSerializer
+    permission_classes = [permissions.IsAdminUser]
+    schema = SecurityRequiredSchema()
+
+    def put(self, request, *args, **kwargs) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+
+class ExchangeRateHistoryApiView(generics.GenericAPIView):
+    """
+    Shows open, high, low and close rates of currency by time buckets.
+    Pages are linked by `next` cursor
+    """
+    serializer_class = RateHistorySerializer
+    query_serializer_class = RateHistoryQuerySerializer
+
+    def get(self, request, *args, **kwargs) -> Response:
+        currency: str = self.kwargs['currency'].upper()
+        if currency not in EXCHANGE_CURRENCIES:
+            raise Http404()
+
+        query = self.query_serializer_class(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        buckets = ExchangeRate.ohlc(
+            currency,
+            params['bucket'],
+            since=params.get('cursor', params.get('after')),
+            until=params.get('before'),
+            limit=params['limit'] + 1
+        )
+
+        next_url = None
+        if len(buckets) > params['limit']:
+            cursor = buckets.pop()['bucket']
+            next_url = replace_query_param(
+                request.build_absolute_uri(),
+                'cursor',
+                cursor.isoformat()
+            )
+
+        return Response({
+            'next': next_url,
+            'results': self.get_serializer(buckets, many=True).data
+        })
+
+
+class QuoteApiView(generics.GenericAPIView):
+    """
+    Locks exchange rates for payment
+    """
+    serializer_class = QuoteSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    schema = SecurityRequiredSchema()
+
+    def post(self, request, *args, **kwargs) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            serializer.save()
+        except ValueError as e:
+            return Response(
+                {api_settings.NON_FIELD_ERRORS_KEY: str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ExchangeRateStreamApiView(
+    NonAtomicRequestsMixin,
+    generics.GenericAPIView
+):
+    """
+    Notifies about new exchange rates. Waits for rates newer than `since`
+    version(long polling) or streams them as server-sent events when
+    `text/event-stream` is accepted. Every listener holds thread of worker,
+    so production server runs threaded workers
+    """
+    query_serializer_class = RateStreamQuerySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    schema = SecurityRequiredSchema()
+    renderer_classes = tuple(
+        api_settings.DEFAULT_RENDERER_CLASSES
+    ) + (EventStreamRenderer,)
+    keepalive = 15
+
+    def get(self, request, *args, **kwargs):
+        query = self.query_serializer_class(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        timeout = query.validated_data.get(
+            'timeout',
+            settings.BILLING_STREAM_TIMEOUT
+        )
+        since = query.validated_data.get('since')
+
+        pubsub = get_pubsub()
+        version = pubsub.version(RATES_CHANNEL)
+        # listener doesn't query db anymore, connection is returned instead
+        # of being held while waiting for events
+        connection.close()
+
+        if request.accepted_renderer.format == EventStreamRenderer.format:
+            last_event_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+            if since is None and last_event_id.isdigit():
+                since = int(last_event_id)
+            since = self.resolve_since(since, version)
+            response = StreamingHttpResponse(
+                self.stream(pubsub, since, timeout),
+                content_type=EventStreamRenderer.media_type
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        if since is None:
+            return Response({'version': version, 'events': []})
+
+        since = self.resolve_since(since, version)
+        events = pubsub.listen(RATES_CHANNEL, since, timeout)
+        return Response({
+            'version': events[-1][0] if events else since,
+            'events': [
+                dict(message, version=event_version)
+                for event_version, message in events
+            ]
+        })
+
+    def resolve_since(self, since: Optional[int], version: int) -> int:
+        """
+        Sends all kept events when listener knows about versions that pubsub
+        has lost, e.g. after restart
+        """
+        if since is None:
+            return version
+        return since if since <= version else 0
+
+    def stream(
+        self,
+        pubsub: BasePubSub,
+        since: int,
+        timeout: int
+    ) -> Iterator[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            events = pubsub.listen(
+                RATES_CHANNEL,
+                since,
+                min(left, self.keepalive)
+            )
+            if not events:
+                yield ': keepalive\n\n'
+            for since, message in events:
+                yield EventStreamRenderer.event(message, since)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+from abc import ABCMeta, abstractmethod
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Optional, Tuple, TYPE_CHECKING
+
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from billing_exness.billing.db import retry_atomic
+from billing_exness.billing.models import IdempotencyKey
+
+if TYPE_CHECKING:
+    # mixins are used with generic views only
+    from rest_framework.generics import GenericAPIView as ViewBase
+else:
+    ViewBase = object
+
+
+class NonAtomicRequestsMixin(ViewBase):
+    """
+    Disables ATOMIC_REQUESTS for view. Every write operation of view
+    should be atomic by itself
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return transaction.non_atomic_requests(super().as_view(**initkwargs))
+
+
+class ConditionalRetrieveMixin(ViewBase, metaclass=ABCMeta):
+    """
+    Adds ETag and Last-Modified headers to retrieved object and answers
+    304 on conditional GET without serializing object.
+    View should implement `get_validators`
+    """
+
+    @abstractmethod
+    def get_validators(
+        self,
+        instance: Any
+    ) -> Tuple[Optional[str], Optional[datetime]]:
+        """
+        Returns ETag and last modification time of object
+        """
+        pass
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = self.get_validators(instance)
+        if etag is not None:
+            etag = quote_etag(etag)
+        timestamp = None
+        if last_modified is not None:
+            timestamp = int(last_modified.timestamp())
+
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=timestamp
+        )
+        if response is None:
+            serializer = self.get_serializer(instance)
+            response = Response(serializer.data)
+
+        if etag is not None:
+            response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class IdempotentRequestsMixin(ViewBase):
+    """
+    Makes write requests with `Idempotency-Key` header idempotent for user.
+    First request with key stores its response, retried request gets stored
+    response without repeating operation. Key is inserted in the same
+    transaction as operation, so concurrent duplicate waits on unique index
+    until first request commits and then replays its response.
+    Responses with server errors aren`t stored, so such requests could be
+    retried with the same key. Only `replayed_headers` of response are
+    stored with its body.
+    """
+    idempotency_header = 'Idempotency-Key'
+    idempotent_methods = ('post', 'put')
+    # headers that describe result of operation are replayed with body
+    replayed_headers = (
+        'Location',
+        'Content-Location',
+        'Preference-Applied',
+        'Retry-After',
+    )
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        method = request.method.lower()
+        key = request.headers.get(self.idempotency_header)
+        if key is not None and method in self.idempotent_methods:
+            # dispatch looks up handler after `initial`
+            setattr(self, method, partial(
+                self.handle_idempotently,
+                getattr(self, method),
+                key
+            ))
+
+    def get_fingerprint(self, request) -> str:
+        """
+        Returns hash of request, so the same key can`t be reused for
+        different request
+        """
+        data = json.dumps(request.data, cls=JSONEncoder, sort_keys=True)
+        return hashlib.sha256(
+            f'{request.method} {request.path} {data}'.encode()
+        ).hexdigest()
+
+    def handle_idempotently(
+        self,
+        handler: Callable,
+        key: str,
+        request,
+        *args,
+        **kwargs
+    ) -> Response:
+        max_length = IdempotencyKey._meta.get_field('key').max_length
+        if not key or len(key) > max_length:
+            return Response(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: (
+                        f"{self.idempotency_header} should contain from 1 "
+                        f"to {max_length} characters"
+                    )
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return self.store_response(
+            handler,
+            key,
+            self.get_fingerprint(request),
+            request,
+            *args,
+            **kwargs
+        )
+
+    @method_decorator(retry_atomic)
+    def store_response(
+        self,
+        handler: Callable,
+        key: str,
+        fingerprint: str,
+        request,
+        *args,
+        **kwargs
+    ) -> Response:
+        """
+        Runs handler and stores its response in one transaction, or replays
+        response that has been stored before
+        """
+        record, created = IdempotencyKey.objects.get_or_create(
+            user=request.user,
+            key=key,
+            defaults={'fingerprint': fingerprint}
+        )
+        if not created:
+            return self.replay(record, fingerprint)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code >= 500:
+            transaction.set_rollback(True)
+            return response
+
+        record.status_code = response.status_code
+        record.response = json.dumps(response.data, cls=JSONEncoder)
+        record.headers = json.dumps({
+            header: response[header]
+            for header in self.replayed_headers
+            if response.has_header(header)
+        })
+        record.save(update_fields=[
+            'status_code',
+            'response',
+            'headers',
+            'modified'
+        ])
+        return response
+
+    def replay(self, record: IdempotencyKey, fingerprint: str) -> Response:
+        if record.fingerprint != fingerprint:
+            return Response(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: (
+                        f"{self.idempotency_header} has been used for "
+                        f"another request"
+                    )
+                },
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+
+        response = Response(
+            json.loads(record.response),
+            status=record.status_code,
+            headers=json.loads(record.headers or '{}')
+        )
+        response['Idempotent-Replayed'] = 'true'
+        return response
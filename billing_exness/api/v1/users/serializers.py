@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Callable
+from typing import Callable, List, Optional, Union
 from rest_framework import serializers
 from decimal import Decimal
 
@@ -7,11 +7,19 @@ from django.conf import settings
 from django.utils.module_loading import import_string
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser
-from django.core.validators import MinValueValidator
 
-from billing_exness.billing.constants import CURRENCIES
-from billing_exness.billing.models import Wallet, Transaction
-from billing_exness.billing.utils import charge, make_payment
+from billing_exness.billing.constants import AMOUNT_MAX_DIGITS, CURRENCIES
+from billing_exness.billing.models import Wallet, Transaction, PaymentIntent
+from billing_exness.billing.quotes import read_quote
+from billing_exness.billing.rates import RateSnapshot
+from billing_exness.billing.utils import (
+    Transfer,
+    charge,
+    enqueue_payment,
+    make_payment,
+    make_payments,
+    make_payout
+)
 
 User = get_user_model()
 
@@ -20,6 +28,13 @@ def get_password_validator(validator_path: str) -> Callable:
     return lambda x: import_string(validator_path)().validate(password=x)
 
 
+def validate_positive(value: Decimal):
+    if value <= 0:
+        raise serializers.ValidationError(
+            "Ensure this value is greater than 0."
+        )
+
+
 class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -87,6 +102,12 @@ class CreateUserSerializer(serializers.ModelSerializer):
 
 
 class WalletSerializer(serializers.ModelSerializer):
+    amount = serializers.DecimalField(
+        max_digits=None,
+        decimal_places=2,
+        source='balance',
+        read_only=True
+    )
 
     class Meta:
         model = Wallet
@@ -95,11 +116,11 @@ class WalletSerializer(serializers.ModelSerializer):
 
 class ChargeSerializer(serializers.Serializer):
     amount = serializers.DecimalField(
-        max_digits=10,
+        max_digits=AMOUNT_MAX_DIGITS,
         decimal_places=2,
         required=True,
         validators=[
-            MinValueValidator(0)
+            validate_positive
         ]
     )
     currency = serializers.ChoiceField(
@@ -123,20 +144,20 @@ class ChargeSerializer(serializers.Serializer):
         )
 
 
-class PaymentSerializer(serializers.Serializer):
+class PaymentItemSerializer(serializers.Serializer):
     """
-    Allow make payment to user
+    Payment to user without any rates
     """
 
     to_user = serializers.ModelField(
         model_field=User()._meta.get_field('username')
     )
     amount = serializers.DecimalField(
-        max_digits=10,
+        max_digits=AMOUNT_MAX_DIGITS,
         decimal_places=2,
         required=True,
         validators=[
-            MinValueValidator(0)
+            validate_positive
         ],
     )
     currency = serializers.ChoiceField(
@@ -144,9 +165,24 @@ class PaymentSerializer(serializers.Serializer):
         required=True
     )
 
+
+class PaymentSerializer(PaymentItemSerializer):
+    """
+    Allow make payment to user
+    """
+
+    quote = serializers.CharField(
+        required=False,
+        help_text='Token of quote to pay with locked rates'
+    )
+
     def save(self, from_user: AbstractBaseUser) -> Transaction:
         """
-        Makes payment from user
+        Makes payment from user. Uses locked rates if quote has been passed
+        Raises:
+            InvalidQuoteException - if quote is broken or has expired
+            ValueError - if recipient doesn`t exist or one of users hasn`t
+                         got wallet
         """
         assert hasattr(self, '_errors'), (
             'You must call `.is_valid()` before calling `.save()`.'
@@ -156,11 +192,176 @@ class PaymentSerializer(serializers.Serializer):
             'You cannot call `.save()` on a serializer with invalid data.'
         )
 
+        snapshot = None
+        if 'quote' in self.validated_data:
+            snapshot = read_quote(self.validated_data['quote'])
+
         return make_payment(
             from_user,
-            User.objects.get(username=self.validated_data['to_user']),
+            self.validated_data['to_user'],
             self.validated_data['amount'],
-            self.validated_data['currency']
+            self.validated_data['currency'],
+            snapshot
+        )
+
+    def enqueue(self, from_user: AbstractBaseUser) -> PaymentIntent:
+        """
+        Accepts payment from user for asynchronous processing. Rates of
+        quote are stored with payment if quote has been passed
+        Raises:
+            InvalidQuoteException - if quote is broken or has expired
+            ValueError - if recipient doesn`t exist or one of users hasn`t
+                         got wallet
+        """
+        assert hasattr(self, '_errors'), (
+            'You must call `.is_valid()` before calling `.save()`.'
+        )
+
+        assert not self.errors, (
+            'You cannot call `.save()` on a serializer with invalid data.'
+        )
+
+        snapshot = None
+        if 'quote' in self.validated_data:
+            snapshot = read_quote(self.validated_data['quote'])
+
+        username = self.validated_data['to_user']
+        try:
+            to_user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise ValueError(f"User {username} doesn`t exist")
+
+        return enqueue_payment(
+            from_user,
+            to_user,
+            self.validated_data['amount'],
+            self.validated_data['currency'],
+            snapshot
+        )
+
+
+class PaymentListSerializer(serializers.Serializer):
+    """
+    List of payments to users with optional quote
+    """
+
+    payments = PaymentItemSerializer(many=True, allow_empty=False)
+    quote = serializers.CharField(
+        required=False,
+        help_text='Token of quote to pay with locked rates'
+    )
+
+    def validate_payments(self, payments: List[dict]) -> List[dict]:
+        """
+        Checks size of batch and resolves all recipients with one query
+        """
+        if len(payments) > settings.BILLING_PAYMENT_BATCH_SIZE:
+            raise serializers.ValidationError(
+                f"Batch can`t contain more than "
+                f"{settings.BILLING_PAYMENT_BATCH_SIZE} payments"
+            )
+
+        users = User.objects.select_related('wallet').in_bulk(
+            {payment['to_user'] for payment in payments},
+            field_name='username'
+        )
+        errors = [
+            {} if payment['to_user'] in users else {
+                'to_user': [f"User {payment['to_user']} doesn`t exist"]
+            }
+            for payment in payments
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return [
+            dict(payment, to_user=users[payment['to_user']])
+            for payment in payments
+        ]
+
+    def get_snapshot(self) -> Optional[RateSnapshot]:
+        """
+        Returns rates of passed quote
+        Raises:
+            InvalidQuoteException - if quote is broken or has expired
+        """
+        if 'quote' in self.validated_data:
+            return read_quote(self.validated_data['quote'])
+        return None
+
+
+class PaymentBatchSerializer(PaymentListSerializer):
+    """
+    Allow make many payments to users with one request
+    """
+
+    all_or_nothing = serializers.BooleanField(
+        default=True,
+        help_text='Make no payments if any of them fails'
+    )
+
+    def save(
+        self,
+        from_user: AbstractBaseUser
+    ) -> List[Union[Transaction, Exception]]:
+        """
+        Makes payments from user. Uses locked rates if quote has been passed
+        Raises:
+            InvalidQuoteException - if quote is broken or has expired
+            BatchPaymentException - in all-or-nothing mode if some payments
+                                    can`t be made
+        """
+        assert hasattr(self, '_errors'), (
+            'You must call `.is_valid()` before calling `.save()`.'
+        )
+
+        assert not self.errors, (
+            'You cannot call `.save()` on a serializer with invalid data.'
+        )
+
+        return make_payments(
+            [
+                Transfer(
+                    from_user,
+                    payment['to_user'],
+                    payment['amount'],
+                    payment['currency']
+                )
+                for payment in self.validated_data['payments']
+            ],
+            self.get_snapshot(),
+            self.validated_data['all_or_nothing']
+        )
+
+
+class PayoutSerializer(PaymentListSerializer):
+    """
+    Allow pay to many users at once with one debit of users wallet
+    """
+
+    def save(self, from_user: AbstractBaseUser) -> List[Transaction]:
+        """
+        Makes payout from user. Uses locked rates if quote has been passed
+        Raises:
+            InvalidQuoteException - if quote is broken or has expired
+            NotEnoughMoneyException - if user hasn`t got enough money for
+                                      all payments
+        """
+        assert hasattr(self, '_errors'), (
+            'You must call `.is_valid()` before calling `.save()`.'
+        )
+
+        assert not self.errors, (
+            'You cannot call `.save()` on a serializer with invalid data.'
+        )
+
+        return make_payout(
+            from_user,
+            [
+                (payment['to_user'], payment['amount'], payment['currency'])
+                for payment in self.validated_data['payments']
+            ],
+            self.get_snapshot()
         )
 
 
@@ -172,6 +373,11 @@ class TransactionSerializer(serializers.ModelSerializer):
         required=False,
         source='from_wallet.user.username'
     )
+    amount = serializers.DecimalField(
+        max_digits=None,
+        decimal_places=2,
+        read_only=True
+    )
 
     class Meta:
         model = Transaction
@@ -188,3 +394,30 @@ class TransactionSerializer(serializers.ModelSerializer):
             'currency',
             'from_user'
         ]
+
+
+class PaymentIntentSerializer(serializers.ModelSerializer):
+    to_user = serializers.CharField(
+        source='to_wallet.user.username'
+    )
+    amount = serializers.DecimalField(
+        max_digits=None,
+        decimal_places=2,
+        read_only=True
+    )
+    transaction = TransactionSerializer(allow_null=True)
+
+    class Meta:
+        model = PaymentIntent
+        fields = [
+            'id',
+            'status',
+            'to_user',
+            'amount',
+            'currency',
+            'error',
+            'transaction',
+            'created',
+            'modified'
+        ]
+        read_only_fields = fields
@@ -9,6 +9,7 @@ from billing_exness.billing.tests.factories import (
     ExchangeRateFactory
 )
 from billing_exness.billing.constants import EUR, USD
+from billing_exness.billing.quotes import make_quote
 from ..serializers import (
     CreateUserSerializer,
     ChargeSerializer,
@@ -177,3 +178,49 @@ class TestPaymentSerializer:
         assert transaction.currency == EUR
         assert transaction.from_wallet.pk == from_wallet.pk
         assert transaction.to_wallet.pk == to_wallet.pk
+
+    def test_make_payment_with_quote(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        token, _, _ = make_quote([EUR])
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=EUR)
+
+        from_wallet = WalletFactory.create(
+            amount=Decimal("60"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=EUR
+        )
+
+        serializer = PaymentSerializer(
+            data={
+                'to_user': to_wallet.user.get_username(),
+                'amount': Decimal('10'),
+                'currency': USD,
+                'quote': token
+            }
+        )
+
+        assert serializer.is_valid()
+        serializer.save(from_wallet.user)
+
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("20")
+
+    def test_make_payment_with_broken_quote(self):
+        from_wallet = WalletFactory.create(currency=USD)
+        to_wallet = WalletFactory.create(currency=USD)
+
+        serializer = PaymentSerializer(
+            data={
+                'to_user': to_wallet.user.get_username(),
+                'amount': Decimal('10'),
+                'currency': USD,
+                'quote': 'broken'
+            }
+        )
+
+        assert serializer.is_valid()
+        with pytest.raises(ValueError):
+            serializer.save(from_wallet.user)
@@ -6,10 +6,13 @@ from django.shortcuts import reverse
 from rest_framework.test import APIClient
 from rest_framework.settings import api_settings
 
-from billing_exness.billing.constants import EUR, CAD
+from billing_exness.billing.constants import USD, EUR, CAD
+from billing_exness.billing.models import PaymentIntent, Transaction
+from billing_exness.billing.utils import process_payment_intents
 from billing_exness.users.tests.factories import UserFactory
 from billing_exness.billing.tests.factories import (
     WalletFactory,
+    WalletShardFactory,
     ExchangeRateFactory
 )
 pytestmark = pytest.mark.django_db
@@ -94,6 +97,49 @@ class TestUsersWallet:
 
         assert response.status_code == 200
 
+    def test_hot_wallet(self):
+        wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+            shard_count=2
+        )
+        client = APIClient()
+        client.force_login(wallet.user)
+        etag = client.get(reverse('api_v1:users:wallet'))['ETag']
+
+        WalletShardFactory.create(wallet=wallet, amount=Decimal("5"))
+        response = client.get(
+            reverse('api_v1:users:wallet'),
+            HTTP_IF_NONE_MATCH=etag
+        )
+
+        assert response.status_code == 200
+        assert response.data['amount'] == "15.00"
+
+    def test_large_amounts(self):
+        wallet = WalletFactory.create(
+            amount=Decimal("123456789.12"),
+            currency=USD
+        )
+        client = APIClient()
+        client.force_login(wallet.user)
+
+        response = client.get(reverse('api_v1:users:wallet'))
+
+        assert response.status_code == 200
+        assert response.data['amount'] == "123456789.12"
+
+        response = client.put(
+            reverse('api_v1:users:wallet'),
+            {
+                'amount': "9876543210.00",
+                'currency': USD,
+            }
+        )
+
+        assert response.status_code == 200
+        assert response.data['amount'] == "9999999999.12"
+
     def test_wallet_charge_success(self):
         ExchangeRateFactory.create(
             rate=Decimal("2"),
@@ -123,6 +169,39 @@ class TestUsersWallet:
         assert response.data['amount'] == "11.00"
         assert response.data['currency'] == EUR
 
+    def test_wallet_not_modified(self):
+        wallet = WalletFactory.create()
+        client = APIClient()
+        client.force_login(wallet.user)
+
+        response = client.get(reverse('api_v1:users:wallet'))
+        assert response.status_code == 200
+
+        response = client.get(
+            reverse('api_v1:users:wallet'),
+            HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        assert response.status_code == 304
+
+    def test_wallet_modified_after_charge(self):
+        wallet = WalletFactory.create(currency=USD)
+        client = APIClient()
+        client.force_login(wallet.user)
+        etag = client.get(reverse('api_v1:users:wallet'))['ETag']
+
+        response = client.put(
+            reverse('api_v1:users:wallet'),
+            {'amount': 2, 'currency': USD}
+        )
+        assert response.status_code == 200
+
+        response = client.get(
+            reverse('api_v1:users:wallet'),
+            HTTP_IF_NONE_MATCH=etag
+        )
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
     def test_wallet_chrage_no_rate(self):
         wallet = WalletFactory.create(
             amount=Decimal("10"),
@@ -172,6 +251,26 @@ class TestPaymentApiView:
         assert response.status_code == 400
         assert api_settings.NON_FIELD_ERRORS_KEY in response.data
 
+    def test_payment_unknown_user(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=EUR
+        )
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payment'),
+            {
+                'to_user': 'unknown',
+                'amount': 5,
+                'currency': EUR,
+            }
+        )
+
+        assert response.status_code == 400
+        assert api_settings.NON_FIELD_ERRORS_KEY in response.data
+
     def test_payment_not_enough_money(self):
         ExchangeRateFactory.create(
             rate=Decimal("2"),
@@ -243,3 +342,555 @@ class TestPaymentApiView:
 
         for field in fields:
             assert field in response.data
+
+
+class TestPaymentBatchApiView:
+
+    def test_permission_denied(self):
+        client = APIClient()
+        response = client.post(reverse('api_v1:users:payment-batch'))
+
+        assert response.status_code == 401
+
+    def test_zero_amount(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payment-batch'),
+            {
+                'payments': [
+                    {
+                        'to_user': to_wallet.user.get_username(),
+                        'amount': 0,
+                        'currency': USD,
+                    }
+                ]
+            },
+            format='json'
+        )
+
+        assert response.status_code == 400
+        assert 'amount' in response.data['payments'][0]
+
+    def test_unknown_user(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payment-batch'),
+            {
+                'payments': [
+                    {
+                        'to_user': to_wallet.user.get_username(),
+                        'amount': 5,
+                        'currency': USD,
+                    },
+                    {
+                        'to_user': 'unknown',
+                        'amount': 5,
+                        'currency': USD,
+                    },
+                ]
+            },
+            format='json'
+        )
+
+        assert response.status_code == 400
+        assert not response.data['payments'][0]
+        assert 'to_user' in response.data['payments'][1]
+
+    def test_too_many_payments(self, settings):
+        settings.BILLING_PAYMENT_BATCH_SIZE = 1
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+        payment = {
+            'to_user': to_wallet.user.get_username(),
+            'amount': 5,
+            'currency': USD,
+        }
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payment-batch'),
+            {'payments': [payment, payment]},
+            format='json'
+        )
+
+        assert response.status_code == 400
+        assert 'payments' in response.data
+
+    def test_all_or_nothing(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("8"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+        payment = {
+            'to_user': to_wallet.user.get_username(),
+            'amount': 5,
+            'currency': USD,
+        }
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payment-batch'),
+            {'payments': [payment, payment]},
+            format='json'
+        )
+
+        assert response.status_code == 400
+        assert api_settings.NON_FIELD_ERRORS_KEY in response.data
+        assert not response.data['payments'][0]
+        assert api_settings.NON_FIELD_ERRORS_KEY in \
+            response.data['payments'][1]
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("0")
+
+    def test_skip_failed(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("8"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+        payment = {
+            'to_user': to_wallet.user.get_username(),
+            'amount': 5,
+            'currency': USD,
+        }
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payment-batch'),
+            {'payments': [payment, payment], 'all_or_nothing': False},
+            format='json'
+        )
+
+        assert response.status_code == 201
+        first, second = response.data['payments']
+        assert first['to_user'] == to_wallet.user.get_username()
+        assert first['from_user'] == from_wallet.user.get_username()
+        assert api_settings.NON_FIELD_ERRORS_KEY in second
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("5")
+
+    def test_success(self, django_assert_max_num_queries):
+        ExchangeRateFactory.create(
+            rate=Decimal("2"),
+            currency=EUR
+        )
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallets = WalletFactory.create_batch(
+            10,
+            amount=Decimal("0"),
+            currency=EUR
+        )
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        with django_assert_max_num_queries(15):
+            response = client.post(
+                reverse('api_v1:users:payment-batch'),
+                {
+                    'payments': [
+                        {
+                            'to_user': wallet.user.get_username(),
+                            'amount': 2,
+                            'currency': EUR,
+                        }
+                        for wallet in to_wallets
+                    ]
+                },
+                format='json'
+            )
+
+        assert response.status_code == 201
+        assert len(response.data['payments']) == 10
+        from_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("90")
+        for wallet in to_wallets:
+            wallet.refresh_from_db()
+            assert wallet.amount == Decimal("2")
+
+
+class TestPayoutApiView:
+
+    def test_zero_amount(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("8"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payout'),
+            {
+                'payments': [
+                    {
+                        'to_user': to_wallet.user.get_username(),
+                        'amount': 0,
+                        'currency': USD,
+                    }
+                ]
+            },
+            format='json'
+        )
+
+        assert response.status_code == 400
+        assert 'amount' in response.data['payments'][0]
+
+    def test_not_enough_money(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("8"),
+            currency=USD
+        )
+        to_wallets = WalletFactory.create_batch(2, currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payout'),
+            {
+                'payments': [
+                    {
+                        'to_user': wallet.user.get_username(),
+                        'amount': 5,
+                        'currency': USD,
+                    }
+                    for wallet in to_wallets
+                ]
+            },
+            format='json'
+        )
+
+        assert response.status_code == 400
+        assert api_settings.NON_FIELD_ERRORS_KEY in response.data
+
+    def test_success(self):
+        ExchangeRateFactory.create(
+            rate=Decimal("2"),
+            currency=EUR
+        )
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallets = WalletFactory.create_batch(
+            10,
+            amount=Decimal("0"),
+            currency=EUR
+        )
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = client.post(
+            reverse('api_v1:users:payout'),
+            {
+                'payments': [
+                    {
+                        'to_user': wallet.user.get_username(),
+                        'amount': 2,
+                        'currency': EUR,
+                    }
+                    for wallet in to_wallets
+                ]
+            },
+            format='json'
+        )
+
+        assert response.status_code == 201
+        assert len(response.data['payments']) == 10
+        from_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("90")
+        for wallet in to_wallets:
+            wallet.refresh_from_db()
+            assert wallet.amount == Decimal("2")
+
+
+class TestIdempotentRequests:
+
+    def pay(self, client, to_user, amount, key='payment-1'):
+        return client.post(
+            reverse('api_v1:users:payment'),
+            {
+                'to_user': to_user.get_username(),
+                'amount': amount,
+                'currency': USD,
+            },
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_replay_payment(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        first = self.pay(client, to_wallet.user, 5)
+        second = self.pay(client, to_wallet.user, 5)
+
+        assert first.status_code == 201
+        assert second.status_code == 201
+        assert second.data == first.data
+        assert second['Idempotent-Replayed'] == 'true'
+        assert Transaction.objects.count() == 1
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("5")
+
+    def test_replay_async_payment(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        first, second = [
+            client.post(
+                reverse('api_v1:users:payment'),
+                {
+                    'to_user': to_wallet.user.get_username(),
+                    'amount': 5,
+                    'currency': USD,
+                },
+                HTTP_IDEMPOTENCY_KEY='payment-1',
+                HTTP_PREFER='respond-async'
+            )
+            for _ in range(2)
+        ]
+
+        assert second.status_code == 202
+        assert second['Idempotent-Replayed'] == 'true'
+        assert second['Location'] == first['Location']
+        assert second['Preference-Applied'] == 'respond-async'
+        assert PaymentIntent.objects.count() == 1
+
+    def test_replay_failed_payment(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        first = self.pay(client, to_wallet.user, 5)
+        from_wallet.amount = Decimal("10")
+        from_wallet.save()
+        second = self.pay(client, to_wallet.user, 5)
+
+        assert first.status_code == 400
+        assert second.status_code == 400
+        assert not Transaction.objects.exists()
+
+    def test_key_of_another_request(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        self.pay(client, to_wallet.user, 5)
+        response = self.pay(client, to_wallet.user, 6)
+
+        assert response.status_code == 422
+        assert Transaction.objects.count() == 1
+
+    def test_keys_of_different_users(self):
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+        for from_wallet in WalletFactory.create_batch(
+            2,
+            amount=Decimal("100"),
+            currency=USD
+        ):
+            client = APIClient()
+            client.force_login(from_wallet.user)
+            assert self.pay(client, to_wallet.user, 5).status_code == 201
+
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("10")
+
+    # DRF marks outer transaction of test for rollback on validation error
+    # of non-atomic view
+    @pytest.mark.django_db(transaction=True)
+    def test_invalid_request_isnt_stored(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = self.pay(client, to_wallet.user, 'wrong')
+        assert response.status_code == 400
+
+        response = self.pay(client, to_wallet.user, 'wrong')
+        assert response.status_code == 400
+        assert 'Idempotent-Replayed' not in response
+
+    def test_too_long_key(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = self.pay(client, to_wallet.user, 5, key='k' * 256)
+
+        assert response.status_code == 400
+        assert not Transaction.objects.exists()
+
+    def test_replay_charge(self):
+        wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD
+        )
+
+        client = APIClient()
+        client.force_login(wallet.user)
+        for _ in range(2):
+            response = client.put(
+                reverse('api_v1:users:wallet'),
+                {
+                    'amount': 2,
+                    'currency': USD,
+                },
+                HTTP_IDEMPOTENCY_KEY='charge-1'
+            )
+            assert response.status_code == 200
+            assert response.data['amount'] == "12.00"
+
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("12")
+
+
+class TestAsyncPayment:
+
+    def pay(self, client, to_user, amount):
+        return client.post(
+            reverse('api_v1:users:payment'),
+            {
+                'to_user': to_user,
+                'amount': amount,
+                'currency': USD,
+            },
+            HTTP_PREFER='respond-async'
+        )
+
+    def test_accepted(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = self.pay(client, to_wallet.user.get_username(), 4)
+
+        assert response.status_code == 202
+        assert response['Preference-Applied'] == 'respond-async'
+        assert response.data['status'] == 'pending'
+        assert response.data['transaction'] is None
+        assert not Transaction.objects.exists()
+
+        process_payment_intents(10)
+        response = client.get(response['Location'])
+
+        assert response.status_code == 200
+        assert response.data['status'] == 'succeeded'
+        assert response.data['transaction']['amount'] == "4.00"
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("4")
+
+    def test_failed(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = self.pay(client, to_wallet.user.get_username(), 4)
+        assert response.status_code == 202
+
+        process_payment_intents(10)
+        response = client.get(response['Location'])
+
+        assert response.data['status'] == 'failed'
+        assert response.data['error']
+
+    def test_unknown_user(self):
+        from_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        response = self.pay(client, 'unknown', 4)
+
+        assert response.status_code == 400
+        assert api_settings.NON_FIELD_ERRORS_KEY in response.data
+
+    def test_intent_of_another_user(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        client = APIClient()
+        client.force_login(from_wallet.user)
+        location = self.pay(client, to_wallet.user.get_username(), 4)[
+            'Location'
+        ]
+
+        client.force_login(to_wallet.user)
+        assert client.get(location).status_code == 404
@@ -6,6 +6,9 @@ from .views import (
     UserMeApiView,
     WalletApiView,
     PaymentApiView,
+    PaymentIntentApiView,
+    PaymentBatchApiView,
+    PayoutApiView,
     TransactionListApiView
 )
 
@@ -15,6 +18,11 @@ urlpatterns = [
     path("me/", UserMeApiView.as_view(), name='me'),
     path("me/wallet/", WalletApiView.as_view(), name="wallet"),
     path("me/payment/", PaymentApiView.as_view(), name="payment"),
+    path("me/payment/intents/<int:pk>/", PaymentIntentApiView.as_view(),
+         name="payment-intent"),
+    path("me/payment/batch/", PaymentBatchApiView.as_view(),
+         name="payment-batch"),
+    path("me/payout/", PayoutApiView.as_view(), name="payout"),
     path("me/transactions/", TransactionListApiView.as_view(),
          name="transactions"),
 ]
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
-from django.shortcuts import Http404
+from datetime import datetime
+from typing import Optional, Tuple
+
+from django.shortcuts import Http404, reverse
 
 from django.contrib.auth.models import AbstractBaseUser
 from rest_framework import generics
@@ -10,17 +13,28 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework_csv import renderers as r
 
 from billing_exness.openapi.schema import SecurityRequiredSchema
-from billing_exness.billing.models import Wallet, Transaction
-from billing_exness.billing.exceptions import NotEnoughMoneyException
+from billing_exness.billing.models import Wallet, Transaction, PaymentIntent
+from billing_exness.billing.exceptions import (
+    NotEnoughMoneyException,
+    BatchPaymentException
+)
 from .serializers import (
     CreateUserSerializer,
     UserSerializer,
     WalletSerializer,
     ChargeSerializer,
     PaymentSerializer,
+    PaymentIntentSerializer,
+    PaymentBatchSerializer,
+    PayoutSerializer,
     TransactionSerializer
 )
 from .filters import TransactionFilter
+from ..mixins import (
+    ConditionalRetrieveMixin,
+    IdempotentRequestsMixin,
+    NonAtomicRequestsMixin
+)
 
 
 class CreateUserApiView(generics.CreateAPIView):
@@ -52,7 +66,12 @@ class UserMeApiView(generics.RetrieveAPIView):
         return self.request.user
 
 
-class WalletApiView(generics.RetrieveUpdateAPIView):
+class WalletApiView(
+    IdempotentRequestsMixin,
+    NonAtomicRequestsMixin,
+    ConditionalRetrieveMixin,
+    generics.RetrieveUpdateAPIView
+):
 
     serializer_class = WalletSerializer
     charge_serializer_class = ChargeSerializer
@@ -65,6 +84,14 @@ class WalletApiView(generics.RetrieveUpdateAPIView):
         except Wallet.DoesNotExist:
             raise Http404()
 
+    def get_validators(
+        self,
+        instance: Wallet
+    ) -> Tuple[Optional[str], Optional[datetime]]:
+        last_modified = instance.last_modified
+        modified = int(last_modified.timestamp() * 1000000)
+        return f'wallet-{instance.pk}-{modified}', last_modified
+
     def get_serializer(self, instance=None, data=None, **kwargs):
         """
         Uses ChargeSerializer if update data passes
@@ -96,7 +123,11 @@ class WalletApiView(generics.RetrieveUpdateAPIView):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class PaymentApiView(generics.CreateAPIView):
+class PaymentApiView(
+    IdempotentRequestsMixin,
+    NonAtomicRequestsMixin,
+    generics.CreateAPIView
+):
 
     serializer_class = PaymentSerializer
     permission_classes = [
@@ -107,9 +138,45 @@ class PaymentApiView(generics.CreateAPIView):
     def perform_create(self, serializer: PaymentSerializer) -> Transaction:
         return serializer.save(self.request.user)
 
+    def is_async(self, request) -> bool:
+        """
+        Checks that client prefers asynchronous processing of payment
+        """
+        preferences = request.headers.get('Prefer', '')
+        return 'respond-async' in [
+            preference.strip().lower()
+            for preference in preferences.split(',')
+        ]
+
+    def create_async(self, serializer: PaymentSerializer) -> Response:
+        """
+        Enqueues payment and responds with its intent
+        """
+        try:
+            intent = serializer.enqueue(self.request.user)
+        except ValueError as e:
+            return Response(
+                {api_settings.NON_FIELD_ERRORS_KEY: str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            PaymentIntentSerializer(intent).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={
+                'Location': reverse(
+                    'api_v1:users:payment-intent',
+                    kwargs={'pk': intent.pk}
+                ),
+                'Preference-Applied': 'respond-async',
+            }
+        )
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if self.is_async(request):
+            return self.create_async(serializer)
         try:
             transaction = self.perform_create(serializer)
         except (ValueError, NotEnoughMoneyException) as e:
@@ -127,6 +194,124 @@ class PaymentApiView(generics.CreateAPIView):
             )
 
 
+class PaymentIntentApiView(generics.RetrieveAPIView):
+    """
+    Shows status of payment that has been accepted asynchronously
+    """
+
+    serializer_class = PaymentIntentSerializer
+    permission_classes = [IsAuthenticated]
+    schema = SecurityRequiredSchema()
+
+    def get_queryset(self):
+        return PaymentIntent.objects.filter(
+            from_wallet__user=self.request.user
+        ).select_related(
+            'to_wallet__user',
+            'transaction__from_wallet__user',
+            'transaction__to_wallet__user'
+        )
+
+
+class PaymentBatchApiView(
+    IdempotentRequestsMixin,
+    NonAtomicRequestsMixin,
+    generics.CreateAPIView
+):
+    """
+    Makes many payments with one request. Responds with result of every
+    payment in order of passed payments
+    """
+
+    serializer_class = PaymentBatchSerializer
+    permission_classes = [
+        IsAuthenticated
+    ]
+    schema = SecurityRequiredSchema()
+
+    def perform_create(self, serializer: PaymentBatchSerializer) -> list:
+        return serializer.save(self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            results = self.perform_create(serializer)
+        except BatchPaymentException as e:
+            count = len(serializer.validated_data['payments'])
+            return Response(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [str(e)],
+                    'payments': [
+                        self.get_error_data(e.errors[i]) if i in e.errors
+                        else {}
+                        for i in range(count)
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except ValueError as e:
+            return Response(
+                {api_settings.NON_FIELD_ERRORS_KEY: str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            {
+                'payments': [
+                    self.get_error_data(result)
+                    if isinstance(result, Exception)
+                    else TransactionSerializer(result).data
+                    for result in results
+                ]
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+    def get_error_data(self, error: Exception) -> dict:
+        return {api_settings.NON_FIELD_ERRORS_KEY: [str(error)]}
+
+
+class PayoutApiView(
+    IdempotentRequestsMixin,
+    NonAtomicRequestsMixin,
+    generics.CreateAPIView
+):
+    """
+    Pays to many users at once. All payments are made or none of them
+    """
+
+    serializer_class = PayoutSerializer
+    permission_classes = [
+        IsAuthenticated
+    ]
+    schema = SecurityRequiredSchema()
+
+    def perform_create(self, serializer: PayoutSerializer) -> list:
+        return serializer.save(self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            transactions = self.perform_create(serializer)
+        except (ValueError, NotEnoughMoneyException) as e:
+            return Response(
+                {api_settings.NON_FIELD_ERRORS_KEY: str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            {
+                'payments': TransactionSerializer(
+                    transactions,
+                    many=True
+                ).data
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+
 class TransactionListApiView(generics.ListAPIView):
 
     serializer_class = TransactionSerializer
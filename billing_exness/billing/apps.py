@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 
 class BillingConfig(AppConfig):
-    name = 'billing'
+    name = 'billing_exness.billing'
+
+    def ready(self):
+        import billing_exness.billing.signals  # noqa F401
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
+
 USD = 'USD'
 EUR = 'EUR'
 CAD = 'CAD'
@@ -8,8 +10,25 @@ BASE_CURRENCY = USD
 
 CURRENCIES = [USD, EUR, CAD, CNY]
 
+# amounts are stored as minor units in bigint column, which always fits
+# 18 digits
+AMOUNT_MAX_DIGITS = 18
+
 EXCHANGE_CURRENCIES = [
     currency
     for currency in CURRENCIES
     if currency != BASE_CURRENCY
 ]
+
+MINUTE = 'minute'
+HOUR = 'hour'
+DAY = 'day'
+
+OHLC_BUCKETS = [MINUTE, HOUR, DAY]
+
+# buckets are truncated in UTC(TIME_ZONE), so they have got fixed width
+OHLC_BUCKET_WIDTHS = {
+    MINUTE: timedelta(minutes=1),
+    HOUR: timedelta(hours=1),
+    DAY: timedelta(days=1),
+}
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+# serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = {'40001', '40P01'}
+
+
+class RetryStats:
+    """
+    Counters of retried billing transactions
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.exhausted = 0
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def gave_up(self):
+        with self._lock:
+            self.exhausted += 1
+
+    def clear(self):
+        with self._lock:
+            self.retries = 0
+            self.exhausted = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'retries': self.retries,
+            'exhausted': self.exhausted,
+        }
+
+
+retry_stats = RetryStats()
+
+
+def is_retryable(error: DatabaseError) -> bool:
+    """
+    Checks that transaction has been aborted by serialization failure or
+    deadlock, so it could succeed if it is run again
+    """
+    return getattr(error.__cause__, 'pgcode', None) in RETRYABLE_PGCODES
+
+
+def retry_atomic(func: Callable) -> Callable:
+    """
+    Runs function in transaction like `transaction.atomic` and reruns it
+    when transaction has been aborted by serialization failure or deadlock.
+    Makes at most `BILLING_RETRY_ATTEMPTS` attempts and waits for random
+    time up to exponentially growing delay between them.
+    Function called inside outer transaction isn`t retried, because only
+    outer transaction could be rerun. So views that make billing operations
+    shouldn`t be atomic.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if connection.in_atomic_block:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+
+        attempts = settings.BILLING_RETRY_ATTEMPTS
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except DatabaseError as e:
+                if not is_retryable(e):
+                    raise
+                if attempt + 1 >= attempts:
+                    retry_stats.gave_up()
+                    raise
+                retry_stats.retried()
+                delay = min(
+                    settings.BILLING_RETRY_BASE_DELAY * 2 ** attempt,
+                    settings.BILLING_RETRY_MAX_DELAY
+                )
+                time.sleep(random.uniform(0, delay))
+
+    return wrapper
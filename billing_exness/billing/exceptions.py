@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from typing import Dict
+
 from .constants import CURRENCIES
 
 
@@ -9,6 +11,27 @@ class NotEnoughMoneyException(Exception):
     pass
 
 
+class BatchPaymentException(Exception):
+    """
+    Raise exception when some payments of all-or-nothing batch can't be made
+    """
+
+    def __init__(self, errors: Dict[int, Exception]):
+        """
+        Params:
+            errors - errors of failed payments by their index in batch
+        """
+        super().__init__(f"{len(errors)} payments of batch can`t be made")
+        self.errors = errors
+
+
+class InvalidQuoteException(ValueError):
+    """
+    Raise exception when quote token is broken or expired
+    """
+    pass
+
+
 def check_currency(currency: str):
     """
     Checks that currency is available for us
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from .money import from_minor, to_minor
+
+
+class MinorUnitsField(models.BigIntegerField):
+    """
+    Stores decimal amount as integer count of minor units(e.g. cents), so
+    db compares and sums amounts as integers. Python value of field is
+    `Decimal` with `decimal_places` digits after point, values with more
+    digits are rounded half up.
+    Expressions with plain `Decimal` operands are computed by db with raw
+    values, so operands should be wrapped in `Value` with this field as
+    `output_field`.
+    """
+    description = _("Decimal number stored as integer minor units")
+
+    def __init__(self, *args, decimal_places: int = 2, **kwargs):
+        self.decimal_places = decimal_places
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['decimal_places'] = self.decimal_places
+        return name, path, args, kwargs
+
+    @cached_property
+    def validators(self):
+        # range of BIGINT limits minor units, not decimal value
+        return [*self.default_validators, *self._validators]
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return from_minor(value, self.decimal_places)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            if isinstance(value, float):
+                value = str(value)
+            return Decimal(value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise exceptions.ValidationError(
+                _("'%(value)s' value must be a decimal number."),
+                code='invalid',
+                params={'value': value},
+            )
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return to_minor(self.to_python(value), self.decimal_places)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField,
+            'decimal_places': self.decimal_places,
+            **kwargs,
+        })
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from typing import List
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from billing_exness.billing.models import Transaction
+from billing_exness.billing.rates import RateSnapshot
+from billing_exness.billing.utils import apply_rates
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills debit, credit and applied rate of transactions made before "
+        "they were stored, with rates that were in force at creation of "
+        "every transaction. Transactions without such rates are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = Transaction.objects.with_rates().filter(
+            to_amount__isnull=True
+        ).select_related('from_wallet', 'to_wallet').order_by('pk')
+
+        filled, skipped, last_pk = 0, 0, 0
+        while True:
+            batch = list(
+                rows.filter(pk__gt=last_pk)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            done = self.fill(batch)
+            with transaction.atomic():
+                Transaction.objects.bulk_update(
+                    done,
+                    ['from_amount', 'to_amount', 'rate']
+                )
+            filled += len(done)
+            skipped += len(batch) - len(done)
+
+        self.stdout.write(
+            f"Filled {filled} transactions, skipped {skipped}"
+        )
+
+    def fill(self, batch: List[Transaction]) -> List[Transaction]:
+        """
+        Applies historical rates to batch. Rates are loaded with batch by
+        correlated subqueries, NULL rate means that it hasn`t been set at
+        creation of transaction.
+        Returns:
+            list - transactions which rates have been found
+        """
+        done = []
+        for row in batch:
+            rates = {
+                row.currency: row.currency_rate,
+                row.to_wallet.currency: row.to_wallet_rate,
+            }
+            if row.from_wallet is not None:
+                rates[row.from_wallet.currency] = row.from_wallet_rate
+            if None in rates.values():
+                continue
+            done.append(apply_rates(row, RateSnapshot(rates)))
+        return done
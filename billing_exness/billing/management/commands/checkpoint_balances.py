@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from typing import List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from billing_exness.billing.models import (
+    BalanceCheckpoint,
+    LedgerEntry,
+    Wallet
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Stores balance checkpoints of wallets that have got ledger entries "
+        "after their latest checkpoint. Entries newer than "
+        "`BILLING_CHECKPOINT_LAG` seconds are left for next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        at = timezone.now() - timedelta(seconds=settings.BILLING_CHECKPOINT_LAG)
+        pks = list(
+            Wallet.objects.order_by('pk').values_list('pk', flat=True)
+        )
+
+        created = 0
+        for start in range(0, len(pks), options['batch_size']):
+            batch = pks[start:start + options['batch_size']]
+            with transaction.atomic():
+                created += self.checkpoint(batch, at)
+
+        self.stdout.write(f"Created {created} balance checkpoints")
+
+    def checkpoint(self, pks: List[int], at: datetime) -> int:
+        """
+        Stores checkpoints at `at` moment of passed wallets with new entries
+        with one statement
+        """
+        checkpoints = BalanceCheckpoint.objects.filter(
+            created__lte=at
+        ).order_by('-created')
+        latest = checkpoints.filter(wallet=OuterRef('wallet'))
+        totals = dict(
+            LedgerEntry.objects.filter(
+                wallet__in=pks,
+                created__lte=at
+            ).annotate(
+                since=Subquery(latest.values('created')[:1])
+            ).filter(
+                Q(since__isnull=True) | Q(created__gt=F('since'))
+            ).order_by().values('wallet').annotate(
+                total=Sum('amount')
+            ).values_list('wallet', 'total')
+        )
+        if not totals:
+            return 0
+
+        previous = dict(
+            Wallet.objects.filter(pk__in=totals).annotate(
+                previous=Subquery(
+                    checkpoints.filter(
+                        wallet=OuterRef('pk')
+                    ).values('amount')[:1]
+                )
+            ).values_list('pk', 'previous')
+        )
+        BalanceCheckpoint.objects.bulk_create([
+            BalanceCheckpoint(
+                wallet_id=pk,
+                amount=(previous[pk] or 0) + total,
+                created=at
+            )
+            for pk, total in totals.items()
+        ])
+        return len(totals)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from billing_exness.billing.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes idempotency keys that are older than "
+        "`BILLING_IDEMPOTENCY_KEY_TTL` seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(
+            created__lt=timezone.now() - timedelta(
+                seconds=settings.BILLING_IDEMPOTENCY_KEY_TTL
+            )
+        ).order_by('pk')
+
+        deleted = 0
+        while True:
+            pks = list(
+                expired.values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                IdempotencyKey.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+
+        self.stdout.write(f"Deleted {deleted} idempotency keys")
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Set
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
+
+from billing_exness.billing.constants import EXCHANGE_CURRENCIES
+from billing_exness.billing.models import (
+    ExchangeRate,
+    CurrentRate,
+    Transaction
+)
+
+
+def hour_of(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_of(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class Command(BaseCommand):
+    help = (
+        "Downsamples exchange rate history: keeps every rate for "
+        "`--raw-days`, then latest rate of every hour for `--hourly-days`, "
+        "then latest rate of every day. Rates that were in force at "
+        "creation of any transaction are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-days', type=int, default=7)
+        parser.add_argument('--hourly-days', type=int, default=90)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        assert options['raw_days'] <= options['hourly_days']
+        now = timezone.now()
+        raw_since = now - timedelta(days=options['raw_days'])
+        hourly_since = now - timedelta(days=options['hourly_days'])
+
+        current = set(
+            CurrentRate.objects.values_list('exchange_rate_id', flat=True)
+        )
+        batch: List[int] = []
+        deleted = 0
+
+        for currency in EXCHANGE_CURRENCIES:
+            outdated = list(
+                self.get_outdated(currency, raw_since, hourly_since)
+            )
+            for pk in outdated:
+                if pk in current:
+                    continue
+                batch.append(pk)
+                if len(batch) >= options['batch_size']:
+                    deleted += self.delete(batch, options['dry_run'])
+                    batch = []
+
+        deleted += self.delete(batch, options['dry_run'])
+        self.stdout.write(f"Deleted {deleted} exchange rates")
+
+    def get_used(self, pks: List[int]) -> Set[int]:
+        """
+        Returns ids of passed rates that were in force at creation of any
+        transaction. Transactions of currency of every rate are looked up
+        by indexes between creation of the rate and of the next one.
+        """
+        following = ExchangeRate.objects.filter(
+            currency=OuterRef('currency'),
+            created__gt=OuterRef('created')
+        ).order_by('created').values('created')[:1]
+        rates = ExchangeRate.objects.filter(pk__in=pks).annotate(
+            replaced=Subquery(following)
+        )
+
+        used: Set[int] = set()
+        for currency in [
+            'currency',
+            'from_wallet__currency',
+            'to_wallet__currency'
+        ]:
+            transactions = Transaction.objects.filter(
+                created__gte=OuterRef('created'),
+                created__lt=OuterRef('replaced'),
+                **{currency: OuterRef('currency')}
+            )
+            used.update(
+                rates.exclude(pk__in=used).annotate(
+                    used=Exists(transactions)
+                ).filter(used=True).values_list('pk', flat=True)
+            )
+        return used
+
+    def get_outdated(
+        self,
+        currency: str,
+        raw_since: datetime,
+        hourly_since: datetime
+    ) -> Iterator[int]:
+        """
+        Yields ids of rates that aren`t latest in their bucket
+        """
+        rates = ExchangeRate.objects.filter(
+            currency=currency,
+            created__lt=raw_since
+        ).order_by('created').values_list('pk', 'created')
+
+        previous_pk: Optional[int] = None
+        previous_bucket: Optional[datetime] = None
+        for pk, created in rates.iterator():
+            bucket = day_of(created) if created < hourly_since \
+                else hour_of(created)
+            if previous_pk is not None and bucket == previous_bucket:
+                yield previous_pk
+            previous_pk, previous_bucket = pk, bucket
+
+    def delete(self, pks: List[int], dry_run: bool) -> int:
+        """
+        Deletes rates of batch that haven't been in force at creation of
+        any transaction
+        Returns:
+            int - count of deleted rates
+        """
+        if not pks:
+            return 0
+        pks = list(set(pks) - self.get_used(pks))
+        if dry_run or not pks:
+            return len(pks)
+
+        with transaction.atomic():
+            ExchangeRate.objects.filter(pk__in=pks).delete()
+        return len(pks)
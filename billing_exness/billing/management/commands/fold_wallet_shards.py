@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from billing_exness.billing.models import Wallet
+from billing_exness.billing.utils import fold_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves money of wallet shards back to wallet rows. Every wallet is "
+        "folded in its own transaction, so credits of other wallets aren`t "
+        "blocked"
+    )
+
+    def handle(self, *args, **options):
+        pks = Wallet.objects.filter(
+            shards__amount__gt=0
+        ).order_by('pk').values_list('pk', flat=True).distinct()
+
+        folded, total = 0, Decimal("0")
+        for pk in list(pks):
+            with transaction.atomic():
+                total += fold_shards(Wallet.objects.get(pk=pk))
+            folded += 1
+
+        self.stdout.write(f"Folded shards of {folded} wallets ({total})")
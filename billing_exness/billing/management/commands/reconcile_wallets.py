@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from billing_exness.billing.models import (
+    ReconciliationMark,
+    Transaction,
+    Wallet,
+    WalletDiscrepancy,
+    WalletShard
+)
+
+
+class Balance(NamedTuple):
+    """
+    Balance of wallet computed from transactions and the real one
+    """
+    until: Decimal
+    expected: Decimal
+    actual: Decimal
+    # all transactions since mark have got amounts
+    complete: bool
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares balances of wallets with sums of their transactions. "
+        "Every wallet keeps high-water mark, so every run reads only "
+        "transactions created since previous one. Mismatches are checked "
+        "again with locked wallets and stored as discrepancies. Wallets "
+        "which transactions haven`t got amounts are skipped without moving "
+        "their marks, fill them by `backfill_transaction_amounts` first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        until = timezone.now() - timedelta(
+            seconds=settings.BILLING_CHECKPOINT_LAG
+        )
+
+        checked, found, skipped, last_pk = 0, 0, 0, 0
+        while True:
+            pks = list(
+                Wallet.objects.filter(
+                    pk__gt=last_pk
+                ).order_by('pk').values_list('pk', flat=True)[
+                    :options['chunk_size']
+                ]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+
+            chunk_found, chunk_skipped = self.reconcile(pks, until)
+            found += chunk_found
+            skipped += chunk_skipped
+            checked += len(pks)
+
+        self.stdout.write(
+            f"Reconciled {checked} wallets, found {found} discrepancies, "
+            f"skipped {skipped}"
+        )
+
+    def reconcile(self, pks: List[int], until: datetime) -> Tuple[int, int]:
+        """
+        Reconciles chunk of wallets and moves their marks to `until`.
+        Wallets with transactions without amounts keep their marks, so
+        these transactions are summed once they are backfilled.
+        Returns:
+            tuple - count of found discrepancies and skipped wallets
+        """
+        marks = ReconciliationMark.objects.in_bulk(pks)
+        balances = self.compute(pks, marks, until)
+        mismatched = [
+            pk for pk, balance in balances.items()
+            if balance.complete and balance.expected != balance.actual
+        ]
+
+        with transaction.atomic():
+            if mismatched:
+                # concurrent payment could change wallet between queries
+                balances.update(
+                    self.compute(mismatched, marks, until, lock=True)
+                )
+                WalletDiscrepancy.objects.bulk_create([
+                    WalletDiscrepancy(
+                        wallet_id=pk,
+                        expected=balances[pk].expected,
+                        actual=balances[pk].actual
+                    )
+                    for pk in mismatched
+                    if balances[pk].complete
+                    and balances[pk].expected != balances[pk].actual
+                ])
+
+            incomplete = {
+                pk for pk, balance in balances.items() if not balance.complete
+            }
+            marks = {
+                pk: mark for pk, mark in marks.items() if pk not in incomplete
+            }
+            for pk, mark in marks.items():
+                mark.amount = balances[pk].until
+                mark.created = until
+            ReconciliationMark.objects.bulk_update(
+                marks.values(),
+                ['amount', 'created']
+            )
+            ReconciliationMark.objects.bulk_create([
+                ReconciliationMark(
+                    wallet_id=pk,
+                    amount=balances[pk].until,
+                    created=until
+                )
+                for pk in pks if pk not in marks and pk not in incomplete
+            ])
+
+        found = sum(
+            balances[pk].complete
+            and balances[pk].expected != balances[pk].actual
+            for pk in mismatched
+        )
+        return found, len(incomplete)
+
+    def compute(
+        self,
+        pks: List[int],
+        marks: Dict[int, ReconciliationMark],
+        until: datetime,
+        lock: bool = False
+    ) -> Dict[int, Balance]:
+        """
+        Computes balances of wallets from their marks and transactions
+        created after them. Transactions of wallets that were marked at the
+        same moment are summed with two queries.
+        Params:
+            pks - primary keys of wallets
+            marks - latest marks of wallets
+            until - moment of new marks
+            lock - locks wallets and their shards before reading them,
+                   should be called inside transaction
+        """
+        wallets = Wallet.objects.filter(pk__in=pks).order_by('pk')
+        shards = WalletShard.objects.filter(
+            wallet__in=pks
+        ).order_by('wallet', 'index')
+        if lock:
+            # wallet rows are locked before shards as in `fold_shards`
+            wallets = wallets.select_for_update()
+            shards = shards.select_for_update()
+        actual = defaultdict(Decimal, wallets.values_list('pk', 'amount'))
+        for wallet, amount in shards.values_list('wallet', 'amount'):
+            actual[wallet] += amount
+
+        groups: Dict[Optional[datetime], List[int]] = defaultdict(list)
+        for pk in pks:
+            groups[marks[pk].created if pk in marks else None].append(pk)
+
+        before: Dict[int, Decimal] = defaultdict(Decimal)
+        after: Dict[int, Decimal] = defaultdict(Decimal)
+        incomplete = set()
+        for since, group in groups.items():
+            for wallet, field, sign in [
+                ('to_wallet', 'to_amount', 1),
+                ('from_wallet', 'from_amount', -1),
+            ]:
+                rows = Transaction.objects.filter(**{f'{wallet}__in': group})
+                if since is not None:
+                    rows = rows.filter(created__gt=since)
+                totals = rows.order_by().values(wallet).annotate(
+                    before=Sum(field, filter=Q(created__lte=until)),
+                    total=Sum(field),
+                    missing=Count('pk', filter=Q(**{f'{field}__isnull': True}))
+                ).values_list(wallet, 'before', 'total', 'missing')
+                for pk, until_total, total, missing in totals:
+                    before[pk] += sign * (until_total or 0)
+                    after[pk] += sign * ((total or 0) - (until_total or 0))
+                    if missing:
+                        incomplete.add(pk)
+
+        balances = {}
+        for pk in pks:
+            opening = marks[pk].amount if pk in marks else Decimal("0")
+            balances[pk] = Balance(
+                until=opening + before[pk],
+                expected=opening + before[pk] + after[pk],
+                actual=actual[pk],
+                complete=pk not in incomplete
+            )
+        return balances
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+import json
+import multiprocessing
+import os
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import (
+    Count,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum
+)
+from django.utils import timezone
+
+from billing_exness.billing.models import (
+    BalanceCheckpoint,
+    Transaction,
+    Wallet,
+    WalletDiscrepancy,
+    WalletShard
+)
+
+Range = Tuple[int, int]
+Result = Tuple[int, int, int, List[int]]
+
+
+def init_worker():
+    """
+    Prepares pool process: configures django for spawned processes and drops
+    connections inherited from parent, so every process opens its own one
+    """
+    django.setup()
+    connections.close_all()
+
+
+class Balance(NamedTuple):
+    """
+    Balance of wallet rebuilt from its history and the real one
+    """
+    expected: Decimal
+    actual: Decimal
+    # all transactions since opening balance have got amounts
+    complete: bool
+
+
+def rebuild(lookups: Dict[str, Any], lock: bool) -> Dict[int, Balance]:
+    """
+    Rebuilds balances of wallets from their opening checkpoints(the
+    earliest ones) and transactions created after them. Wallets without
+    checkpoints are opened with 0.
+    Params:
+        lookups - conditions of primary keys of wallets, e.g. {'in': [1]}
+        lock - locks wallets and their shards, should be called inside
+               transaction
+    """
+    def where(field: str) -> Dict[str, Any]:
+        return {
+            f'{field}__{lookup}': value for lookup, value in lookups.items()
+        }
+
+    opening = BalanceCheckpoint.objects.order_by('created')
+    wallets = Wallet.objects.filter(**where('pk')).annotate(
+        opening=Subquery(
+            opening.filter(wallet=OuterRef('pk')).values('amount')[:1]
+        )
+    ).order_by('pk')
+    shards = WalletShard.objects.filter(
+        **where('wallet')
+    ).order_by('wallet', 'index')
+    if lock:
+        # wallet rows are locked before shards as in `fold_shards`
+        wallets = wallets.select_for_update()
+        shards = shards.select_for_update()
+
+    expected: Dict[int, Decimal] = {}
+    actual: Dict[int, Decimal] = {}
+    for pk, amount, opened in wallets.values_list('pk', 'amount', 'opening'):
+        expected[pk] = opened or Decimal("0")
+        actual[pk] = amount
+    for wallet, amount in shards.values_list('wallet', 'amount'):
+        actual[wallet] += amount
+
+    incomplete = set()
+    for wallet, field, sign in [
+        ('to_wallet', 'to_amount', 1),
+        ('from_wallet', 'from_amount', -1),
+    ]:
+        totals = Transaction.objects.filter(**where(wallet)).annotate(
+            opened=Subquery(
+                opening.filter(wallet=OuterRef(wallet)).values('created')[:1]
+            )
+        ).filter(
+            Q(opened__isnull=True) | Q(created__gt=F('opened'))
+        ).order_by().values(wallet).annotate(
+            total=Sum(field),
+            missing=Count('pk', filter=Q(**{f'{field}__isnull': True}))
+        ).values_list(wallet, 'total', 'missing')
+        for pk, total, missing in totals:
+            expected[pk] += sign * (total or 0)
+            if missing:
+                incomplete.add(pk)
+
+    return {
+        pk: Balance(expected[pk], actual[pk], pk not in incomplete)
+        for pk in actual
+    }
+
+
+def replay_range(bounds: Range, apply: bool) -> Result:
+    """
+    Rebuilds balances of wallets with primary keys in [start, stop) range.
+    Wallets and their shards are locked in apply mode, in compare mode only
+    mismatched wallets are locked and checked again, as concurrent payment
+    could change them between queries. Wallets with transactions without
+    amounts can`t be rebuilt, they are reported and never changed.
+    Params:
+        bounds - start and stop of range
+        apply - stores rebuilt balances into mismatched wallets and empties
+                their shards if True, otherwise stores discrepancies
+    Returns:
+        tuple - start of range, count of wallets, count of mismatched ones
+                and primary keys of wallets that can`t be rebuilt
+    """
+    start, stop = bounds
+    with transaction.atomic():
+        balances = rebuild({'gte': start, 'lt': stop}, lock=apply)
+        mismatched = [
+            pk for pk, balance in balances.items()
+            if balance.complete and balance.expected != balance.actual
+        ]
+        if mismatched and not apply:
+            balances.update(rebuild({'in': mismatched}, lock=True))
+            mismatched = [
+                pk for pk in mismatched
+                if balances[pk].complete
+                and balances[pk].expected != balances[pk].actual
+            ]
+
+        if apply and mismatched:
+            now = timezone.now()
+            Wallet.objects.bulk_update(
+                [
+                    Wallet(pk=pk, amount=balances[pk].expected, modified=now)
+                    for pk in mismatched
+                ],
+                ['amount', 'modified']
+            )
+            WalletShard.objects.filter(
+                wallet__in=mismatched
+            ).update(amount=0, modified=now)
+        elif mismatched:
+            WalletDiscrepancy.objects.bulk_create([
+                WalletDiscrepancy(
+                    wallet_id=pk,
+                    expected=balances[pk].expected,
+                    actual=balances[pk].actual
+                )
+                for pk in mismatched
+            ])
+
+    incomplete = [
+        pk for pk, balance in balances.items() if not balance.complete
+    ]
+    return start, len(balances), len(mismatched), incomplete
+
+
+def replay_range_star(args: Tuple[Range, bool]) -> Result:
+    return replay_range(*args)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds balances of all wallets from their transactions. Wallets "
+        "are split into ranges of primary keys that are replayed by pool "
+        "of processes. Mismatches are stored as discrepancies, or applied "
+        "to wallets with `--apply`. Finished ranges are saved to `--state` "
+        "file, so interrupted replay could be resumed. Wallets which "
+        "transactions haven`t got amounts are reported and skipped, fill "
+        "them by `backfill_transaction_amounts` first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Count of processes, 0 replays in current process'
+        )
+        parser.add_argument('--range-size', type=int, default=1000)
+        parser.add_argument('--state', help='Path of file with progress')
+        parser.add_argument('--apply', action='store_true')
+
+    def handle(self, *args, **options):
+        size = options['range_size']
+        if size <= 0:
+            raise CommandError("Range size should be positive")
+
+        state = self.load_state(options['state'], size, options['apply'])
+        bounds = Wallet.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        done = set(state['done'])
+        ranges: List[Range] = []
+        if bounds['first'] is not None:
+            ranges = [
+                (start, start + size)
+                for start in range(bounds['first'], bounds['last'] + 1, size)
+                if start not in done
+            ]
+
+        wallets = mismatched = skipped = 0
+        total = len(ranges) + len(state['done'])
+        for start, count, found, incomplete in self.replay(
+            ranges,
+            options['apply'],
+            options['workers']
+        ):
+            wallets += count
+            mismatched += found
+            skipped += len(incomplete)
+            state['done'].append(start)
+            self.save_state(options['state'], state)
+            self.stdout.write(
+                f"{len(state['done'])}/{total} ranges: "
+                f"{wallets} wallets, {mismatched} mismatched"
+            )
+            if incomplete:
+                self.stdout.write(
+                    "Skipped wallets with transactions without amounts: "
+                    + ", ".join(map(str, incomplete))
+                )
+
+        action = 'applied' if options['apply'] else 'found'
+        self.stdout.write(
+            f"Replayed {wallets} wallets, {action} {mismatched} mismatches, "
+            f"skipped {skipped}"
+        )
+
+    def replay(self, ranges: List[Range], apply: bool, workers: int):
+        """
+        Yields results of ranges in order of their completion
+        """
+        tasks = [(bounds, apply) for bounds in ranges]
+        if not workers:
+            yield from map(replay_range_star, tasks)
+            return
+
+        # forked processes shouldn`t share connection of this process
+        connections.close_all()
+        with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+            yield from pool.imap_unordered(replay_range_star, tasks)
+
+    def load_state(self, path: Optional[str], size: int, apply: bool) -> dict:
+        state = {'range_size': size, 'apply': apply, 'done': []}
+        if not path or not os.path.exists(path):
+            return state
+
+        with open(path) as f:
+            stored = json.load(f)
+        if (stored['range_size'], stored['apply']) != (size, apply):
+            raise CommandError(
+                f"{path} has been made with other range size or mode"
+            )
+        return stored
+
+    def save_state(self, path: Optional[str], state: dict):
+        if not path:
+            return
+        # file is replaced at once, so interruption can`t corrupt it
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{path}.tmp', path)
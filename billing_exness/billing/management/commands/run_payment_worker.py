@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from billing_exness.billing.worker import PaymentWorker, Stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Makes pending payment intents in batches. Many workers could be run "
+        "concurrently"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.BILLING_WORKER_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--max-latency',
+            type=float,
+            default=settings.BILLING_WORKER_MAX_LATENCY,
+            help='Seconds that intent could wait for batch to fill'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when queue is empty'
+        )
+        parser.add_argument(
+            '--report-interval',
+            type=float,
+            default=60.0,
+            help='Seconds between reports of batches'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        worker = PaymentWorker(
+            options['batch_size'],
+            options['max_latency'],
+            options['sleep'],
+            options['report_interval']
+        )
+        interval = options['report_interval']
+        try:
+            worker.run(
+                options['once'],
+                lambda stats: self.stdout.write(
+                    f"Last {interval:g}s: processed {self.summary(stats)}"
+                )
+            )
+        finally:
+            self.stdout.write(f"Processed {self.summary(worker.stats())}")
+
+    def summary(self, stats: Stats) -> str:
+        return (
+            f"{stats['intents']} payment intents in {stats['batches']} "
+            f"batches, fill ratio {stats['fill_ratio']}"
+        )
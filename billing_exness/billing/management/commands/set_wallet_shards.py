@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from billing_exness.billing.models import Wallet
+from billing_exness.billing.utils import fold_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Sets count of shards of users wallet. Credits of wallet with shards "
+        "are spread among them, 0 turns sharding off and folds shards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('count', type=int)
+
+    def handle(self, *args, **options):
+        if options['count'] < 0:
+            raise CommandError("Count of shards can`t be negative")
+
+        with transaction.atomic():
+            try:
+                wallet = Wallet.objects.select_for_update().get(
+                    user__username=options['username']
+                )
+            except Wallet.DoesNotExist:
+                raise CommandError(
+                    f"User {options['username']} hasn`t got wallet"
+                )
+            wallet.shard_count = options['count']
+            wallet.save(update_fields=['shard_count', 'modified'])
+            if not wallet.shard_count:
+                fold_shards(wallet)
+
+        self.stdout.write(
+            f"Wallet of {options['username']} has got "
+            f"{options['count']} shards"
+        )
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_current_rates(apps, schema_editor):
+    ExchangeRate = apps.get_model('billing', 'ExchangeRate')
+    CurrentRate = apps.get_model('billing', 'CurrentRate')
+
+    currencies = ExchangeRate.objects.values_list(
+        'currency',
+        flat=True
+    ).distinct()
+
+    for currency in currencies:
+        latest = ExchangeRate.objects.filter(
+            currency=currency
+        ).order_by('-created').first()
+        CurrentRate.objects.create(
+            currency=currency,
+            exchange_rate=latest,
+            created=latest.created
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_auto_20191026_2215'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='transaction',
+            options={'ordering': ('-created',)},
+        ),
+        migrations.CreateModel(
+            name='CurrentRate',
+            fields=[
+                ('currency', models.CharField(choices=[('EUR', 'EUR'), ('CAD', 'CAD'), ('CNY', 'CNY')], max_length=100, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField()),
+                ('exchange_rate', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='billing.ExchangeRate')),
+            ],
+        ),
+        migrations.RunPython(fill_current_rates, migrations.RunPython.noop),
+    ]
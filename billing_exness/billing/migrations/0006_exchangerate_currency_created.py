@@ -0,0 +1,23 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:10
+
+from django.db import migrations, models
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_currentrate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exchangerate',
+            index=models.Index(fields=['currency', 'created'], name='billing_exc_currenc_caf6e2_idx'),
+        ),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='currency',
+            field=model_utils.fields.StatusField(choices=[(0, 'dummy')], default='EUR', max_length=100, no_check_for_status=True),
+        ),
+    ]
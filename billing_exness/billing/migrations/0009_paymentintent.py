@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_walletshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIntent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', model_utils.fields.StatusField(choices=[('USD', 'USD'), ('EUR', 'EUR'), ('CAD', 'CAD'), ('CNY', 'CNY')], default='USD', max_length=100, no_check_for_status=True)),
+                ('rates', models.TextField(blank=True, help_text='JSON of quoted rates, latest rates are used if empty')),
+                ('status', model_utils.fields.StatusField(choices=[('pending', 'pending'), ('succeeded', 'succeeded'), ('failed', 'failed')], default='pending', max_length=100, no_check_for_status=True)),
+                ('error', models.TextField(blank=True)),
+                ('from_wallet', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payment_intents', to='billing.Wallet')),
+                ('to_wallet', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='billing.Wallet')),
+                ('transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='billing.Transaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymentintent',
+            index=models.Index(fields=['status', 'created'], name='billing_pay_status_9aff4b_idx'),
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 2.2.6 on 2026-10-18 18:02
+
+from decimal import Decimal
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+import billing_exness.billing.fields
+
+# (model, field) pairs that are moved to minor units
+AMOUNT_FIELDS = [
+    ('exchangerate', 'rate'),
+    ('wallet', 'amount'),
+    ('walletshard', 'amount'),
+    ('transaction', 'amount'),
+    ('paymentintent', 'amount'),
+]
+
+SCALE = 100
+
+
+def to_minor_units(apps, schema_editor):
+    for model_name, field in AMOUNT_FIELDS:
+        model = apps.get_model('billing', model_name)
+        model.objects.update(**{
+            f'{field}_minor': Cast(
+                Round(F(field) * SCALE),
+                models.BigIntegerField()
+            )
+        })
+
+
+def from_minor_units(apps, schema_editor):
+    # division of integers is integer division for some backends
+    for model_name, field in AMOUNT_FIELDS:
+        model = apps.get_model('billing', model_name)
+        objects = list(model.objects.only('pk', f'{field}_minor'))
+        for obj in objects:
+            setattr(
+                obj,
+                field,
+                Decimal(getattr(obj, f'{field}_minor')) / SCALE
+            )
+        model.objects.bulk_update(objects, [field], batch_size=1000)
+
+
+def replace_field(model_name, field, final):
+    return [
+        migrations.RemoveField(
+            model_name=model_name,
+            name=field,
+        ),
+        migrations.RenameField(
+            model_name=model_name,
+            old_name=f'{field}_minor',
+            new_name=field,
+        ),
+        migrations.AlterField(
+            model_name=model_name,
+            name=field,
+            field=final,
+        ),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0009_paymentintent'),
+    ]
+
+    operations = [
+        *[
+            migrations.AddField(
+                model_name=model_name,
+                name=f'{field}_minor',
+                field=models.BigIntegerField(null=True),
+            )
+            for model_name, field in AMOUNT_FIELDS
+        ],
+        # old columns should be nullable, so they could be filled back
+        *[
+            migrations.AlterField(
+                model_name=model_name,
+                name=field,
+                field=models.DecimalField(
+                    decimal_places=2,
+                    max_digits=10,
+                    null=True
+                ),
+            )
+            for model_name, field in AMOUNT_FIELDS
+        ],
+        migrations.RunPython(to_minor_units, from_minor_units),
+        *replace_field(
+            'exchangerate',
+            'rate',
+            billing_exness.billing.fields.MinorUnitsField(
+                decimal_places=2,
+                validators=[django.core.validators.MinValueValidator(0)]
+            ),
+        ),
+        *replace_field(
+            'wallet',
+            'amount',
+            billing_exness.billing.fields.MinorUnitsField(
+                decimal_places=2,
+                validators=[django.core.validators.MinValueValidator(0)]
+            ),
+        ),
+        *replace_field(
+            'walletshard',
+            'amount',
+            billing_exness.billing.fields.MinorUnitsField(
+                decimal_places=2,
+                default=Decimal('0'),
+                validators=[django.core.validators.MinValueValidator(0)]
+            ),
+        ),
+        *replace_field(
+            'transaction',
+            'amount',
+            billing_exness.billing.fields.MinorUnitsField(decimal_places=2),
+        ),
+        *replace_field(
+            'paymentintent',
+            'amount',
+            billing_exness.billing.fields.MinorUnitsField(decimal_places=2),
+        ),
+    ]
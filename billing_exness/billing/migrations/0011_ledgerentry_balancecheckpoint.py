@@ -0,0 +1,76 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:42
+
+import billing_exness.billing.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+def open_checkpoints(apps, schema_editor):
+    # history before ledger is unknown, so current balances of wallets
+    # become their opening checkpoints
+    Wallet = apps.get_model('billing', 'Wallet')
+    WalletShard = apps.get_model('billing', 'WalletShard')
+    BalanceCheckpoint = apps.get_model('billing', 'BalanceCheckpoint')
+
+    now = django.utils.timezone.now()
+    shards = dict(
+        WalletShard.objects.values('wallet').annotate(
+            total=models.Sum('amount')
+        ).values_list('wallet', 'total')
+    )
+    checkpoints = [
+        BalanceCheckpoint(
+            wallet_id=pk,
+            amount=amount + (shards.get(pk) or 0),
+            created=now
+        )
+        for pk, amount in Wallet.objects.values_list('pk', 'amount')
+    ]
+    BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0010_minor_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', billing_exness.billing.fields.MinorUnitsField(decimal_places=2)),
+                ('currency', model_utils.fields.StatusField(choices=[('USD', 'USD'), ('EUR', 'EUR'), ('CAD', 'CAD'), ('CNY', 'CNY')], default='USD', max_length=100, no_check_for_status=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='billing.Transaction')),
+                ('wallet', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='billing.Wallet')),
+            ],
+            options={
+                'ordering': ('created', 'pk'),
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', billing_exness.billing.fields.MinorUnitsField(decimal_places=2)),
+                ('created', models.DateTimeField()),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='billing.Wallet')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['wallet', 'created'], name='billing_led_wallet__321b47_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='balancecheckpoint',
+            unique_together={('wallet', 'created')},
+        ),
+        migrations.RunPython(open_checkpoints, migrations.RunPython.noop),
+    ]
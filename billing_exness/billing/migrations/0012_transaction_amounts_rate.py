@@ -0,0 +1,29 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:45
+
+import billing_exness.billing.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0011_ledgerentry_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='from_amount',
+            field=billing_exness.billing.fields.MinorUnitsField(blank=True, decimal_places=2, help_text='Debit of payer in currency of its wallet, empty for charge', null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='rate',
+            field=billing_exness.billing.fields.MinorUnitsField(decimal_places=8, help_text='How much currency of payee could be bought by 1 currency of payer(or of transaction for charge)', null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='to_amount',
+            field=billing_exness.billing.fields.MinorUnitsField(decimal_places=2, help_text='Credit of payee in currency of its wallet', null=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:46
+
+import billing_exness.billing.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0012_transaction_amounts_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationMark',
+            fields=[
+                ('wallet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reconciliation_mark', serialize=False, to='billing.Wallet')),
+                ('amount', billing_exness.billing.fields.MinorUnitsField(decimal_places=2)),
+                ('created', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalletDiscrepancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('expected', billing_exness.billing.fields.MinorUnitsField(decimal_places=2, help_text='Balance computed from transactions')),
+                ('actual', billing_exness.billing.fields.MinorUnitsField(decimal_places=2, help_text='Balance of wallet with its shards')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['from_wallet', 'created'], name='billing_tra_from_wa_964439_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['to_wallet', 'created'], name='billing_tra_to_wall_6b039e_idx'),
+        ),
+        migrations.AddField(
+            model_name='walletdiscrepancy',
+            name='wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discrepancies', to='billing.Wallet'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0013_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='headers',
+            field=models.TextField(blank=True, default='', help_text='Replayed headers of response'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.6 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0014_idempotencykey_headers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['currency', 'created'], name='billing_tra_currenc_10bb7f_idx'),
+        ),
+    ]
@@ -1,9 +1,34 @@
-from typing import Union
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+    TYPE_CHECKING
+)
 from decimal import Decimal
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import (
+    Case,
+    Expression,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When
+)
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Trunc
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from model_utils import Choices
 from model_utils.models import TimeStampedModel
@@ -13,9 +38,15 @@ from model_utils.fields import StatusField
 from .constants import (
     BASE_CURRENCY,
     EXCHANGE_CURRENCIES,
-    CURRENCIES
+    CURRENCIES,
+    OHLC_BUCKETS,
+    OHLC_BUCKET_WIDTHS
 )
 from .exceptions import check_currency
+from .fields import MinorUnitsField
+
+if TYPE_CHECKING:
+    from .rates import RateSnapshot  # noqa F401
 
 
 class ExchangeRate(TimeStampedModel):
@@ -26,29 +57,80 @@ class ExchangeRate(TimeStampedModel):
     """
     EXCHANGE_CURRENCIES = Choices(*EXCHANGE_CURRENCIES)
 
-    rate = models.DecimalField(
-        max_digits=10,
+    rate: Decimal = MinorUnitsField(
         decimal_places=2,
         validators=[MinValueValidator(0)]
     )
-    currency = StatusField(
-        choices_name='EXCHANGE_CURRENCIES',
-        db_index=True
-    )
+    currency = StatusField(choices_name='EXCHANGE_CURRENCIES')
 
     class Meta:
         ordering = ('-created', )
+        indexes = [
+            models.Index(fields=['currency', 'created']),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Stores rate and moves current rate of currency to it
+        """
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                CurrentRate.track([self])
+
+    @classmethod
+    def publish(cls, rates: Mapping[str, Decimal]) -> List['ExchangeRate']:
+        """
+        Stores set of rates with one insert in one transaction, so
+        readers never see partly updated set
+        Params:
+            rates - new rate for every passed currency
+        Raises:
+            AssertionError - when wrong currency has been passed
+        Returns
+            list - stored `ExchangeRate` objects
+        """
+        assert rates
+        for currency in rates:
+            assert currency in EXCHANGE_CURRENCIES
+
+        now = timezone.now()
+        objects = [
+            cls(currency=currency, rate=rate, created=now, modified=now)
+            for currency, rate in rates.items()
+        ]
+
+        with transaction.atomic():
+            cls.objects.bulk_create(objects)
+            if any(rate.pk is None for rate in objects):
+                # backend can't return ids of inserted rows
+                objects = list(cls.objects.filter(
+                    created=now,
+                    currency__in=list(rates)
+                ))
+            CurrentRate.track(objects)
+
+        from .rates import rate_cache, broadcast_rates
+        rate_cache.invalidate()
+        broadcast_rates(objects)
+
+        return objects
 
     @classmethod
     def of(
         cls,
         currency: str,
-        as_object: bool = False
+        as_object: bool = False,
+        at: Optional[datetime] = None
     ) -> Union[Decimal, TimeStampedModel]:
         """
-        Shows latest of 1 usd to `currency`
+        Shows latest of 1 usd to `currency`. Latest rates are cached
+        in process, see `rates.RateCache`
         Params:
             currency - one of available currency
+            at - shows rate that was in force at this moment instead of
+                 latest one
         Raises:
             AssertionError - when wrong currency has been passed,
             or tried to return as object BASE_CURRENCY
@@ -56,18 +138,195 @@ class ExchangeRate(TimeStampedModel):
         Returns
             Decimal - current rate
         """
+        if at is None:
+            from .rates import rate_cache
+            return rate_cache.snapshot().of(currency, as_object)
+
         check_currency(currency)
 
         if currency == BASE_CURRENCY:
             assert not as_object
             return Decimal("1")
 
-        latest = cls.objects.filter(currency=currency).first()
+        rate = cls.objects.filter(currency=currency, created__lte=at).first()
+
+        if rate is None:
+            raise ValueError(f"Rate for {currency} hasn`t been set at {at}")
+
+        return rate if as_object else rate.rate
+
+    @classmethod
+    def of_many(
+        cls,
+        moments: Iterable[Tuple[str, datetime]]
+    ) -> Dict[Tuple[str, datetime], Decimal]:
+        """
+        Shows rates that were in force at passed moments with one query.
+        Rate of every distinct moment is selected by its own indexed
+        subquery, so history between moments isn`t read. Rows of other
+        models should be annotated with `rate_at` instead, which is
+        correlated with every row.
+        Params:
+            moments - pairs of currency and moment
+        Raises:
+            AssertionError - when wrong currency has been passed
+            ValueError - when rate hasn`t been set at one of moments
+        Returns
+            dict - rate for every passed pair
+        """
+        moments = list(moments)
+        for currency, _ in moments:
+            check_currency(currency)
+
+        in_force = [
+            Subquery(
+                cls.objects.filter(
+                    currency=currency,
+                    created__lte=at
+                ).order_by('-created').values('pk')[:1]
+            )
+            for currency, at in set(moments) if currency != BASE_CURRENCY
+        ]
+
+        # rate in force at moment is the latest selected one before it
+        moments_of: Dict[str, List[datetime]] = defaultdict(list)
+        rates_of: Dict[str, List[Decimal]] = defaultdict(list)
+        if in_force:
+            rows = cls.objects.filter(
+                pk__in=in_force
+            ).order_by('created').values_list('currency', 'created', 'rate')
+            for currency, created, rate in rows:
+                moments_of[currency].append(created)
+                rates_of[currency].append(rate)
+
+        result = {}
+        for currency, at in moments:
+            if currency == BASE_CURRENCY:
+                result[currency, at] = Decimal("1")
+                continue
 
-        if latest is None:
-            raise ValueError(f"Rate for {currency} hasn`t been set")
+            index = bisect_right(moments_of[currency], at)
+            if not index:
+                raise ValueError(
+                    f"Rate for {currency} hasn`t been set at {at}"
+                )
+            result[currency, at] = rates_of[currency][index - 1]
 
-        return latest if as_object else latest.rate
+        return result
+
+    @classmethod
+    def ohlc(
+        cls,
+        currency: str,
+        bucket: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: Optional[int] = None
+    ) -> List[dict]:
+        """
+        Aggregates rates of currency by time buckets in db. With `limit`
+        rates are aggregated by time windows that start from the first
+        bucket with rates and fit only missing buckets, so db doesn`t
+        aggregate whole history after `since` for every page.
+        Params:
+            currency - one of exchange currencies
+            bucket - size of bucket: minute, hour or day
+            since - includes rates created since this moment
+            until - includes rates created before this moment
+            limit - max count of buckets
+        Returns
+            list - dicts with `bucket`, `open`, `high`, `low`, `close` keys
+                   ordered by bucket
+        """
+        assert currency in EXCHANGE_CURRENCIES
+        assert bucket in OHLC_BUCKETS
+
+        rates = cls.objects.filter(currency=currency)
+        if since is not None:
+            rates = rates.filter(created__gte=since)
+        if until is not None:
+            rates = rates.filter(created__lt=until)
+        rates = rates.annotate(bucket=Trunc('created', bucket))
+
+        def aggregate(rates: models.QuerySet) -> List[dict]:
+            return list(rates.values('bucket').annotate(
+                high=Max('rate'),
+                low=Min('rate'),
+                opened=Min('created'),
+                closed=Max('created'),
+            ).order_by('bucket'))
+
+        if limit is None:
+            buckets = aggregate(rates)
+        else:
+            buckets = []
+            width = OHLC_BUCKET_WIDTHS[bucket]
+            while len(buckets) < limit:
+                first = rates.order_by('created').values_list(
+                    'bucket',
+                    flat=True
+                ).first()
+                if first is None:
+                    break
+                end = first + (limit - len(buckets)) * width
+                buckets.extend(aggregate(rates.filter(created__lt=end)))
+                rates = rates.filter(created__gte=end)
+
+        # rates of first and last moments of every bucket
+        moments = {item['opened'] for item in buckets}
+        moments.update(item['closed'] for item in buckets)
+        prices = dict(
+            cls.objects.filter(
+                currency=currency,
+                created__in=moments
+            ).values_list('created', 'rate')
+        ) if moments else {}
+
+        return [
+            {
+                'bucket': item['bucket'],
+                'open': prices[item['opened']],
+                'high': item['high'],
+                'low': item['low'],
+                'close': prices[item['closed']],
+            }
+            for item in buckets
+        ]
+
+    @classmethod
+    def in_force(cls, currency: str, at: str) -> models.QuerySet:
+        """
+        Builds queryset with rate that was in force at moment for
+        subqueries of other querysets.
+        Params:
+            currency - name of outer field with currency
+            at - name of outer field with moment
+        """
+        return cls.objects.filter(
+            currency=OuterRef(currency),
+            created__lte=OuterRef(at)
+        ).order_by('-created')[:1]
+
+    @classmethod
+    def rate_at(cls, currency: str, at: str) -> Expression:
+        """
+        Builds expression of rate that was in force at moment for annotating
+        other querysets.
+        Params:
+            currency - name of field with currency
+            at - name of field with moment
+        Returns
+            Expression - rate or NULL if rate hasn`t been set at moment
+        """
+        field = cls._meta.get_field('rate')
+        return Case(
+            When(
+                **{currency: BASE_CURRENCY},
+                then=Value(Decimal(1), output_field=field)
+            ),
+            default=Subquery(cls.in_force(currency, at).values('rate')),
+            output_field=field
+        )
 
     @classmethod
     def get(cls, from_currency: str, to_currency: str) -> Decimal:
@@ -79,10 +338,57 @@ class ExchangeRate(TimeStampedModel):
         Returns
             Decimal - current rate
         """
-        from_rate = cls.of(from_currency)
-        to_rate = cls.of(to_currency)
+        from .rates import rate_cache
+        return rate_cache.snapshot().get(from_currency, to_currency)
 
-        return to_rate / from_rate
+
+class CurrentRate(models.Model):
+    """
+    Latest exchange rate of currency. Kept in sync with `ExchangeRate`
+    history on every insert, so latest rate could be read by primary key
+    however long history is.
+    """
+    currency = models.CharField(
+        max_length=100,
+        choices=ExchangeRate.EXCHANGE_CURRENCIES,
+        primary_key=True
+    )
+    exchange_rate = models.OneToOneField(
+        ExchangeRate,
+        related_name='+',
+        on_delete=models.PROTECT
+    )
+    created = models.DateTimeField()
+
+    @classmethod
+    def track(cls, rates: Iterable[ExchangeRate]):
+        """
+        Moves current rates to passed ones. Rates that are older than
+        current one are ignored.
+        Params:
+            rates - stored `ExchangeRate` objects
+        """
+        latest: Dict[str, ExchangeRate] = {}
+        for rate in rates:
+            assert rate.pk is not None
+            current = latest.get(rate.currency)
+            if current is None or current.created <= rate.created:
+                latest[rate.currency] = rate
+
+        for currency, rate in latest.items():
+            updated = cls.objects.filter(
+                currency=currency,
+                created__lte=rate.created
+            ).update(exchange_rate=rate, created=rate.created)
+
+            if not updated:
+                cls.objects.get_or_create(
+                    currency=currency,
+                    defaults={
+                        'exchange_rate': rate,
+                        'created': rate.created
+                    }
+                )
 
 
 class Wallet(TimeStampedModel):
@@ -98,25 +404,80 @@ class Wallet(TimeStampedModel):
     )
 
     currency = StatusField(choices_name='CURRENCIES')
-    amount = models.DecimalField(
-        max_digits=10,
+    amount: Decimal = MinorUnitsField(
         decimal_places=2,
         validators=[MinValueValidator(0)]
     )
+    shard_count = models.PositiveSmallIntegerField(
+        default=0,
+        help_text=(
+            'Count of shard rows that receive credits of hot wallet. '
+            '0 disables sharding'
+        )
+    )
+
+    @property
+    def balance(self) -> Decimal:
+        """
+        Amount of wallet with money that is kept in its shards
+        """
+        if not self.shard_count:
+            return self.amount
+        total = self.shards.aggregate(total=Sum('amount'))['total']
+        return self.amount + (total or Decimal("0"))
 
-    def amount_in(self, to_currency: str) -> Decimal:
+    def balance_at(self, moment: datetime) -> Decimal:
+        """
+        Computes balance of wallet at moment from ledger: amount of latest
+        checkpoint before moment plus entries made after checkpoint, so
+        count of read entries doesn`t depend on length of history
+        """
+        entries = self.entries.filter(created__lte=moment)
+        amount = Decimal("0")
+
+        checkpoint = self.checkpoints.filter(
+            created__lte=moment
+        ).order_by('-created').first()
+        if checkpoint is not None:
+            entries = entries.filter(created__gt=checkpoint.created)
+            amount = checkpoint.amount
+
+        total = entries.aggregate(total=Sum('amount'))['total']
+        return amount + (total or Decimal("0"))
+
+    @property
+    def last_modified(self) -> datetime:
+        """
+        Time of latest change of wallet or its shards
+        """
+        if not self.shard_count:
+            return self.modified
+        modified = self.shards.aggregate(
+            modified=Max('modified')
+        )['modified']
+        return max(self.modified, modified or self.modified)
+
+    def amount_in(
+        self,
+        to_currency: str,
+        snapshot: Optional['RateSnapshot'] = None
+    ) -> Decimal:
         """
         Get's amount of wallet in different currencies.
         Params:
             to_params - currencies
+            snapshot - rates to use, latest rates by default
         Raises:
             AssertionError - when wrong currency has been passed
             ValueError - when rates hasn`t been set
         Returns:
             Decimal - amount in selected currency
         """
-        rate = ExchangeRate.get(self.currency, to_currency)
-        return self.amount * rate
+        if snapshot is None:
+            rate = ExchangeRate.get(self.currency, to_currency)
+        else:
+            rate = snapshot.get(self.currency, to_currency)
+        return self.balance * rate
 
     @property
     def transactions(self) -> models.QuerySet:
@@ -133,6 +494,50 @@ class Wallet(TimeStampedModel):
         return self._transactions
 
 
+class WalletShard(TimeStampedModel):
+    """
+    Part of amount of hot wallet. Credits of hot wallet are spread among its
+    shards, so concurrent payments to it don`t wait for lock of one row.
+    Money of shards is moved to wallet by debits and `fold_wallet_shards`
+    """
+    wallet = models.ForeignKey(
+        Wallet,
+        related_name='shards',
+        on_delete=models.CASCADE,
+    )
+    index = models.PositiveSmallIntegerField()
+    amount: Decimal = MinorUnitsField(
+        decimal_places=2,
+        default=Decimal("0"),
+        validators=[MinValueValidator(0)]
+    )
+
+    class Meta:
+        unique_together = [
+            ('wallet', 'index'),
+        ]
+
+
+class TransactionQuerySet(models.QuerySet):
+
+    def with_rates(self) -> 'TransactionQuerySet':
+        """
+        Annotates transactions with rates that were in force at their
+        creation: `currency_rate`, `from_wallet_rate`, `to_wallet_rate`
+        """
+        return self.annotate(
+            currency_rate=ExchangeRate.rate_at('currency', 'created'),
+            from_wallet_rate=ExchangeRate.rate_at(
+                'from_wallet__currency',
+                'created'
+            ),
+            to_wallet_rate=ExchangeRate.rate_at(
+                'to_wallet__currency',
+                'created'
+            ),
+        )
+
+
 class Transaction(TimeStampedModel):
     """
     Stores info about transactions that has been proceed
@@ -150,14 +555,214 @@ class Transaction(TimeStampedModel):
         related_name='incoming_transactions',
         on_delete=models.PROTECT,
     )
-    amount = models.DecimalField(
-        max_digits=10,
+    amount: Decimal = MinorUnitsField(
         decimal_places=2
     )
     currency = StatusField(choices_name='CURRENCIES')
+    from_amount: Decimal = MinorUnitsField(
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text='Debit of payer in currency of its wallet, empty for charge'
+    )
+    to_amount: Decimal = MinorUnitsField(
+        decimal_places=2,
+        null=True,
+        help_text='Credit of payee in currency of its wallet'
+    )
+    rate: Decimal = MinorUnitsField(
+        decimal_places=8,
+        null=True,
+        help_text=(
+            'How much currency of payee could be bought by 1 currency of '
+            'payer(or of transaction for charge)'
+        )
+    )
+
+    objects = TransactionQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created', )
         index_together = [
             ('from_wallet', 'to_wallet'),
         ]
+        indexes = [
+            models.Index(fields=['from_wallet', 'created']),
+            models.Index(fields=['to_wallet', 'created']),
+            models.Index(fields=['currency', 'created']),
+        ]
+
+
+class LedgerEntry(models.Model):
+    """
+    Change of balance of wallet made by transaction. Every transaction has
+    got debit entry(negative amount) of payer and credit entry of payee,
+    both in currencies of their wallets. Debit entry of charge hasn`t got
+    wallet, money comes from outer world. Entries are never changed.
+    """
+    CURRENCIES = Choices(*CURRENCIES)
+
+    transaction = models.ForeignKey(
+        Transaction,
+        related_name='entries',
+        on_delete=models.PROTECT,
+    )
+    wallet = models.ForeignKey(
+        Wallet,
+        related_name='entries',
+        on_delete=models.PROTECT,
+        blank=True,
+        null=True,
+    )
+    amount: Decimal = MinorUnitsField(
+        decimal_places=2
+    )
+    currency = StatusField(choices_name='CURRENCIES')
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ('created', 'pk')
+        indexes = [
+            models.Index(fields=['wallet', 'created']),
+        ]
+
+    def save(self, *args, **kwargs):
+        assert self._state.adding, "Ledger entries can`t be changed"
+        super().save(*args, **kwargs)
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Balance of wallet with all ledger entries created up to `created`.
+    Made by `checkpoint_balances` command
+    """
+    wallet = models.ForeignKey(
+        Wallet,
+        related_name='checkpoints',
+        on_delete=models.CASCADE,
+    )
+    amount: Decimal = MinorUnitsField(
+        decimal_places=2
+    )
+    created = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-created', )
+        unique_together = [
+            ('wallet', 'created'),
+        ]
+
+
+class ReconciliationMark(models.Model):
+    """
+    High-water mark of reconciliation of wallet: balance computed from
+    transactions of wallet created up to `created`. Made by
+    `reconcile_wallets` command
+    """
+    wallet = models.OneToOneField(
+        Wallet,
+        primary_key=True,
+        related_name='reconciliation_mark',
+        on_delete=models.CASCADE,
+    )
+    amount: Decimal = MinorUnitsField(
+        decimal_places=2
+    )
+    created = models.DateTimeField()
+
+
+class WalletDiscrepancy(TimeStampedModel):
+    """
+    Mismatch of balance of wallet and its transactions found by
+    `reconcile_wallets` command
+    """
+    wallet = models.ForeignKey(
+        Wallet,
+        related_name='discrepancies',
+        on_delete=models.CASCADE,
+    )
+    expected: Decimal = MinorUnitsField(
+        decimal_places=2,
+        help_text='Balance computed from transactions'
+    )
+    actual: Decimal = MinorUnitsField(
+        decimal_places=2,
+        help_text='Balance of wallet with its shards'
+    )
+
+    class Meta:
+        ordering = ('-created', )
+
+
+class IdempotencyKey(TimeStampedModel):
+    """
+    Stores response of write request made with `Idempotency-Key` header,
+    so retried request gets the same response without repeating operation
+    """
+    user = models.ForeignKey(
+        get_user_model(),
+        related_name='idempotency_keys',
+        on_delete=models.CASCADE,
+    )
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(
+        max_length=64,
+        help_text='Hash of method, path and data of request'
+    )
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.TextField(blank=True)
+    headers = models.TextField(
+        blank=True,
+        default='',
+        help_text='Replayed headers of response'
+    )
+
+    class Meta:
+        unique_together = [
+            ('user', 'key'),
+        ]
+        indexes = [
+            models.Index(fields=['created']),
+        ]
+
+
+class PaymentIntent(TimeStampedModel):
+    """
+    Payment that has been accepted for asynchronous processing. Pending
+    intents are made by `run_payment_worker` command
+    """
+    STATUS = Choices('pending', 'succeeded', 'failed')
+    CURRENCIES = Choices(*CURRENCIES)
+
+    from_wallet = models.ForeignKey(
+        Wallet,
+        related_name='payment_intents',
+        on_delete=models.PROTECT,
+    )
+    to_wallet = models.ForeignKey(
+        Wallet,
+        related_name='+',
+        on_delete=models.PROTECT,
+    )
+    amount: Decimal = MinorUnitsField(
+        decimal_places=2
+    )
+    currency = StatusField(choices_name='CURRENCIES')
+    rates = models.TextField(
+        blank=True,
+        help_text='JSON of quoted rates, latest rates are used if empty'
+    )
+    status = StatusField()
+    error = models.TextField(blank=True)
+    transaction = models.OneToOneField(
+        Transaction,
+        related_name='+',
+        on_delete=models.PROTECT,
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created']),
+        ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def to_minor(amount: Decimal, exponent: int) -> int:
+    """
+    Converts amount to integer count of minor units, rounds half up
+    """
+    return int(
+        Decimal(amount).scaleb(exponent).quantize(
+            Decimal(1),
+            rounding=ROUND_HALF_UP
+        )
+    )
+
+
+def from_minor(units: int, exponent: int) -> Decimal:
+    """
+    Converts integer count of minor units to amount
+    """
+    return Decimal(units).scaleb(-exponent)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import json
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, List, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+RATES_CHANNEL = 'billing:exchange-rates'
+
+Event = Tuple[int, dict]
+
+
+class BasePubSub(ABC):
+    """
+    Publishes messages to channels. Every message gets increasing version
+    of channel, so listeners could wait for messages newer than version
+    that they have already seen. Only latest `size` messages are kept.
+    """
+
+    def __init__(self, size: int = 100):
+        self.size = size
+
+    @abstractmethod
+    def publish(self, channel: str, message: dict) -> int:
+        """
+        Publishes message and returns its version
+        """
+        pass
+
+    @abstractmethod
+    def version(self, channel: str) -> int:
+        """
+        Returns version of latest message of channel, 0 for empty channel
+        """
+        pass
+
+    @abstractmethod
+    def listen(self, channel: str, since: int, timeout: float) -> List[Event]:
+        """
+        Returns messages newer than `since` version. Waits for them at most
+        `timeout` seconds if there aren`t any.
+        Returns:
+            list - pairs of version and message ordered by version
+        """
+        pass
+
+
+class InMemoryPubSub(BasePubSub):
+    """
+    Keeps messages in memory of process. Suitable for tests and single
+    process development server
+    """
+
+    def __init__(self, size: int = 100):
+        super().__init__(size)
+        self._condition = threading.Condition()
+        self._versions: Dict[str, int] = {}
+        self._events: Dict[str, Deque[Event]] = {}
+
+    def publish(self, channel: str, message: dict) -> int:
+        with self._condition:
+            version = self._versions.get(channel, 0) + 1
+            self._versions[channel] = version
+            events = self._events.setdefault(channel, deque(maxlen=self.size))
+            events.append((version, message))
+            self._condition.notify_all()
+        return version
+
+    def version(self, channel: str) -> int:
+        with self._condition:
+            return self._versions.get(channel, 0)
+
+    def listen(self, channel: str, since: int, timeout: float) -> List[Event]:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._versions.get(channel, 0) > since,
+                timeout
+            )
+            return [
+                event for event in self._events.get(channel, [])
+                if event[0] > since
+            ]
+
+    def clear(self):
+        with self._condition:
+            self._versions.clear()
+            self._events.clear()
+
+
+class RedisPubSub(BasePubSub):
+    """
+    Keeps messages in redis sorted set scored by version and wakes up
+    listeners of every process with redis PUBLISH
+    """
+
+    def __init__(self, url: str, size: int = 100):
+        import redis
+
+        super().__init__(size)
+        self._redis = redis.Redis.from_url(url)
+
+    def publish(self, channel: str, message: dict) -> int:
+        version = self._redis.incr(f'{channel}:version')
+        pipeline = self._redis.pipeline()
+        pipeline.zadd(
+            f'{channel}:events',
+            {json.dumps([version, message]): version}
+        )
+        pipeline.zremrangebyrank(f'{channel}:events', 0, -self.size - 1)
+        pipeline.publish(channel, version)
+        pipeline.execute()
+        return version
+
+    def version(self, channel: str) -> int:
+        return int(self._redis.get(f'{channel}:version') or 0)
+
+    def listen(self, channel: str, since: int, timeout: float) -> List[Event]:
+        events = self._read(channel, since)
+        if events or timeout <= 0:
+            return events
+
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(channel)
+            # message could be published before subscription
+            events = self._read(channel, since)
+            deadline = time.monotonic() + timeout
+            while not events:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                if pubsub.get_message(timeout=left) is not None:
+                    events = self._read(channel, since)
+        finally:
+            pubsub.close()
+
+        return events
+
+    def _read(self, channel: str, since: int) -> List[Event]:
+        return [
+            tuple(json.loads(event))
+            for event in self._redis.zrangebyscore(
+                f'{channel}:events',
+                f'({since}',
+                '+inf'
+            )
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_pubsub() -> BasePubSub:
+    """
+    Returns pubsub configured by `BILLING_PUBSUB` setting
+    """
+    backend = import_string(settings.BILLING_PUBSUB['BACKEND'])
+    return backend(**settings.BILLING_PUBSUB.get('OPTIONS', {}))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from .constants import BASE_CURRENCY
+from .exceptions import InvalidQuoteException, check_currency
+from .rates import RateSnapshot, rate_cache
+
+QUOTE_SALT = 'billing.quote'
+
+
+def make_quote(
+    currencies: Iterable[str],
+    snapshot: Optional[RateSnapshot] = None
+) -> Tuple[str, RateSnapshot, datetime]:
+    """
+    Locks rates of currencies for `BILLING_QUOTE_TTL` seconds.
+    Params:
+        currencies - currencies which rates should be locked
+        snapshot - rates to lock, latest rates by default
+    Raises:
+        AssertionError - when wrong currency has been passed
+        ValueError - when one of rates hasn`t been set
+    Returns:
+        tuple - signed token, locked rates and expiration time of token
+    """
+    snapshot = snapshot or rate_cache.snapshot()
+
+    rates = {}
+    for currency in currencies:
+        check_currency(currency)
+        if currency != BASE_CURRENCY:
+            rates[currency] = snapshot.of(currency)
+
+    token = signing.dumps(
+        {currency: str(rate) for currency, rate in rates.items()},
+        salt=QUOTE_SALT,
+        compress=True
+    )
+    expires = timezone.now() + timedelta(seconds=settings.BILLING_QUOTE_TTL)
+
+    return token, RateSnapshot(rates), expires
+
+
+def read_quote(token: str) -> RateSnapshot:
+    """
+    Verifies signature and expiration of quote token.
+    Raises:
+        InvalidQuoteException - if token is broken or has expired
+    Returns:
+        `RateSnapshot` - locked rates
+    """
+    try:
+        rates = signing.loads(
+            token,
+            salt=QUOTE_SALT,
+            max_age=settings.BILLING_QUOTE_TTL
+        )
+    except signing.SignatureExpired:
+        raise InvalidQuoteException("Quote has expired")
+    except signing.BadSignature:
+        raise InvalidQuoteException("Quote is broken")
+
+    return RateSnapshot({
+        currency: Decimal(rate)
+        for currency, rate in rates.items()
+    })
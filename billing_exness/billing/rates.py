@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Dict, Iterable, Mapping, Optional, Tuple, Union
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .constants import BASE_CURRENCY
+from .exceptions import check_currency
+from .models import ExchangeRate, CurrentRate
+from .pubsub import RATES_CHANNEL, get_pubsub
+
+VERSION_KEY = 'billing:exchange-rate:version'
+
+
+class RateSnapshot:
+    """
+    Immutable set of exchange rates with precomputed cross rates between
+    every pair of currencies. Allows to convert all amounts of request or
+    batch with one consistent set of rates.
+    """
+    __slots__ = ('_rates', '_objects', '_matrix')
+
+    def __init__(
+        self,
+        rates: Mapping[str, Decimal],
+        objects: Optional[Mapping[str, ExchangeRate]] = None
+    ):
+        """
+        Params:
+            rates - how much `currency` could be bought by 1 BASE_CURRENCY
+            objects - `ExchangeRate` entities of rates if they are known
+        """
+        base_rates = {BASE_CURRENCY: Decimal("1")}
+        base_rates.update(rates)
+
+        matrix: Dict[Tuple[str, str], Decimal] = {}
+        for from_currency, from_rate in base_rates.items():
+            if not from_rate:
+                continue
+            for to_currency, to_rate in base_rates.items():
+                matrix[from_currency, to_currency] = to_rate / from_rate
+
+        self._rates = MappingProxyType(base_rates)
+        self._objects = MappingProxyType(dict(objects or {}))
+        self._matrix = MappingProxyType(matrix)
+
+    @classmethod
+    def from_objects(cls, objects: Iterable[ExchangeRate]) -> 'RateSnapshot':
+        by_currency = {rate.currency: rate for rate in objects}
+        return cls(
+            {currency: rate.rate for currency, rate in by_currency.items()},
+            by_currency
+        )
+
+    @classmethod
+    def load(cls) -> 'RateSnapshot':
+        """
+        Loads latest rate of every currency with one query
+        """
+        return cls.from_objects(
+            current.exchange_rate
+            for current in CurrentRate.objects.select_related(
+                'exchange_rate'
+            )
+        )
+
+    @property
+    def rates(self) -> Mapping[str, Decimal]:
+        return self._rates
+
+    def of(
+        self,
+        currency: str,
+        as_object: bool = False
+    ) -> Union[Decimal, ExchangeRate]:
+        """
+        Works like `ExchangeRate.of` but with rates of snapshot
+        """
+        check_currency(currency)
+
+        if currency == BASE_CURRENCY:
+            assert not as_object
+            return self._rates[currency]
+
+        if currency not in self._rates:
+            raise ValueError(f"Rate for {currency} hasn`t been set")
+
+        if as_object:
+            if currency not in self._objects:
+                raise ValueError(f"Rate for {currency} hasn`t been stored")
+            return self._objects[currency]
+
+        return self._rates[currency]
+
+    def get(self, from_currency: str, to_currency: str) -> Decimal:
+        """
+        Works like `ExchangeRate.get` but with rates of snapshot
+        """
+        check_currency(from_currency)
+        check_currency(to_currency)
+
+        try:
+            return self._matrix[from_currency, to_currency]
+        except KeyError:
+            for currency in (from_currency, to_currency):
+                if not self._rates.get(currency):
+                    raise ValueError(f"Rate for {currency} hasn`t been set")
+            raise
+
+
+class RateCache:
+    """
+    Process-local cache of latest exchange rates.
+    Every process keeps its own copy of latest rates and compares its
+    version with the shared one(stored in django cache) not more often than
+    `BILLING_RATE_CACHE_CHECK_INTERVAL` seconds. So new rate becomes
+    visible for every process at most after that delay.
+    Transaction that has changed rates reads them from db without caching
+    until it is committed, as changes could be rolled back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: Optional[RateSnapshot] = None
+        self._version: Optional[str] = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def snapshot(self) -> RateSnapshot:
+        """
+        Returns snapshot of latest rates. Loads it from db on cache miss.
+        """
+        now = time.monotonic()
+        interval = settings.BILLING_RATE_CACHE_CHECK_INTERVAL
+
+        if self._is_pending():
+            with self._lock:
+                self.misses += 1
+            return RateSnapshot.load()
+
+        with self._lock:
+            outdated = now - self._checked_at >= interval
+            if self._snapshot is not None and outdated:
+                if self._shared_version() != self._version:
+                    self._snapshot = None
+                self._checked_at = now
+
+            if self._snapshot is not None:
+                self.hits += 1
+                return self._snapshot
+
+            self.misses += 1
+            # read version before rates, so concurrent insert
+            # will be noticed on next check
+            self._version = self._shared_version()
+            self._snapshot = RateSnapshot.load()
+            self._checked_at = now
+            return self._snapshot
+
+    def invalidate(self):
+        """
+        Drops local rates immediately and bumps shared version after
+        commit of current transaction, so other processes will reload rates
+        """
+        self._drop()
+        transaction.on_commit(self._bump)
+
+    def clear(self):
+        """
+        Resets cache with counters
+        """
+        with self._lock:
+            self._snapshot = None
+            self._version = None
+            self._checked_at = 0.0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _drop(self):
+        with self._lock:
+            self._snapshot = None
+
+    def _bump(self):
+        cache.set(VERSION_KEY, uuid4().hex, None)
+        self._drop()
+
+    def _is_pending(self) -> bool:
+        """
+        Checks that current transaction has changed rates, i.e. `_bump` is
+        still waiting for its commit. Rollback of transaction or savepoint
+        drops the callback, so rates are cached again after it.
+        """
+        return any(
+            func == self._bump for _, func in connection.run_on_commit
+        )
+
+    def _shared_version(self) -> Optional[str]:
+        return cache.get(VERSION_KEY)
+
+
+rate_cache = RateCache()
+
+
+def broadcast_rates(rates: Iterable[ExchangeRate]):
+    """
+    Publishes set of new rates to `RATES_CHANNEL` after commit of
+    current transaction
+    """
+    places = ExchangeRate._meta.get_field('rate').decimal_places
+    message = {
+        'rates': [
+            {
+                'currency': rate.currency,
+                'rate': str(Decimal(rate.rate).quantize(
+                    Decimal(1).scaleb(-places)
+                )),
+                'created': rate.created.isoformat(),
+            }
+            for rate in rates
+        ]
+    }
+    transaction.on_commit(
+        lambda: get_pubsub().publish(RATES_CHANNEL, message)
+    )
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import ExchangeRate
+from .rates import rate_cache, broadcast_rates
+
+
+@receiver(post_save, sender=ExchangeRate)
+def exchange_rate_created(
+    sender,
+    instance: ExchangeRate,
+    created: bool,
+    **kwargs
+):
+    """
+    Drops cached rates and notifies listeners when new rate has been stored
+    """
+    if created:
+        rate_cache.invalidate()
+        broadcast_rates([instance])
@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from factory import fuzzy, DjangoModelFactory, SubFactory
+from factory import fuzzy, DjangoModelFactory, Sequence, SubFactory
 
 from billing_exness.users.tests.factories import UserFactory
 from ..constants import CURRENCIES, EXCHANGE_CURRENCIES
 from ..models import (
     ExchangeRate,
     Wallet,
+    WalletShard,
     Transaction
 )
 
@@ -29,6 +30,16 @@ class WalletFactory(DjangoModelFactory):
         model = Wallet
 
 
+class WalletShardFactory(DjangoModelFactory):
+    wallet = SubFactory(WalletFactory, shard_count=4)
+    index = Sequence(lambda n: n % 4)
+
+    amount = fuzzy.FuzzyDecimal(low=0.1, high=1000)
+
+    class Meta:
+        model = WalletShard
+
+
 class TransactionFactory(DjangoModelFactory):
     from_wallet = SubFactory(WalletFactory)
     to_wallet = SubFactory(WalletFactory)
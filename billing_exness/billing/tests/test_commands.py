@@ -0,0 +1,600 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+import multiprocessing
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from .factories import (
+    ExchangeRateFactory,
+    TransactionFactory,
+    WalletFactory,
+    WalletShardFactory
+)
+from ..constants import EUR, USD
+from ..models import (
+    BalanceCheckpoint,
+    ExchangeRate,
+    IdempotencyKey,
+    PaymentIntent,
+    ReconciliationMark,
+    Transaction,
+    Wallet,
+    WalletDiscrepancy,
+    WalletShard
+)
+from ..utils import charge, enqueue_payment, make_payment
+from billing_exness.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+class TestDownsampleRates:
+
+    def create_rates(self, start, count, step):
+        return [
+            ExchangeRateFactory.create(
+                currency=EUR,
+                created=start + step * index
+            )
+            for index in range(count)
+        ]
+
+    def test_downsample(self):
+        now = timezone.now()
+        day = (now - timedelta(days=200)).replace(hour=0, minute=0)
+        hour = (now - timedelta(days=30)).replace(minute=0)
+
+        daily = self.create_rates(day, 4, timedelta(hours=1))
+        hourly = self.create_rates(hour, 4, timedelta(minutes=10))
+        raw = self.create_rates(
+            now - timedelta(days=1),
+            4,
+            timedelta(minutes=1)
+        )
+
+        call_command('downsample_rates', stdout=StringIO())
+
+        kept = set(ExchangeRate.objects.values_list('pk', flat=True))
+        assert kept == {daily[-1].pk, hourly[-1].pk} | {r.pk for r in raw}
+
+    def test_rate_of_transaction_preserved(self):
+        hour = (timezone.now() - timedelta(days=30)).replace(minute=0)
+        rates = self.create_rates(hour, 4, timedelta(minutes=10))
+        TransactionFactory.create(
+            currency=USD,
+            from_wallet__currency=EUR,
+            created=rates[1].created + timedelta(minutes=1)
+        )
+
+        call_command('downsample_rates', stdout=StringIO())
+
+        kept = set(ExchangeRate.objects.values_list('pk', flat=True))
+        assert kept == {rates[1].pk, rates[-1].pk}
+
+    def test_rates_of_transactions_checked_per_batch(self):
+        hour = (timezone.now() - timedelta(days=30)).replace(minute=0)
+        rates = self.create_rates(hour, 5, timedelta(minutes=10))
+        TransactionFactory.create(
+            currency=EUR,
+            created=rates[0].created + timedelta(minutes=1)
+        )
+        TransactionFactory.create(
+            currency=USD,
+            to_wallet__currency=EUR,
+            created=rates[2].created
+        )
+        out = StringIO()
+
+        call_command('downsample_rates', batch_size=1, stdout=out)
+
+        kept = set(ExchangeRate.objects.values_list('pk', flat=True))
+        assert kept == {rates[0].pk, rates[2].pk, rates[-1].pk}
+        assert 'Deleted 2' in out.getvalue()
+
+    def test_dry_run(self):
+        hour = (timezone.now() - timedelta(days=30)).replace(minute=0)
+        self.create_rates(hour, 4, timedelta(minutes=10))
+        out = StringIO()
+
+        call_command('downsample_rates', '--dry-run', stdout=out)
+
+        assert ExchangeRate.objects.count() == 4
+        assert 'Deleted 3' in out.getvalue()
+
+
+class TestClearIdempotencyKeys:
+
+    def test_clear(self, settings):
+        settings.BILLING_IDEMPOTENCY_KEY_TTL = 60
+        user = UserFactory.create()
+        keys = [
+            IdempotencyKey.objects.create(
+                user=user,
+                key=f'key-{index}',
+                fingerprint='fingerprint'
+            )
+            for index in range(3)
+        ]
+        IdempotencyKey.objects.filter(pk__in=[keys[0].pk, keys[1].pk]).update(
+            created=timezone.now() - timedelta(minutes=2)
+        )
+
+        out = StringIO()
+        call_command('clear_idempotency_keys', batch_size=1, stdout=out)
+
+        assert list(IdempotencyKey.objects.values_list('pk', flat=True)) == [
+            keys[2].pk
+        ]
+        assert 'Deleted 2 idempotency keys' in out.getvalue()
+
+
+class TestWalletShards:
+
+    def test_fold(self):
+        wallet = WalletFactory.create(amount=Decimal("1"), shard_count=2)
+        WalletShardFactory.create(wallet=wallet, amount=Decimal("2"))
+        WalletShardFactory.create(wallet=wallet, amount=Decimal("3"))
+        other = WalletShardFactory.create(amount=Decimal("4"))
+
+        out = StringIO()
+        call_command('fold_wallet_shards', stdout=out)
+
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("6")
+        assert not WalletShard.objects.filter(amount__gt=0).exists()
+        other.wallet.refresh_from_db()
+        assert other.wallet.balance == other.wallet.amount
+        assert 'Folded shards of 2 wallets' in out.getvalue()
+
+    def test_set_shards(self):
+        wallet = WalletFactory.create(amount=Decimal("1"))
+
+        call_command(
+            'set_wallet_shards',
+            wallet.user.username,
+            '4',
+            stdout=StringIO()
+        )
+        wallet.refresh_from_db()
+        assert wallet.shard_count == 4
+
+        WalletShardFactory.create(wallet=wallet, amount=Decimal("2"))
+        call_command(
+            'set_wallet_shards',
+            wallet.user.username,
+            '0',
+            stdout=StringIO()
+        )
+        wallet.refresh_from_db()
+        assert wallet.shard_count == 0
+        assert wallet.amount == Decimal("3")
+
+    def test_set_shards_without_wallet(self):
+        user = UserFactory.create()
+
+        with pytest.raises(CommandError):
+            call_command('set_wallet_shards', user.username, '4')
+
+
+class TestRunPaymentWorker:
+
+    def test_once(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        for _ in range(3):
+            enqueue_payment(from_wallet, to_wallet, Decimal("1"), USD)
+
+        out = StringIO()
+        call_command('run_payment_worker', once=True, batch_size=2, stdout=out)
+
+        assert not PaymentIntent.objects.filter(
+            status=PaymentIntent.STATUS.pending
+        ).exists()
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("3")
+        assert 'Processed 3 payment intents' in out.getvalue()
+
+
+class TestCheckpointBalances:
+
+    def test_checkpoint(self, settings):
+        settings.BILLING_CHECKPOINT_LAG = 0
+        first = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        second = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        idle = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(first, Decimal("10"), USD)
+        make_payment(first, second, Decimal("4"), USD)
+
+        out = StringIO()
+        call_command('checkpoint_balances', stdout=out)
+        assert "Created 2 balance checkpoints" in out.getvalue()
+
+        charge(second, Decimal("1"), USD)
+        call_command('checkpoint_balances', batch_size=1, stdout=StringIO())
+
+        assert list(first.checkpoints.values_list('amount', flat=True)) == [
+            Decimal("6")
+        ]
+        assert list(second.checkpoints.values_list('amount', flat=True)) == [
+            Decimal("5"),
+            Decimal("4")
+        ]
+        assert not idle.checkpoints.exists()
+        assert second.balance_at(timezone.now()) == Decimal("5")
+
+    def test_recent_entries_skipped(self, settings):
+        settings.BILLING_CHECKPOINT_LAG = 60
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(wallet, Decimal("10"), USD)
+
+        call_command('checkpoint_balances', stdout=StringIO())
+
+        assert not BalanceCheckpoint.objects.exists()
+
+
+class TestBackfillTransactionAmounts:
+
+    def test_backfill(self):
+        now = timezone.now()
+        ExchangeRateFactory.create(
+            rate=Decimal("2"),
+            currency=EUR,
+            created=now - timedelta(days=2)
+        )
+        ExchangeRateFactory.create(
+            rate=Decimal("4"),
+            currency=EUR,
+            created=now - timedelta(days=1)
+        )
+        from_wallet = WalletFactory.create(currency=EUR)
+        to_wallet = WalletFactory.create(currency=USD)
+        old = TransactionFactory.create(
+            from_wallet=from_wallet,
+            to_wallet=to_wallet,
+            amount=Decimal("8"),
+            currency=EUR,
+            created=now - timedelta(hours=36)
+        )
+        charged = TransactionFactory.create(
+            from_wallet=None,
+            to_wallet=from_wallet,
+            amount=Decimal("1"),
+            currency=USD,
+            created=now
+        )
+        unknown = TransactionFactory.create(
+            from_wallet=from_wallet,
+            to_wallet=to_wallet,
+            amount=Decimal("1"),
+            currency=EUR,
+            created=now - timedelta(days=3)
+        )
+
+        out = StringIO()
+        call_command('backfill_transaction_amounts', batch_size=2, stdout=out)
+
+        assert "Filled 2 transactions, skipped 1" in out.getvalue()
+        old.refresh_from_db()
+        charged.refresh_from_db()
+        unknown.refresh_from_db()
+        assert (old.from_amount, old.to_amount, old.rate) == (
+            Decimal("8"),
+            Decimal("4"),
+            Decimal("0.5")
+        )
+        assert (charged.from_amount, charged.to_amount, charged.rate) == (
+            None,
+            Decimal("4"),
+            Decimal("4")
+        )
+        assert unknown.to_amount is None
+        assert not Transaction.objects.filter(
+            to_amount__isnull=True
+        ).exclude(pk=unknown.pk).exists()
+
+    def test_rates_loaded_with_batch(self, django_assert_max_num_queries):
+        now = timezone.now()
+        ExchangeRateFactory.create(
+            rate=Decimal("2"),
+            currency=EUR,
+            created=now - timedelta(days=1)
+        )
+        wallet = WalletFactory.create(currency=EUR)
+        for hours in range(1, 6):
+            TransactionFactory.create(
+                from_wallet=None,
+                to_wallet=wallet,
+                amount=Decimal("1"),
+                currency=USD,
+                created=now - timedelta(days=1, hours=hours)
+            )
+        filled = TransactionFactory.create(
+            from_wallet=None,
+            to_wallet=wallet,
+            amount=Decimal("1"),
+            currency=USD,
+            created=now
+        )
+
+        out = StringIO()
+        # batches, update of filled rows and its savepoint
+        with django_assert_max_num_queries(5):
+            call_command(
+                'backfill_transaction_amounts',
+                batch_size=10,
+                stdout=out
+            )
+
+        assert "Filled 1 transactions, skipped 5" in out.getvalue()
+        filled.refresh_from_db()
+        assert filled.to_amount == Decimal("2")
+
+
+class TestReconcileWallets:
+
+    def reconcile(self, **options):
+        out = StringIO()
+        call_command('reconcile_wallets', stdout=out, **options)
+        return out.getvalue()
+
+    def test_balances_match(self, settings):
+        settings.BILLING_CHECKPOINT_LAG = 0
+        first = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        second = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD,
+            shard_count=2
+        )
+        charge(first, Decimal("10"), USD)
+        make_payment(first, second, Decimal("4"), USD)
+
+        out = self.reconcile(chunk_size=1)
+
+        assert "Reconciled 2 wallets, found 0 discrepancies" in out
+        assert dict(
+            ReconciliationMark.objects.values_list('wallet', 'amount')
+        ) == {first.pk: Decimal("6"), second.pk: Decimal("4")}
+
+    def test_discrepancy(self, settings):
+        settings.BILLING_CHECKPOINT_LAG = 0
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(wallet, Decimal("10"), USD)
+        Wallet.objects.filter(pk=wallet.pk).update(amount=Decimal("15"))
+
+        assert "found 1 discrepancies" in self.reconcile()
+        assert "found 1 discrepancies" in self.reconcile()
+
+        discrepancy = WalletDiscrepancy.objects.first()
+        assert discrepancy.wallet_id == wallet.pk
+        assert discrepancy.expected == Decimal("10")
+        assert discrepancy.actual == Decimal("15")
+
+    def test_reads_transactions_since_mark(self, settings):
+        settings.BILLING_CHECKPOINT_LAG = 0
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(wallet, Decimal("10"), USD)
+        self.reconcile()
+        # transactions before mark aren`t summed again
+        ReconciliationMark.objects.update(amount=Decimal("50"))
+        charge(wallet, Decimal("1"), USD)
+
+        assert "found 1 discrepancies" in self.reconcile()
+        discrepancy = WalletDiscrepancy.objects.get()
+        assert discrepancy.expected == Decimal("51")
+        assert discrepancy.actual == Decimal("11")
+        assert ReconciliationMark.objects.get().amount == Decimal("51")
+
+    def test_recent_transactions(self, settings):
+        settings.BILLING_CHECKPOINT_LAG = 60
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(wallet, Decimal("10"), USD)
+
+        assert "found 0 discrepancies" in self.reconcile()
+        mark = ReconciliationMark.objects.get()
+        assert mark.amount == Decimal("0")
+        assert mark.created < Transaction.objects.get().created
+
+    def test_reconciled_before_backfill(self, settings):
+        settings.BILLING_CHECKPOINT_LAG = 0
+        from_wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        to_wallet = WalletFactory.create(amount=Decimal("10"), currency=USD)
+        Wallet.objects.filter(pk=from_wallet.pk).update(amount=Decimal("-10"))
+        # legacy payment without amounts
+        TransactionFactory.create(
+            from_wallet=from_wallet,
+            to_wallet=to_wallet,
+            amount=Decimal("10"),
+            currency=USD,
+            created=timezone.now() - timedelta(hours=1)
+        )
+
+        out = self.reconcile()
+
+        assert "found 0 discrepancies, skipped 2" in out
+        assert not ReconciliationMark.objects.exists()
+
+        call_command('backfill_transaction_amounts', stdout=StringIO())
+        out = self.reconcile()
+
+        assert "found 0 discrepancies, skipped 0" in out
+        assert not WalletDiscrepancy.objects.exists()
+        assert dict(
+            ReconciliationMark.objects.values_list('wallet', 'amount')
+        ) == {from_wallet.pk: Decimal("-10"), to_wallet.pk: Decimal("10")}
+
+
+class TestReplayWallets:
+
+    def create_wallets(self):
+        first = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        second = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD,
+            shard_count=2
+        )
+        third = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(first, Decimal("10"), USD)
+        make_payment(first, second, Decimal("4"), USD)
+        make_payment(first, third, Decimal("1"), USD)
+        Wallet.objects.filter(pk=first.pk).update(amount=Decimal("7"))
+        WalletShard.objects.filter(wallet=second).update(amount=Decimal("3"))
+        return first, second, third
+
+    def replay(self, **options):
+        out = StringIO()
+        call_command('replay_wallets', workers=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_compare(self):
+        first, second, third = self.create_wallets()
+
+        out = self.replay(range_size=2)
+
+        assert "2/2 ranges" in out
+        assert "Replayed 3 wallets, found 2 mismatches" in out
+        assert dict(
+            WalletDiscrepancy.objects.values_list('wallet', 'expected')
+        ) == {first.pk: Decimal("5"), second.pk: Decimal("4")}
+        first.refresh_from_db()
+        assert first.amount == Decimal("7")
+
+    def test_apply(self):
+        first, second, third = self.create_wallets()
+
+        out = self.replay(apply=True)
+
+        assert "Replayed 3 wallets, applied 2 mismatches" in out
+        first.refresh_from_db()
+        second.refresh_from_db()
+        third.refresh_from_db()
+        assert first.amount == Decimal("5")
+        assert second.balance == Decimal("4")
+        assert third.amount == Decimal("1")
+        assert not WalletDiscrepancy.objects.exists()
+
+    def test_resume(self, tmp_path):
+        first, second, third = self.create_wallets()
+        state = tmp_path / 'replay.json'
+        state.write_text(
+            '{"range_size": 1, "apply": false, "done": [%d]}' % first.pk
+        )
+
+        out = self.replay(range_size=1, state=str(state))
+
+        assert "3/3 ranges" in out
+        assert "Replayed 2 wallets, found 1 mismatches" in out
+        assert list(
+            WalletDiscrepancy.objects.values_list('wallet', flat=True)
+        ) == [second.pk]
+        out = self.replay(range_size=1, state=str(state))
+        assert "Replayed 0 wallets" in out
+
+    def test_opening_checkpoint(self):
+        wallet = WalletFactory.create(amount=Decimal("100"), currency=USD)
+        opened = timezone.now() - timedelta(days=1)
+        # history before opening checkpoint is in its amount
+        TransactionFactory.create(
+            from_wallet=None,
+            to_wallet=wallet,
+            created=opened - timedelta(days=1)
+        )
+        BalanceCheckpoint.objects.create(
+            wallet=wallet,
+            amount=Decimal("100"),
+            created=opened
+        )
+        charge(wallet, Decimal("5"), USD)
+
+        out = self.replay(apply=True)
+
+        assert "Replayed 1 wallets, applied 0 mismatches, skipped 0" in out
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("105")
+
+    def test_transactions_without_amounts(self):
+        wallet = WalletFactory.create(amount=Decimal("100"), currency=USD)
+        TransactionFactory.create(from_wallet=None, to_wallet=wallet)
+
+        out = self.replay(apply=True)
+
+        assert f"transactions without amounts: {wallet.pk}" in out
+        assert "applied 0 mismatches, skipped 1" in out
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("100")
+        out = self.replay()
+        assert "found 0 mismatches, skipped 1" in out
+        assert not WalletDiscrepancy.objects.exists()
+
+    def test_resume_with_other_options(self, tmp_path):
+        state = tmp_path / 'replay.json'
+        state.write_text('{"range_size": 1, "apply": false, "done": []}')
+
+        with pytest.raises(CommandError):
+            self.replay(range_size=2, state=str(state))
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != 'fork',
+    reason='spawned processes can`t see in-memory test database'
+)
+def test_replay_wallets_with_pool():
+    # forked processes get copy of in-memory database, so only reported
+    # results are checked
+    wallets = WalletFactory.create_batch(
+        5,
+        amount=Decimal("0"),
+        currency=USD
+    )
+    for wallet in wallets:
+        charge(wallet, Decimal("2"), USD)
+    Wallet.objects.filter(
+        pk__in=[wallets[0].pk, wallets[4].pk]
+    ).update(amount=Decimal("1"))
+
+    out = StringIO()
+    call_command('replay_wallets', workers=2, range_size=2, stdout=out)
+
+    assert "3/3 ranges" in out.getvalue()
+    assert "Replayed 5 wallets, found 2 mismatches" in out.getvalue()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(
+    connection.vendor != 'postgresql',
+    reason='pool processes can`t see in-memory test database'
+)
+def test_replay_wallets_with_pool_applied():
+    wallets = WalletFactory.create_batch(
+        6,
+        amount=Decimal("0"),
+        currency=USD
+    )
+    for wallet in wallets:
+        charge(wallet, Decimal("2"), USD)
+    Wallet.objects.filter(
+        pk__in=[wallets[0].pk, wallets[5].pk]
+    ).update(amount=Decimal("1"))
+
+    out = StringIO()
+    call_command(
+        'replay_wallets',
+        workers=2,
+        range_size=2,
+        apply=True,
+        stdout=out
+    )
+
+    assert "Replayed 6 wallets, applied 2 mismatches" in out.getvalue()
+    assert set(
+        Wallet.objects.values_list('amount', flat=True)
+    ) == {Decimal("2")}
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.db.models import Sum
+from django.shortcuts import reverse
+from rest_framework.test import APIClient
+
+from .factories import WalletFactory
+from ..constants import USD
+from ..exceptions import NotEnoughMoneyException
+from ..models import Wallet, Transaction, PaymentIntent
+from ..utils import (
+    charge,
+    enqueue_payment,
+    make_payment,
+    make_payout,
+    process_payment_intents
+)
+
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.skipif(
+        connection.vendor != 'postgresql',
+        reason='row locks are checked against PostgreSQL only'
+    ),
+]
+
+THREADS = 16
+PAYMENTS = 50
+
+
+def run_threads(target):
+    errors = []
+
+    def worker(seed):
+        try:
+            target(random.Random(seed))
+        except Exception as e:  # noqa
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=worker, args=(seed,))
+        for seed in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors
+
+
+class TestConcurrentPayments:
+
+    def test_money_is_kept(self):
+        wallets = WalletFactory.create_batch(
+            4,
+            amount=Decimal("100"),
+            currency=USD
+        )
+        pks = [wallet.pk for wallet in wallets]
+        succeeded = []
+
+        def pay(rnd):
+            for _ in range(PAYMENTS):
+                # opposite directions to provoke deadlocks
+                from_pk, to_pk = rnd.sample(pks, 2)
+                try:
+                    make_payment(
+                        Wallet.objects.get(pk=from_pk),
+                        Wallet.objects.get(pk=to_pk),
+                        Decimal(rnd.randint(1, 30)),
+                        USD
+                    )
+                except NotEnoughMoneyException:
+                    continue
+                succeeded.append(1)
+
+        run_threads(pay)
+
+        total = Wallet.objects.aggregate(total=Sum('amount'))['total']
+        assert total == Decimal("400")
+        assert not Wallet.objects.filter(amount__lt=0).exists()
+        assert Transaction.objects.count() == len(succeeded)
+
+    def test_payouts_with_payments(self):
+        wallets = WalletFactory.create_batch(
+            4,
+            amount=Decimal("100"),
+            currency=USD
+        )
+        pks = [wallet.pk for wallet in wallets]
+
+        def pay(rnd):
+            for _ in range(PAYMENTS):
+                from_pk, *to_pks = rnd.sample(pks, 4)
+                try:
+                    if rnd.random() < 0.5:
+                        make_payout(Wallet.objects.get(pk=from_pk), [
+                            (Wallet.objects.get(pk=to_pk), Decimal("1"), USD)
+                            for to_pk in to_pks
+                        ])
+                    else:
+                        make_payment(
+                            Wallet.objects.get(pk=from_pk),
+                            Wallet.objects.get(pk=to_pks[0]),
+                            Decimal(rnd.randint(1, 30)),
+                            USD
+                        )
+                except NotEnoughMoneyException:
+                    continue
+
+        run_threads(pay)
+
+        total = Wallet.objects.aggregate(total=Sum('amount'))['total']
+        assert total == Decimal("400")
+        assert not Wallet.objects.filter(amount__lt=0).exists()
+
+    def test_charges_are_not_lost(self):
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+
+        def top_up(rnd):
+            for _ in range(PAYMENTS):
+                charge(Wallet.objects.get(pk=wallet.pk), Decimal("1"), USD)
+
+        run_threads(top_up)
+
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal(THREADS * PAYMENTS)
+
+    def test_credits_of_hot_wallet(self):
+        wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD,
+            shard_count=8
+        )
+        payers = WalletFactory.create_batch(
+            THREADS,
+            amount=Decimal(PAYMENTS),
+            currency=USD
+        )
+
+        def pay(rnd):
+            payer = payers.pop()
+            for _ in range(PAYMENTS):
+                make_payment(payer, wallet, Decimal("1"), USD)
+
+        run_threads(pay)
+
+        wallet.refresh_from_db()
+        assert wallet.balance == Decimal(THREADS * PAYMENTS)
+        assert wallet.shards.count() <= 8
+
+
+class TestConcurrentIdempotentRequests:
+
+    def test_duplicates_wait_for_first(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        responses = []
+
+        def pay(rnd):
+            client = APIClient()
+            client.force_authenticate(from_wallet.user)
+            responses.append(client.post(
+                reverse('api_v1:users:payment'),
+                {
+                    'to_user': to_wallet.user.get_username(),
+                    'amount': 5,
+                    'currency': USD,
+                },
+                HTTP_IDEMPOTENCY_KEY='payment-1'
+            ))
+
+        run_threads(pay)
+
+        assert {response.status_code for response in responses} == {201}
+        assert len({str(response.data) for response in responses}) == 1
+        assert Transaction.objects.count() == 1
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("5")
+
+
+class TestConcurrentPaymentWorkers:
+
+    def test_intents_are_made_once(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("1000"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        for _ in range(THREADS * 10):
+            enqueue_payment(from_wallet, to_wallet, Decimal("1"), USD)
+
+        def work(rnd):
+            while process_payment_intents(5):
+                pass
+
+        run_threads(work)
+
+        assert not PaymentIntent.objects.filter(
+            status=PaymentIntent.STATUS.pending
+        ).exists()
+        assert Transaction.objects.count() == THREADS * 10
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal(THREADS * 10)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+import pytest
+from django.db import IntegrityError, OperationalError, transaction
+
+from .factories import WalletFactory
+from .. import utils
+from ..constants import USD
+from ..db import retry_atomic, retry_stats
+from ..models import Transaction
+from ..utils import charge, make_payout
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+class PgError(Exception):
+
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+def aborted(pgcode: str) -> OperationalError:
+    error = OperationalError(f"aborted with {pgcode}")
+    error.__cause__ = PgError(pgcode)
+    return error
+
+
+@pytest.fixture(autouse=True)
+def retry_settings(settings):
+    settings.BILLING_RETRY_ATTEMPTS = 3
+    settings.BILLING_RETRY_BASE_DELAY = 0
+    settings.BILLING_RETRY_MAX_DELAY = 0
+
+
+class TestRetryAtomic:
+
+    def test_retry_rolls_back_attempt(self):
+        wallet = WalletFactory.create(currency=USD)
+        errors = [aborted('40P01'), aborted('40001')]
+
+        @retry_atomic
+        def pay():
+            Transaction.objects.create(
+                to_wallet=wallet,
+                amount=Decimal("1"),
+                currency=USD
+            )
+            if errors:
+                raise errors.pop()
+            return 'done'
+
+        assert pay() == 'done'
+        assert Transaction.objects.count() == 1
+        assert retry_stats.stats() == {'retries': 2, 'exhausted': 0}
+
+    def test_attempts_exhausted(self):
+        calls = []
+
+        @retry_atomic
+        def pay():
+            calls.append(1)
+            raise aborted('40001')
+
+        with pytest.raises(OperationalError):
+            pay()
+
+        assert len(calls) == 3
+        assert retry_stats.stats() == {'retries': 2, 'exhausted': 1}
+
+    def test_other_errors_arent_retried(self):
+        calls = []
+
+        @retry_atomic
+        def pay():
+            calls.append(1)
+            raise IntegrityError("duplicate key")
+
+        with pytest.raises(IntegrityError):
+            pay()
+
+        assert len(calls) == 1
+        assert retry_stats.stats() == {'retries': 0, 'exhausted': 0}
+
+    def test_no_retry_inside_transaction(self):
+        calls = []
+
+        @retry_atomic
+        def pay():
+            calls.append(1)
+            raise aborted('40001')
+
+        with pytest.raises(OperationalError):
+            with transaction.atomic():
+                pay()
+
+        assert len(calls) == 1
+
+
+class TestRetriedOperations:
+
+    @pytest.fixture
+    def deadlock_once(self, monkeypatch):
+        def patch(name: str):
+            errors = [aborted('40P01')]
+            original = getattr(utils, name)
+
+            def func(*args, **kwargs):
+                original(*args, **kwargs)
+                if errors:
+                    raise errors.pop()
+
+            monkeypatch.setattr(utils, name, func)
+        return patch
+
+    def test_charge(self, deadlock_once):
+        wallet = WalletFactory.create(amount=Decimal("10"), currency=USD)
+        deadlock_once('create_entries')
+
+        charge(wallet, Decimal("5"), USD)
+
+        assert retry_stats.stats() == {'retries': 1, 'exhausted': 0}
+        assert wallet.amount == Decimal("15")
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("15")
+
+    def test_payout(self, deadlock_once):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        deadlock_once('create_transactions')
+
+        make_payout(from_wallet, [(to_wallet, Decimal("4"), USD)])
+
+        assert retry_stats.stats() == {'retries': 1, 'exhausted': 0}
+        assert from_wallet.amount == Decimal("6")
+        assert to_wallet.amount == Decimal("4")
@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
 from decimal import Decimal
 
 import pytest
 from django.db.models import QuerySet
+from django.utils import timezone
 
 from .factories import ExchangeRateFactory, WalletFactory, TransactionFactory
-from ..models import ExchangeRate
-from ..constants import USD, CAD, EUR
+from ..models import (
+    BalanceCheckpoint,
+    ExchangeRate,
+    CurrentRate,
+    Transaction
+)
+from ..utils import charge
+from ..constants import USD, CAD, EUR, HOUR
 
 pytestmark = pytest.mark.django_db
 
@@ -147,3 +155,211 @@ class TestWallet:
 
         assert isinstance(first_wallet.transactions, QuerySet)
         assert first_wallet.transactions.count() == 24
+
+    def test_balance_at(self):
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(wallet, Decimal("1"), USD)
+        charge(wallet, Decimal("2"), USD)
+        first, second = wallet.entries.order_by('pk')
+
+        assert wallet.balance_at(first.created) == Decimal("1")
+        assert wallet.balance_at(second.created) == Decimal("3")
+        assert wallet.balance_at(
+            first.created - timedelta(seconds=1)
+        ) == Decimal("0")
+
+    def test_balance_at_from_checkpoint(self, django_assert_num_queries):
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        charge(wallet, Decimal("1"), USD)
+        moment = wallet.entries.get().created
+        # checkpoint covers entries that aren`t read anymore
+        BalanceCheckpoint.objects.create(
+            wallet=wallet,
+            amount=Decimal("50"),
+            created=moment
+        )
+        charge(wallet, Decimal("2"), USD)
+
+        with django_assert_num_queries(2):
+            assert wallet.balance_at(timezone.now()) == Decimal("52")
+        assert wallet.balance_at(moment) == Decimal("50")
+
+
+class TestCurrentRate:
+
+    def test_created_with_first_rate(self):
+        rate = ExchangeRateFactory.create(currency=CAD)
+
+        current = CurrentRate.objects.get(pk=CAD)
+        assert current.exchange_rate_id == rate.pk
+        assert current.created == rate.created
+
+    def test_moved_to_latest_rate(self):
+        ExchangeRateFactory.create_batch(3, currency=CAD)
+        latest = ExchangeRateFactory.create(currency=CAD)
+
+        assert CurrentRate.objects.get(pk=CAD).exchange_rate_id == latest.pk
+        assert CurrentRate.objects.count() == 1
+
+    def test_older_rate_ignored(self):
+        latest = ExchangeRateFactory.create(currency=CAD)
+        ExchangeRateFactory.create(
+            currency=CAD,
+            created=latest.created - timedelta(hours=1)
+        )
+
+        assert CurrentRate.objects.get(pk=CAD).exchange_rate_id == latest.pk
+
+
+class TestExchangeRateAt:
+
+    def test_rate_at_moment(self):
+        first = ExchangeRateFactory.create(rate=Decimal("2"), currency=CAD)
+        second = ExchangeRateFactory.create(
+            rate=Decimal("3"),
+            currency=CAD,
+            created=first.created + timedelta(hours=1)
+        )
+
+        assert ExchangeRate.of(
+            CAD,
+            at=first.created + timedelta(minutes=30)
+        ) == Decimal("2")
+        exchange_rate = ExchangeRate.of(
+            CAD,
+            as_object=True,
+            at=second.created
+        )
+        assert isinstance(exchange_rate, ExchangeRate)
+        assert exchange_rate.pk == second.pk
+        assert ExchangeRate.of(USD, at=first.created) == Decimal("1")
+
+    def test_rate_not_set_at_moment(self):
+        rate = ExchangeRateFactory.create(currency=CAD)
+
+        with pytest.raises(ValueError):
+            ExchangeRate.of(CAD, at=rate.created - timedelta(seconds=1))
+
+    def test_of_many_with_one_query(self, django_assert_num_queries):
+        first = ExchangeRateFactory.create(rate=Decimal("2"), currency=CAD)
+        start = first.created
+        for hours, rate in [(1, "3"), (2, "4"), (3, "5")]:
+            ExchangeRateFactory.create(
+                rate=Decimal(rate),
+                currency=CAD,
+                created=start + timedelta(hours=hours)
+            )
+        ExchangeRateFactory.create(
+            rate=Decimal("7"),
+            currency=EUR,
+            created=start
+        )
+
+        moments = [
+            (CAD, start + timedelta(minutes=90)),
+            (CAD, start + timedelta(hours=5)),
+            (EUR, start + timedelta(hours=2)),
+            (USD, start),
+        ]
+        with django_assert_num_queries(1):
+            rates = ExchangeRate.of_many(moments)
+
+        assert rates == {
+            moments[0]: Decimal("3"),
+            moments[1]: Decimal("5"),
+            moments[2]: Decimal("7"),
+            moments[3]: Decimal("1"),
+        }
+
+    def test_of_many_rate_not_set(self):
+        rate = ExchangeRateFactory.create(currency=CAD)
+
+        with pytest.raises(ValueError):
+            ExchangeRate.of_many([
+                (CAD, rate.created - timedelta(seconds=1))
+            ])
+
+    def test_transactions_with_rates(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        transaction = TransactionFactory.create(
+            currency=EUR,
+            from_wallet=WalletFactory.create(currency=USD),
+            to_wallet=WalletFactory.create(currency=EUR)
+        )
+        ExchangeRateFactory.create(rate=Decimal("3"), currency=EUR)
+
+        annotated = Transaction.objects.with_rates().get(pk=transaction.pk)
+        assert annotated.currency_rate == Decimal("2")
+        assert annotated.from_wallet_rate == Decimal("1")
+        assert annotated.to_wallet_rate == Decimal("2")
+
+
+class TestExchangeRateOHLC:
+
+    def test_aggregate_by_hour(self, django_assert_num_queries):
+        start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for minutes, rate in [(0, "3"), (10, "5"), (20, "1"), (30, "2"),
+                              (60, "4"), (70, "6")]:
+            ExchangeRateFactory.create(
+                rate=Decimal(rate),
+                currency=CAD,
+                created=start + timedelta(minutes=minutes)
+            )
+        ExchangeRateFactory.create(rate=Decimal("9"), currency=EUR)
+
+        with django_assert_num_queries(2):
+            buckets = ExchangeRate.ohlc(CAD, HOUR, since=start)
+
+        assert buckets == [
+            {
+                'bucket': start,
+                'open': Decimal("3"),
+                'high': Decimal("5"),
+                'low': Decimal("1"),
+                'close': Decimal("2"),
+            },
+            {
+                'bucket': start + timedelta(hours=1),
+                'open': Decimal("4"),
+                'high': Decimal("6"),
+                'low': Decimal("4"),
+                'close': Decimal("6"),
+            },
+        ]
+
+    def test_limit(self):
+        start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for hours in range(3):
+            ExchangeRateFactory.create(
+                currency=CAD,
+                created=start + timedelta(hours=hours)
+            )
+
+        buckets = ExchangeRate.ohlc(CAD, HOUR, since=start, limit=2)
+
+        assert [item['bucket'] for item in buckets] == [
+            start,
+            start + timedelta(hours=1)
+        ]
+
+    def test_limit_with_gaps(self, django_assert_num_queries):
+        start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for hours in [0, 5, 6]:
+            ExchangeRateFactory.create(
+                currency=CAD,
+                created=start + timedelta(hours=hours, minutes=10)
+            )
+
+        # every window is started by query of its first bucket
+        with django_assert_num_queries(5):
+            buckets = ExchangeRate.ohlc(
+                CAD,
+                HOUR,
+                since=start + timedelta(minutes=5),
+                limit=2
+            )
+
+        assert [item['bucket'] for item in buckets] == [
+            start,
+            start + timedelta(hours=5)
+        ]
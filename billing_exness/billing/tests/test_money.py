@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.db.models import Sum
+
+from .factories import WalletFactory, TransactionFactory
+from ..models import Wallet, Transaction
+from ..money import from_minor, to_minor
+from ..utils import shift_amount
+
+pytestmark = pytest.mark.django_db
+
+
+class TestMinorUnits:
+
+    def test_to_minor(self):
+        assert to_minor(Decimal("10.55"), 2) == 1055
+        assert to_minor(Decimal("0.005"), 2) == 1
+        assert to_minor(Decimal("-0.005"), 2) == -1
+        assert to_minor(Decimal("7"), 0) == 7
+
+    def test_from_minor(self):
+        assert from_minor(1055, 2) == Decimal("10.55")
+        assert str(from_minor(100, 2)) == "1.00"
+
+
+class TestMinorUnitsField:
+
+    def test_stored_as_integer(self):
+        wallet = WalletFactory.create(amount=Decimal("10.55"))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT amount FROM {Wallet._meta.db_table} WHERE id = %s",
+                [wallet.pk]
+            )
+            assert cursor.fetchone()[0] == 1055
+
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("10.55")
+
+    def test_lookup_and_sum(self):
+        TransactionFactory.create(amount=Decimal("0.10"))
+        TransactionFactory.create(amount=Decimal("0.20"))
+
+        assert Transaction.objects.filter(amount__gt="0.1").count() == 1
+        assert Transaction.objects.aggregate(
+            total=Sum('amount')
+        )['total'] == Decimal("0.30")
+
+    def test_shift_amount(self):
+        wallet = WalletFactory.create(amount=Decimal("1.10"))
+
+        assert shift_amount(wallet, Decimal("0.25"))
+        assert not shift_amount(wallet, Decimal("-1.36"))
+        assert shift_amount(wallet, Decimal("-1.35"))
+
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("0")
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from ..pubsub import InMemoryPubSub
+
+
+class TestInMemoryPubSub:
+
+    def test_publish(self):
+        pubsub = InMemoryPubSub()
+
+        assert pubsub.version('rates') == 0
+        assert pubsub.publish('rates', {'rate': 1}) == 1
+        assert pubsub.publish('rates', {'rate': 2}) == 2
+        assert pubsub.publish('other', {'rate': 3}) == 1
+
+        assert pubsub.listen('rates', 0, 0) == [
+            (1, {'rate': 1}),
+            (2, {'rate': 2}),
+        ]
+        assert pubsub.listen('rates', 1, 0) == [(2, {'rate': 2})]
+
+    def test_listen_timeout(self):
+        pubsub = InMemoryPubSub()
+        pubsub.publish('rates', {'rate': 1})
+
+        assert pubsub.listen('rates', 1, 0.01) == []
+
+    def test_listen_wakes_up(self):
+        pubsub = InMemoryPubSub()
+        timer = threading.Timer(
+            0.05,
+            pubsub.publish,
+            args=('rates', {'rate': 1})
+        )
+        timer.start()
+
+        assert pubsub.listen('rates', 0, 5) == [(1, {'rate': 1})]
+        timer.join()
+
+    def test_keeps_latest_messages(self):
+        pubsub = InMemoryPubSub(size=2)
+        for rate in range(3):
+            pubsub.publish('rates', {'rate': rate})
+
+        assert [version for version, _ in pubsub.listen('rates', 0, 0)] == [
+            2,
+            3
+        ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+import pytest
+
+from .factories import ExchangeRateFactory
+from ..constants import USD, EUR, CAD
+from ..exceptions import InvalidQuoteException
+from ..quotes import make_quote, read_quote
+
+pytestmark = pytest.mark.django_db
+
+
+class TestQuotes:
+
+    def test_read_quote(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=CAD)
+
+        token, snapshot, expires = make_quote([USD, EUR, CAD])
+        ExchangeRateFactory.create(rate=Decimal("3"), currency=EUR)
+
+        quoted = read_quote(token)
+        assert quoted.get(EUR, CAD) == Decimal("2")
+        assert quoted.rates == snapshot.rates
+
+    def test_rate_not_set(self):
+        with pytest.raises(ValueError):
+            make_quote([EUR])
+
+    def test_broken_quote(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        token, _, _ = make_quote([EUR])
+
+        with pytest.raises(InvalidQuoteException):
+            read_quote(token[:-1])
+
+    def test_expired_quote(self, settings):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        token, _, _ = make_quote([EUR])
+
+        settings.BILLING_QUOTE_TTL = -1
+        with pytest.raises(InvalidQuoteException):
+            read_quote(token)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+import pytest
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .factories import ExchangeRateFactory, WalletFactory
+from ..constants import USD, EUR, CAD, CNY
+from ..models import ExchangeRate
+from ..rates import RateSnapshot, rate_cache, VERSION_KEY
+from ..utils import charge, make_payment
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.mark.django_db(transaction=True)
+class TestRateCache:
+
+    def test_miss_then_hit(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+
+        assert ExchangeRate.of(EUR) == Decimal("2")
+        assert ExchangeRate.of(EUR) == Decimal("2")
+
+        assert rate_cache.stats() == {'hits': 1, 'misses': 1}
+
+    def test_invalidated_on_insert(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        assert ExchangeRate.of(EUR) == Decimal("2")
+
+        ExchangeRateFactory.create(rate=Decimal("3"), currency=EUR)
+        assert ExchangeRate.of(EUR) == Decimal("3")
+
+    def test_not_cached_before_commit(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+
+        with pytest.raises(ZeroDivisionError):
+            with transaction.atomic():
+                ExchangeRateFactory.create(rate=Decimal("9"), currency=EUR)
+                assert ExchangeRate.of(EUR) == Decimal("9")
+                assert ExchangeRate.of(EUR) == Decimal("9")
+                1 / 0
+
+        assert ExchangeRate.of(EUR) == Decimal("2")
+
+    def test_cached_after_rollback(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        with pytest.raises(ZeroDivisionError):
+            with transaction.atomic():
+                ExchangeRateFactory.create(rate=Decimal("9"), currency=EUR)
+                1 / 0
+
+        with transaction.atomic():
+            with pytest.raises(ZeroDivisionError):
+                with transaction.atomic():
+                    ExchangeRateFactory.create(
+                        rate=Decimal("9"),
+                        currency=EUR
+                    )
+                    1 / 0
+            for _ in range(5):
+                assert ExchangeRate.of(EUR) == Decimal("2")
+
+        assert rate_cache.stats() == {'hits': 4, 'misses': 1}
+
+    def test_reloads_on_shared_version_change(self, settings):
+        settings.BILLING_RATE_CACHE_CHECK_INTERVAL = 0
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        ExchangeRate.of(EUR)
+
+        # rate has been changed by other process
+        ExchangeRate.objects.filter(currency=EUR).update(rate=Decimal("5"))
+        cache.set(VERSION_KEY, 'changed-by-other-process')
+
+        assert ExchangeRate.of(EUR) == Decimal("5")
+        assert rate_cache.misses == 2
+
+    def test_keeps_rates_until_check_interval(self, settings):
+        settings.BILLING_RATE_CACHE_CHECK_INTERVAL = 60
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        ExchangeRate.of(EUR)
+
+        cache.set(VERSION_KEY, 'changed-by-other-process')
+
+        assert ExchangeRate.of(EUR) == Decimal("2")
+        assert rate_cache.misses == 1
+
+    def test_payment_without_rate_queries(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=CAD)
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=EUR
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=CAD
+        )
+        ExchangeRate.get(EUR, CAD)
+
+        with CaptureQueriesContext(connection) as context:
+            make_payment(from_wallet, to_wallet, Decimal("1"), EUR)
+
+        assert not [
+            query for query in context.captured_queries
+            if ExchangeRate._meta.db_table in query['sql']
+        ]
+
+
+class TestRateSnapshot:
+
+    def test_load_with_one_query(self, django_assert_num_queries):
+        ExchangeRateFactory.create_batch(3, currency=EUR)
+        latest = ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=CAD)
+
+        with django_assert_num_queries(1):
+            snapshot = RateSnapshot.load()
+
+        assert snapshot.of(EUR) == Decimal("2")
+        exchange_rate = snapshot.of(EUR, as_object=True)
+        assert isinstance(exchange_rate, ExchangeRate)
+        assert exchange_rate.pk == latest.pk
+        assert snapshot.get(EUR, CAD) == Decimal("2")
+        assert snapshot.get(CAD, USD) == Decimal("0.25")
+
+    def test_rate_not_set(self):
+        snapshot = RateSnapshot({EUR: Decimal("2")})
+
+        assert snapshot.get(EUR, EUR) == Decimal("1")
+        with pytest.raises(ValueError):
+            snapshot.of(CNY)
+        with pytest.raises(ValueError):
+            snapshot.get(EUR, CNY)
+
+    def test_wrong_currency(self):
+        snapshot = RateSnapshot({EUR: Decimal("2")})
+
+        with pytest.raises(AssertionError):
+            snapshot.get(EUR, 'RUR')
+
+    def test_payment_with_snapshot(self):
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=EUR)
+        snapshot = RateSnapshot({EUR: Decimal("2")})
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=EUR
+        )
+
+        make_payment(from_wallet, to_wallet, Decimal("2"), EUR, snapshot)
+        charge(to_wallet, Decimal("1"), USD, snapshot)
+
+        from_wallet.refresh_from_db()
+        to_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("9")
+        assert to_wallet.amount == Decimal("4")
+        assert to_wallet.amount_in(USD, snapshot) == Decimal("2")
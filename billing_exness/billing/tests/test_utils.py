@@ -2,11 +2,34 @@
 from decimal import Decimal
 
 import pytest
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
 
 from ..constants import USD, CAD, EUR, CNY
-from ..utils import charge, make_payment, get_wallet
-from billing_exness.billing.exceptions import NotEnoughMoneyException
-from .factories import WalletFactory, ExchangeRateFactory
+from ..models import Transaction, WalletShard, PaymentIntent, LedgerEntry
+from ..rates import RateSnapshot
+from ..utils import (
+    Transfer,
+    charge,
+    enqueue_payment,
+    fold_shards,
+    get_wallet,
+    make_payment,
+    make_payments,
+    make_payout,
+    process_payment_intents,
+    resolve_wallets
+)
+from billing_exness.billing.exceptions import (
+    NotEnoughMoneyException,
+    BatchPaymentException
+)
+from .factories import (
+    WalletFactory,
+    WalletShardFactory,
+    ExchangeRateFactory
+)
 from billing_exness.users.tests.factories import UserFactory
 
 pytestmark = pytest.mark.django_db
@@ -84,6 +107,56 @@ class TestCharge:
         assert updated_wallet.amount == Decimal("125")
 
 
+class TestResolveWallets:
+
+    def test_one_query(self, django_assert_num_queries):
+        from_wallet = WalletFactory.create(currency=USD)
+        to_wallet = WalletFactory.create(currency=USD)
+        username = to_wallet.user.get_username()
+
+        with django_assert_num_queries(1):
+            payer, payee = resolve_wallets(from_wallet.user, username)
+            assert payee.user.get_username() == username
+
+        assert payer.pk == from_wallet.pk
+        assert payer.user is from_wallet.user
+        assert payee.pk == to_wallet.pk
+
+    def test_passed_wallet_refreshed(self):
+        from_wallet = WalletFactory.create(amount=Decimal("1"), currency=USD)
+        to_wallet = WalletFactory.create(currency=USD)
+        from_wallet.amount = Decimal("100")
+
+        payer, _ = resolve_wallets(from_wallet, to_wallet.user)
+
+        assert payer is from_wallet
+        assert payer.amount == Decimal("1")
+
+    def test_hot_payee(self, django_assert_num_queries):
+        from_wallet = WalletFactory.create(currency=USD)
+        to_wallet = WalletFactory.create(currency=USD, shard_count=4)
+
+        with django_assert_num_queries(2):
+            _, payee = resolve_wallets(from_wallet, to_wallet.user)
+
+        assert payee.pk == to_wallet.pk
+
+    def test_unknown_user(self):
+        wallet = WalletFactory.create(currency=USD)
+
+        with pytest.raises(ValueError, match="doesn`t exist"):
+            resolve_wallets(wallet, 'unknown')
+
+    def test_user_without_wallet(self):
+        wallet = WalletFactory.create(currency=USD)
+        user = UserFactory.create()
+
+        with pytest.raises(ValueError, match="hasn`t got wallet"):
+            resolve_wallets(user, wallet)
+        with pytest.raises(ValueError, match="hasn`t got wallet"):
+            resolve_wallets(wallet, user.get_username())
+
+
 class TestMakePayment:
 
     def test_not_enough_money_same_currency(self):
@@ -263,3 +336,596 @@ class TestMakePayment:
 
         with pytest.raises(AssertionError):
             make_payment(from_wallet, to_wallet, Decimal("-4"), EUR)
+
+    def test_same_wallet(self):
+        wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+
+        with pytest.raises(ValueError):
+            make_payment(wallet, wallet.user, Decimal("4"), USD)
+
+    def test_not_enough_money_keeps_amounts(self):
+        # credit of wallet with lower pk is applied before failed debit
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+
+        with pytest.raises(NotEnoughMoneyException):
+            make_payment(from_wallet, to_wallet, Decimal("11"), USD)
+
+        from_wallet.refresh_from_db()
+        to_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("10")
+        assert to_wallet.amount == Decimal("1")
+
+    def test_whole_balance(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+
+        make_payment(from_wallet, to_wallet, Decimal("10"), USD)
+
+        from_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("0")
+
+    def test_conditional_updates(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            make_payment(from_wallet, to_wallet, Decimal("4"), USD)
+
+        updates = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('UPDATE')
+        ]
+        assert len(updates) == 2
+        assert not [sql for sql in updates if 'currency' in sql]
+        # wallets are only resolved, balance is checked by update
+        assert len([
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT')
+            and 'billing_wallet' in query['sql']
+        ]) == 1
+        assert from_wallet.amount == Decimal("6")
+        assert to_wallet.amount == Decimal("5")
+
+
+class TestMakePayments:
+
+    def test_success(self):
+        ExchangeRateFactory.create(
+            rate=Decimal("2"),
+            currency=EUR
+        )
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        first_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=EUR
+        )
+        second_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+
+        results = make_payments([
+            Transfer(from_wallet, first_wallet, Decimal("4"), EUR),
+            Transfer(from_wallet, second_wallet.user, Decimal("3"), USD),
+            # spends money received by first payment
+            Transfer(first_wallet.user, second_wallet, Decimal("5"), EUR),
+        ])
+
+        assert [result.amount for result in results] == [
+            Decimal("4"),
+            Decimal("3"),
+            Decimal("5"),
+        ]
+        assert Transaction.objects.count() == 3
+        for wallet, amount in [
+            (from_wallet, Decimal("5")),
+            (first_wallet, Decimal("0")),
+            (second_wallet, Decimal("5.5")),
+        ]:
+            wallet.refresh_from_db()
+            assert wallet.amount == amount
+
+    def test_all_or_nothing(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+
+        with pytest.raises(BatchPaymentException) as e:
+            make_payments([
+                Transfer(from_wallet, to_wallet, Decimal("4"), USD),
+                Transfer(from_wallet, to_wallet, Decimal("7"), USD),
+                Transfer(from_wallet, from_wallet, Decimal("1"), USD),
+            ])
+
+        assert list(e.value.errors) == [1, 2]
+        assert isinstance(e.value.errors[1], NotEnoughMoneyException)
+        assert isinstance(e.value.errors[2], ValueError)
+        assert not Transaction.objects.exists()
+        from_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("10")
+
+    def test_skip_failed(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+        cad_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=CAD
+        )
+
+        results = make_payments(
+            [
+                Transfer(from_wallet, to_wallet, Decimal("4"), USD),
+                Transfer(from_wallet, to_wallet, Decimal("7"), USD),
+                Transfer(from_wallet, cad_wallet, Decimal("1"), USD),
+                Transfer(from_wallet, to_wallet, Decimal("6"), USD),
+            ],
+            all_or_nothing=False
+        )
+
+        assert isinstance(results[0], Transaction)
+        assert isinstance(results[1], NotEnoughMoneyException)
+        assert isinstance(results[2], ValueError)
+        assert isinstance(results[3], Transaction)
+        assert Transaction.objects.count() == 2
+        from_wallet.refresh_from_db()
+        to_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("0")
+        assert to_wallet.amount == Decimal("11")
+
+    def test_negative_amount(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+
+        with pytest.raises(AssertionError):
+            make_payments([
+                Transfer(from_wallet, to_wallet, Decimal("-4"), USD),
+            ])
+
+
+class TestMakePayout:
+
+    def test_success(self):
+        ExchangeRateFactory.create(
+            rate=Decimal("2"),
+            currency=EUR
+        )
+        first_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=EUR
+        )
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        second_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            transactions = make_payout(from_wallet, [
+                (first_wallet, Decimal("4"), EUR),
+                (second_wallet.user, Decimal("3"), USD),
+                (first_wallet, Decimal("1"), USD),
+            ])
+
+        updates = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE')
+        ]
+        assert len(updates) == 3
+        assert [transaction.amount for transaction in transactions] == [
+            Decimal("4"),
+            Decimal("3"),
+            Decimal("1"),
+        ]
+        assert Transaction.objects.count() == 3
+        assert from_wallet.amount == Decimal("4")
+        for wallet, amount in [
+            (from_wallet, Decimal("4")),
+            (first_wallet, Decimal("7")),
+            (second_wallet, Decimal("3")),
+        ]:
+            wallet.refresh_from_db()
+            assert wallet.amount == amount
+
+    def test_not_enough_money(self):
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+
+        with pytest.raises(NotEnoughMoneyException):
+            make_payout(from_wallet, [
+                (to_wallet, Decimal("6"), USD),
+                (to_wallet, Decimal("5"), USD),
+            ])
+
+        assert not Transaction.objects.exists()
+        from_wallet.refresh_from_db()
+        to_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("10")
+        assert to_wallet.amount == Decimal("1")
+
+    def test_same_wallet(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD
+        )
+
+        with pytest.raises(ValueError):
+            make_payout(from_wallet, [
+                (to_wallet, Decimal("1"), USD),
+                (from_wallet.user, Decimal("1"), USD),
+            ])
+
+
+class TestHotWallet:
+
+    def test_payment_credits_shard(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD,
+            shard_count=4
+        )
+
+        make_payment(from_wallet, to_wallet, Decimal("3"), USD)
+        make_payment(from_wallet, to_wallet, Decimal("2"), USD)
+        charge(to_wallet, Decimal("4"), USD)
+
+        to_wallet.refresh_from_db()
+        assert to_wallet.amount == Decimal("1")
+        assert to_wallet.balance == Decimal("10")
+        assert to_wallet.shards.count() <= 3
+        assert to_wallet.amount_in(USD) == Decimal("10")
+
+    def test_debit_folds_shards(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD,
+            shard_count=4
+        )
+        WalletShardFactory.create_batch(
+            3,
+            wallet=from_wallet,
+            amount=Decimal("2")
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+
+        make_payment(from_wallet, to_wallet, Decimal("5"), USD)
+
+        from_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("2")
+        assert from_wallet.balance == Decimal("2")
+        assert not WalletShard.objects.filter(amount__gt=0).exists()
+
+    def test_debit_of_whole_balance(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD,
+            shard_count=4
+        )
+        WalletShardFactory.create_batch(
+            2,
+            wallet=from_wallet,
+            amount=Decimal("2")
+        )
+        to_wallet = WalletFactory.create(currency=USD)
+
+        with pytest.raises(NotEnoughMoneyException):
+            make_payment(from_wallet, to_wallet, Decimal("6"), USD)
+        make_payment(from_wallet, to_wallet, Decimal("5"), USD)
+
+        from_wallet.refresh_from_db()
+        assert from_wallet.balance == Decimal("0")
+
+    def test_payout_and_batch(self):
+        hot_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD,
+            shard_count=2
+        )
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=USD
+        )
+
+        make_payout(from_wallet, [
+            (hot_wallet, Decimal("5"), USD),
+            (to_wallet, Decimal("1"), USD),
+        ])
+        hot_wallet.refresh_from_db()
+        assert hot_wallet.amount == Decimal("0")
+        assert hot_wallet.balance == Decimal("5")
+
+        make_payments([
+            Transfer(hot_wallet, to_wallet, Decimal("4"), USD),
+        ])
+        hot_wallet.refresh_from_db()
+        to_wallet.refresh_from_db()
+        assert hot_wallet.balance == Decimal("1")
+        assert to_wallet.amount == Decimal("5")
+
+    def test_fold_shards(self):
+        wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=USD,
+            shard_count=4
+        )
+        WalletShardFactory.create_batch(
+            4,
+            wallet=wallet,
+            amount=Decimal("2")
+        )
+
+        assert fold_shards(wallet) == Decimal("8")
+        assert wallet.amount == Decimal("9")
+        wallet.refresh_from_db()
+        assert wallet.amount == Decimal("9")
+        assert wallet.balance == Decimal("9")
+
+
+class TestPaymentIntents:
+
+    def test_enqueue(self):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("1"),
+            currency=EUR
+        )
+
+        intent = enqueue_payment(
+            from_wallet.user,
+            to_wallet.user,
+            Decimal("4"),
+            EUR,
+            RateSnapshot({EUR: Decimal("2")})
+        )
+
+        assert intent.status == PaymentIntent.STATUS.pending
+        assert intent.from_wallet == from_wallet
+        assert intent.to_wallet == to_wallet
+        assert not Transaction.objects.exists()
+        from_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("10")
+
+    def test_enqueue_to_same_wallet(self):
+        wallet = WalletFactory.create(currency=USD)
+
+        with pytest.raises(ValueError):
+            enqueue_payment(wallet, wallet.user, Decimal("4"), USD)
+
+    def test_process(self):
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=EUR)
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=USD,
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=EUR
+        )
+        quoted = enqueue_payment(
+            from_wallet,
+            to_wallet,
+            Decimal("4"),
+            EUR,
+            RateSnapshot({EUR: Decimal("2")})
+        )
+        failed = enqueue_payment(from_wallet, to_wallet, Decimal("9"), USD)
+        latest = enqueue_payment(from_wallet, to_wallet, Decimal("4"), EUR)
+
+        assert process_payment_intents(2) == 2
+        assert process_payment_intents(2) == 1
+        assert process_payment_intents(2) == 0
+
+        quoted.refresh_from_db()
+        failed.refresh_from_db()
+        latest.refresh_from_db()
+        assert quoted.status == PaymentIntent.STATUS.succeeded
+        assert quoted.transaction.amount == Decimal("4")
+        assert failed.status == PaymentIntent.STATUS.failed
+        assert failed.error
+        assert failed.transaction is None
+        assert latest.status == PaymentIntent.STATUS.succeeded
+        from_wallet.refresh_from_db()
+        to_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("7")
+        assert to_wallet.amount == Decimal("8")
+
+
+class TestTransactionAmounts:
+
+    def test_charge(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=EUR)
+
+        charge(wallet, Decimal("3"), USD)
+
+        transaction = Transaction.objects.get()
+        assert transaction.from_amount is None
+        assert transaction.to_amount == Decimal("6")
+        assert transaction.rate == Decimal("2")
+
+    def test_payment(self):
+        ExchangeRateFactory.create(rate=Decimal("3"), currency=EUR)
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=CAD)
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=EUR
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=CAD
+        )
+
+        make_payment(from_wallet, to_wallet, Decimal("1"), USD)
+
+        transaction = Transaction.objects.get()
+        assert transaction.from_amount == Decimal("3")
+        assert transaction.to_amount == Decimal("4")
+        assert transaction.rate == Decimal("1.33333333")
+
+    def test_batch_and_payout(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        from_wallet = WalletFactory.create(amount=Decimal("10"), currency=USD)
+        to_wallet = WalletFactory.create(amount=Decimal("0"), currency=EUR)
+
+        make_payments([Transfer(from_wallet, to_wallet, Decimal("2"), EUR)])
+        make_payout(from_wallet, [(to_wallet, Decimal("1"), USD)])
+
+        assert list(Transaction.objects.order_by('pk').values_list(
+            'from_amount',
+            'to_amount',
+            'rate'
+        )) == [
+            (Decimal("1"), Decimal("2"), Decimal("2")),
+            (Decimal("1"), Decimal("2"), Decimal("2")),
+        ]
+
+
+class TestLedger:
+
+    def entries(self, transaction):
+        return list(transaction.entries.order_by('amount').values_list(
+            'wallet',
+            'amount',
+            'currency'
+        ))
+
+    def test_charge(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        wallet = WalletFactory.create(amount=Decimal("0"), currency=EUR)
+
+        charge(wallet, Decimal("3"), USD)
+
+        transaction = Transaction.objects.get()
+        assert self.entries(transaction) == [
+            (None, Decimal("-3"), USD),
+            (wallet.pk, Decimal("6"), EUR),
+        ]
+
+    def test_payment_in_wallet_currencies(self):
+        ExchangeRateFactory.create(rate=Decimal("2"), currency=EUR)
+        ExchangeRateFactory.create(rate=Decimal("4"), currency=CAD)
+        from_wallet = WalletFactory.create(
+            amount=Decimal("10"),
+            currency=EUR
+        )
+        to_wallet = WalletFactory.create(
+            amount=Decimal("0"),
+            currency=CAD
+        )
+
+        transaction = make_payment(from_wallet, to_wallet, Decimal("1"), USD)
+
+        assert self.entries(transaction) == [
+            (from_wallet.pk, Decimal("-2"), EUR),
+            (to_wallet.pk, Decimal("4"), CAD),
+        ]
+
+    def test_batch_and_payout(self):
+        from_wallet = WalletFactory.create(amount=Decimal("10"), currency=USD)
+        to_wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+
+        results = make_payments(
+            [
+                Transfer(from_wallet, to_wallet, Decimal("1"), USD),
+                Transfer(from_wallet, to_wallet, Decimal("100"), USD),
+                Transfer(from_wallet, to_wallet, Decimal("2"), USD),
+            ],
+            all_or_nothing=False
+        )
+        payouts = make_payout(
+            from_wallet,
+            [(to_wallet, Decimal("3"), USD), (to_wallet, Decimal("4"), USD)]
+        )
+
+        for transaction in [results[0], results[2], *payouts]:
+            assert self.entries(transaction) == [
+                (from_wallet.pk, -transaction.amount, USD),
+                (to_wallet.pk, transaction.amount, USD),
+            ]
+        assert LedgerEntry.objects.count() == 8
+        totals = dict(
+            LedgerEntry.objects.order_by().values('wallet').annotate(
+                total=Sum('amount')
+            ).values_list('wallet', 'total')
+        )
+        assert totals == {
+            from_wallet.pk: Decimal("-10"),
+            to_wallet.pk: Decimal("10"),
+        }
+
+    def test_entries_cant_be_changed(self):
+        wallet = WalletFactory.create(currency=USD)
+        charge(wallet, Decimal("3"), USD)
+        entry = LedgerEntry.objects.first()
+
+        entry.amount = Decimal("100")
+        with pytest.raises(AssertionError):
+            entry.save()
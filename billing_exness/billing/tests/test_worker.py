@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from decimal import Decimal
+from typing import List
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .factories import WalletFactory
+from ..constants import USD
+from ..models import PaymentIntent, Transaction, Wallet
+from ..utils import enqueue_payment
+from .. import worker as worker_module
+from ..worker import PaymentWorker, Stats
+
+pytestmark = pytest.mark.django_db
+
+
+class TestPaymentWorker:
+
+    def enqueue(self, count, amount=Decimal("1")):
+        from_wallet = WalletFactory.create(
+            amount=Decimal("100"),
+            currency=USD
+        )
+        to_wallet = WalletFactory.create(amount=Decimal("0"), currency=USD)
+        intents = [
+            enqueue_payment(from_wallet, to_wallet, amount, USD)
+            for _ in range(count)
+        ]
+        return from_wallet, to_wallet, intents
+
+    def test_empty_queue(self):
+        worker = PaymentWorker(batch_size=10, max_latency=5)
+
+        assert worker.wait_time() is None
+        worker.run(once=True)
+        assert worker.stats() == {
+            'batches': 0,
+            'intents': 0,
+            'fill_ratio': 0.0,
+        }
+
+    def test_waits_for_batch_to_fill(self):
+        self.enqueue(3)
+        worker = PaymentWorker(batch_size=10, max_latency=5)
+
+        wait = worker.wait_time()
+        assert wait is not None
+        assert 0 < wait <= 5
+
+    def test_full_batch(self):
+        self.enqueue(3)
+        worker = PaymentWorker(batch_size=3, max_latency=5)
+
+        assert worker.wait_time() == 0
+
+    def test_latency_exceeded(self):
+        self.enqueue(3)
+        PaymentIntent.objects.update(
+            created=timezone.now() - timedelta(seconds=10)
+        )
+        worker = PaymentWorker(batch_size=10, max_latency=5)
+
+        assert worker.wait_time() == 0
+
+    def test_group_commit(self):
+        from_wallet, to_wallet, intents = self.enqueue(8)
+        worker = PaymentWorker(batch_size=10, max_latency=0)
+
+        with CaptureQueriesContext(connection) as context:
+            assert worker.run_once() == 8
+
+        wallet_updates = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE')
+            and Wallet._meta.db_table in query['sql']
+        ]
+        assert len(wallet_updates) == 1
+        assert Transaction.objects.count() == 8
+        assert worker.stats() == {
+            'batches': 1,
+            'intents': 8,
+            'fill_ratio': 0.8,
+        }
+        for intent in PaymentIntent.objects.all():
+            assert intent.status == PaymentIntent.STATUS.succeeded
+            assert intent.transaction_id is not None
+        from_wallet.refresh_from_db()
+        to_wallet.refresh_from_db()
+        assert from_wallet.amount == Decimal("92")
+        assert to_wallet.amount == Decimal("8")
+
+    def test_run_once(self):
+        from_wallet, to_wallet, intents = self.enqueue(5, Decimal("30"))
+        worker = PaymentWorker(batch_size=2, max_latency=0)
+
+        worker.run(once=True)
+
+        assert worker.stats() == {
+            'batches': 3,
+            'intents': 5,
+            'fill_ratio': 0.833,
+        }
+        statuses = list(
+            PaymentIntent.objects.order_by('pk').values_list(
+                'status',
+                flat=True
+            )
+        )
+        assert statuses == ['succeeded'] * 3 + ['failed'] * 2
+
+    def test_sleeps_when_intents_are_locked(self, monkeypatch):
+        self.enqueue(3)
+        worker = PaymentWorker(batch_size=3, max_latency=0, poll_interval=2)
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            raise KeyboardInterrupt
+
+        # other worker has locked pending intents
+        monkeypatch.setattr(worker, 'run_once', lambda: 0)
+        monkeypatch.setattr(worker_module.time, 'sleep', sleep)
+
+        with pytest.raises(KeyboardInterrupt):
+            worker.run()
+
+        assert sleeps == [2]
+
+    def test_report(self):
+        self.enqueue(5)
+        worker = PaymentWorker(batch_size=2, max_latency=0, report_interval=0)
+        reports: List[Stats] = []
+
+        worker.run(once=True, report=reports.append)
+
+        assert [report['fill_ratio'] for report in reports] == [1, 1, 0.5]
+        assert [report['batches'] for report in reports] == [1, 1, 1]
@@ -1,16 +1,49 @@
 # -*- coding: utf-8 -*-
-from typing import Union
-from decimal import Decimal
+import json
+import random
+from collections import defaultdict
+from datetime import datetime
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union
+)
+from decimal import Decimal, ROUND_HALF_UP
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser
-from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
 
-from .models import Wallet, ExchangeRate, Transaction
-from .exceptions import NotEnoughMoneyException, check_currency
+from .constants import BASE_CURRENCY
+from .db import retry_atomic
+from .models import (
+    Wallet,
+    WalletShard,
+    Transaction,
+    LedgerEntry,
+    PaymentIntent
+)
+from .rates import RateSnapshot, rate_cache
+from .exceptions import (
+    NotEnoughMoneyException,
+    BatchPaymentException,
+    check_currency
+)
 
 User = get_user_model()
 
+AMOUNT_STEP = Decimal(1).scaleb(
+    -Wallet._meta.get_field('amount').decimal_places
+)
+RATE_STEP = Decimal(1).scaleb(
+    -Transaction._meta.get_field('rate').decimal_places
+)
+
 
 def get_wallet(wallet: Union[AbstractBaseUser, Wallet]) -> Wallet:
     """
@@ -28,11 +61,327 @@ def get_wallet(wallet: Union[AbstractBaseUser, Wallet]) -> Wallet:
     return wallet
 
 
-@transaction.atomic
+Owner = Union[AbstractBaseUser, Wallet, str]
+
+
+def owner_filter(owner: Owner) -> Q:
+    """
+    Builds condition of wallet of `Wallet`, `User` or username
+    """
+    if isinstance(owner, Wallet):
+        return Q(pk=owner.pk)
+    if isinstance(owner, User):
+        return Q(user=owner.pk)
+    return Q(user__username=owner)
+
+
+def find_wallet(owner: Owner, wallets: List[Wallet]) -> Wallet:
+    """
+    Picks wallet of owner from fetched wallets. Passed wallet is refreshed
+    from fetched row and returned itself.
+    Raises:
+        ValueError - if user doesn`t exist or hasn`t got wallet
+    """
+    for wallet in wallets:
+        if isinstance(owner, Wallet) and wallet.pk == owner.pk:
+            owner.amount = wallet.amount
+            if not Wallet.user.is_cached(owner):
+                owner.user = wallet.user
+            return owner
+        if isinstance(owner, User) and wallet.user_id == owner.pk:
+            wallet.user = owner
+            return wallet
+        if isinstance(owner, str) and wallet.user.username == owner:
+            return wallet
+
+    if isinstance(owner, Wallet):
+        raise ValueError(f"Wallet {owner.pk} doesn`t exist")
+    if isinstance(owner, str) and \
+            not User.objects.filter(username=owner).exists():
+        raise ValueError(f"User {owner} doesn`t exist")
+    username = owner if isinstance(owner, str) else owner.get_username()
+    raise ValueError(f"User {username} hasn`t got wallet")
+
+
+def resolve_wallets(payer: Owner, payee: Owner) -> Tuple[Wallet, Wallet]:
+    """
+    Fetches wallets of payment joined with their users and locks them in
+    order of primary keys with one query. Hot payee isn`t locked, so
+    concurrent payments to it don`t wait for each other, it is fetched with
+    one more query. Should be called inside transaction.
+    Params:
+        payer - `Wallet`, `User` or username of payer
+        payee - `Wallet`, `User` or username of payee
+    Raises:
+        ValueError - if one of users doesn`t exist or hasn`t got wallet
+    Returns:
+        tuple - wallets of payer and payee
+    """
+    wallets = Wallet.objects.select_related('user')
+    locked = list(
+        wallets.select_for_update(of=('self',)).filter(
+            owner_filter(payer) |
+            owner_filter(payee) & Q(shard_count=0)
+        ).order_by('pk')
+    )
+    from_wallet = find_wallet(payer, locked)
+    try:
+        to_wallet = find_wallet(payee, locked)
+    except ValueError:
+        to_wallet = find_wallet(
+            payee,
+            list(wallets.filter(owner_filter(payee)))
+        )
+    return from_wallet, to_wallet
+
+
+def lock_wallets(*wallets: Wallet) -> Dict[int, Decimal]:
+    """
+    Locks rows of wallets in order of primary keys, so concurrent operations
+    with the same wallets can`t deadlock. Refreshes `amount` of passed
+    wallets from locked rows. Should be called inside transaction.
+    Returns:
+        dict - amounts of locked wallets by their primary keys
+    """
+    amounts = dict(
+        Wallet.objects.select_for_update().filter(
+            pk__in={wallet.pk for wallet in wallets}
+        ).order_by('pk').values_list('pk', 'amount')
+    )
+    for wallet in wallets:
+        wallet.amount = amounts[wallet.pk]
+    return amounts
+
+
+def amount_value(amount: Decimal, model=Wallet) -> Value:
+    """
+    Wraps amount for expressions with `amount` field of model, so it is
+    converted to minor units like the field
+    """
+    return Value(amount, output_field=model._meta.get_field('amount'))
+
+
+def round_amount(amount: Decimal) -> Decimal:
+    """
+    Rounds amount to precision of wallet amount
+    """
+    return amount.quantize(AMOUNT_STEP, rounding=ROUND_HALF_UP)
+
+
+def apply_rates(row: Transaction, snapshot: RateSnapshot) -> Transaction:
+    """
+    Fills debit, credit and applied rate of transaction with rates of
+    snapshot. Payer of charge is outer world, so charge hasn`t got debit
+    and its rate is rate of transaction currency.
+    Raises:
+        ValueError - when one of rates hasn`t been set
+    Returns:
+        `Transaction` - passed transaction
+    """
+    to_currency = row.to_wallet.currency
+    from_currency = row.currency
+    if row.from_wallet is not None:
+        from_currency = row.from_wallet.currency
+        row.from_amount = round_amount(
+            row.amount / snapshot.get(from_currency, row.currency)
+        )
+    row.to_amount = round_amount(
+        row.amount * snapshot.get(row.currency, to_currency)
+    )
+    row.rate = snapshot.get(from_currency, to_currency).quantize(
+        RATE_STEP,
+        rounding=ROUND_HALF_UP
+    )
+    return row
+
+
+def shift_amount(wallet: Wallet, delta: Decimal) -> bool:
+    """
+    Adds `delta` to amount of wallet with one UPDATE statement. Negative
+    delta is applied only if wallet has got enough money, so balance is
+    checked and changed atomically without reading it first.
+    Passed wallet isn`t changed.
+    Returns:
+        bool - False if wallet hasn`t got enough money
+    """
+    wallets = Wallet.objects.filter(pk=wallet.pk)
+    if delta < 0:
+        wallets = wallets.filter(amount__gte=-delta)
+    return bool(wallets.update(
+        amount=F('amount') + amount_value(delta),
+        modified=timezone.now()
+    ))
+
+
+def credit_wallet(wallet: Wallet, credit: Decimal):
+    """
+    Adds credit to wallet with one UPDATE statement. Credit of hot wallet
+    is added to its random shard, so concurrent credits of it don`t wait
+    for each other. Amount of passed wallet is updated if credit has been
+    added to wallet row.
+    """
+    if not wallet.shard_count:
+        shift_amount(wallet, credit)
+        wallet.amount += credit
+        return
+
+    index = random.randrange(wallet.shard_count)
+    updated = WalletShard.objects.filter(
+        wallet_id=wallet.pk,
+        index=index
+    ).update(
+        amount=F('amount') + amount_value(credit, WalletShard),
+        modified=timezone.now()
+    )
+    if not updated:
+        _, created = WalletShard.objects.get_or_create(
+            wallet_id=wallet.pk,
+            index=index,
+            defaults={'amount': credit}
+        )
+        if not created:
+            WalletShard.objects.filter(
+                wallet_id=wallet.pk,
+                index=index
+            ).update(
+                amount=F('amount') + amount_value(credit, WalletShard),
+                modified=timezone.now()
+            )
+
+
+def debit_wallet(wallet: Wallet, debit: Decimal) -> bool:
+    """
+    Subtracts debit from wallet with one conditional UPDATE statement.
+    If hot wallet hasn`t got enough money in its row, money of its shards
+    is moved to wallet row and debit is retried. Amount of passed wallet is
+    updated on success.
+    Returns:
+        bool - False if wallet hasn`t got enough money
+    """
+    debited = shift_amount(wallet, -debit)
+    if not debited and wallet.shard_count and fold_shards(wallet):
+        debited = shift_amount(wallet, -debit)
+    if debited:
+        wallet.amount -= debit
+    return debited
+
+
+def fold_shards(wallet: Wallet) -> Decimal:
+    """
+    Moves money of all shards of wallet to wallet row. Locks wallet row
+    before its shards, so concurrent folds of wallet can`t deadlock.
+    Refreshes `amount` of passed wallet. Should be called inside
+    transaction.
+    Returns:
+        Decimal - amount that has been moved
+    """
+    lock_wallets(wallet)
+    shards = dict(
+        WalletShard.objects.select_for_update().filter(
+            wallet_id=wallet.pk,
+            amount__gt=0
+        ).order_by('index').values_list('pk', 'amount')
+    )
+    total = sum(shards.values(), Decimal("0"))
+    if not total:
+        return total
+
+    now = timezone.now()
+    WalletShard.objects.filter(pk__in=shards).update(amount=0, modified=now)
+    Wallet.objects.filter(pk=wallet.pk).update(
+        amount=F('amount') + amount_value(total),
+        modified=now
+    )
+    wallet.amount += total
+    return total
+
+
+def credit_wallets(
+    pks: Sequence[int],
+    credits: Dict[int, Decimal],
+    modified: datetime
+):
+    """
+    Adds credits to amounts of wallets with one UPDATE statement. UPDATE
+    locks rows in order of scan, so rows are locked in order of primary
+    keys by SELECT FOR UPDATE before it.
+    Params:
+        pks - primary keys of wallets that should be updated
+        credits - amounts that should be added by primary keys of wallets
+        modified - time of modification
+    """
+    if not pks:
+        return
+
+    wallets = Wallet.objects.filter(pk__in=pks)
+    list(wallets.select_for_update().order_by('pk').values_list('pk'))
+    field = Wallet._meta.get_field('amount')
+    wallets.update(
+        amount=Case(
+            *[
+                When(pk=pk, then=F('amount') + amount_value(credits[pk]))
+                for pk in pks
+            ],
+            output_field=field
+        ),
+        modified=modified
+    )
+
+
+def create_entries(transactions: List[Transaction]):
+    """
+    Inserts debit and credit ledger entries of saved transactions with
+    one statement. Debit of charge is amount of transaction
+    """
+    entries = []
+    for row in transactions:
+        if row.from_wallet is None:
+            debit, currency = row.amount, row.currency
+        else:
+            debit, currency = row.from_amount, row.from_wallet.currency
+        entries.append(LedgerEntry(
+            transaction=row,
+            wallet=row.from_wallet,
+            amount=-debit,
+            currency=currency,
+            created=row.created
+        ))
+        entries.append(LedgerEntry(
+            transaction=row,
+            wallet=row.to_wallet,
+            amount=row.to_amount,
+            currency=row.to_wallet.currency,
+            created=row.created
+        ))
+    LedgerEntry.objects.bulk_create(entries)
+
+
+def create_transactions(transactions: List[Transaction], now: datetime):
+    """
+    Inserts transactions with one statement and their ledger entries with
+    another one. All of them are marked as created at `now`
+    """
+    for row in transactions:
+        row.created = row.modified = now
+    Transaction.objects.bulk_create(transactions)
+    if any(row.pk is None for row in transactions):
+        # backend can't return ids of inserted rows, rows of batch are
+        # the latest ones created at `now`
+        pks = list(Transaction.objects.filter(
+            created=now
+        ).order_by('-pk').values_list('pk', flat=True)[:len(transactions)])
+        for row, pk in zip(transactions, reversed(pks)):
+            row.pk = pk
+            row._state.adding = False
+    create_entries(transactions)
+
+
+@retry_atomic
 def charge(
     wallet: Union[AbstractBaseUser, Wallet],
     amount: Decimal,
     currency: str,
+    snapshot: Optional[RateSnapshot] = None,
 ) -> Wallet:
     """
     Charges users wallet from outer world. And add transaction for
@@ -42,6 +391,7 @@ def charge(
                  should be charged
         amount - amount that should be charged
         currency - currency of amount
+        snapshot - rates to use for conversion, latest rates by default
     Raises:
         AssertionError - if wrong currency has been passed, or not positive
         amount has been passed
@@ -54,37 +404,43 @@ def charge(
 
     wallet = get_wallet(wallet)
 
-    rate = ExchangeRate.get(currency, wallet.currency)
-    wallet.amount += amount * rate
-    wallet.save()
-    Transaction.objects.create(
-        amount=amount,
-        currency=currency,
-        to_wallet=wallet
+    row = apply_rates(
+        Transaction(amount=amount, currency=currency, to_wallet=wallet),
+        snapshot or rate_cache.snapshot()
     )
+    credit_wallet(wallet, row.to_amount)
+    if not wallet.shard_count:
+        # row is already locked by credit, amount is read instead of being
+        # shifted, so attempt rerun by `retry_atomic` doesn`t add it twice
+        lock_wallets(wallet)
+    row.save()
+    create_entries([row])
 
     return wallet
 
 
-@transaction.atomic
+@retry_atomic
 def make_payment(
-    from_wallet: Union[AbstractBaseUser, Wallet],
-    to_wallet: Union[AbstractBaseUser, Wallet],
+    from_wallet: Owner,
+    to_wallet: Owner,
     amount: Decimal,
-    currency: str
+    currency: str,
+    snapshot: Optional[RateSnapshot] = None,
 ) -> Transaction:
     """
     Make payment from `from_wallet` to `to_wallet` in any currencies.
     Checks that from_wallet has got enough money for processing it.
     Stores info about transaction in db
     Params:
-        from_wallet - `Wallet` or `User` that will pay
-        to_wallet - `Wallet` or `User` that will receive payment
+        from_wallet - `Wallet`, `User` or username that will pay
+        to_wallet - `Wallet`, `User` or username that will receive payment
         amount - amount of payment in Decial
         currency - currency of processing payment
+        snapshot - rates to use for conversion, latest rates by default
     Raises:
         AssertionError - if wrong currency has been passed
-        ValueError - if one of passed users hasn`t got wallet
+        ValueError - if one of passed users doesn`t exist or hasn`t got
+                     wallet, or wallets are the same
         NotEnoughMoneyException - if from_wallet hasn`t got enough money to
                                   proceed transaction
     Returns:
@@ -93,27 +449,355 @@ def make_payment(
     check_currency(currency)
     assert amount > 0
 
-    from_wallet = get_wallet(from_wallet)
-    to_wallet = get_wallet(to_wallet)
+    from_wallet, to_wallet = resolve_wallets(from_wallet, to_wallet)
+    if from_wallet.pk == to_wallet.pk:
+        raise ValueError("Payment to the same wallet isn`t allowed")
 
-    from_rate = ExchangeRate.get(from_wallet.currency, currency)
-    to_rate = ExchangeRate.get(currency, to_wallet.currency)
+    row = apply_rates(
+        Transaction(
+            from_wallet=from_wallet,
+            to_wallet=to_wallet,
+            amount=amount,
+            currency=currency
+        ),
+        snapshot or rate_cache.snapshot()
+    )
 
-    if from_rate * from_wallet.amount < amount:
+    # wallet rows have already been locked in order of primary keys
+    if not debit_wallet(from_wallet, row.from_amount):
         username = from_wallet.user.get_username()
         raise NotEnoughMoneyException(
             f"{username} hasn`t got {amount} {currency}"
         )
+    credit_wallet(to_wallet, row.to_amount)
 
-    from_wallet.amount -= amount / from_rate
-    to_wallet.amount += amount * to_rate
+    row.save()
+    create_entries([row])
+    return row
 
-    from_wallet.save()
-    to_wallet.save()
 
-    return Transaction.objects.create(
+class Transfer(NamedTuple):
+    """
+    Payment of batch. Payment is made with its own rates if they are
+    passed, else with rates of batch
+    """
+    from_wallet: Union[AbstractBaseUser, Wallet]
+    to_wallet: Union[AbstractBaseUser, Wallet]
+    amount: Decimal
+    currency: str
+    snapshot: Optional[RateSnapshot] = None
+
+
+@retry_atomic
+def make_payments(
+    transfers: Sequence[Transfer],
+    snapshot: Optional[RateSnapshot] = None,
+    all_or_nothing: bool = True,
+) -> List[Union[Transaction, Exception]]:
+    """
+    Makes batch of payments in one transaction. Locks all involved wallets
+    once in order of primary keys, checks balances in memory and writes
+    new balances and `Transaction` rows with one statement each.
+    Payments are applied in passed order, so payment could spend money
+    received by previous payments of batch.
+    Params:
+        transfers - payments that should be made
+        snapshot - rates to use for conversion, latest rates by default
+        all_or_nothing - if True no payment is made when any of them fails,
+                         otherwise only failed payments are skipped
+    Raises:
+        AssertionError - if wrong currency or not positive amount has been
+                         passed
+        BatchPaymentException - in all-or-nothing mode if some payments
+                                can`t be made
+    Returns:
+        list - `Transaction` of every made payment and `ValueError` or
+               `NotEnoughMoneyException` of every failed one in order of
+               transfers
+    """
+    for transfer in transfers:
+        check_currency(transfer.currency)
+        assert transfer.amount > 0
+
+    results: List[Union[Transaction, Exception]] = []
+    for transfer in transfers:
+        try:
+            from_wallet = get_wallet(transfer.from_wallet)
+            to_wallet = get_wallet(transfer.to_wallet)
+            if from_wallet.pk == to_wallet.pk:
+                raise ValueError("Payment to the same wallet isn`t allowed")
+        except ValueError as e:
+            results.append(e)
+        else:
+            results.append(Transaction(
+                from_wallet=from_wallet,
+                to_wallet=to_wallet,
+                amount=transfer.amount,
+                currency=transfer.currency
+            ))
+
+    wallets = [
+        wallet
+        for result in results if isinstance(result, Transaction)
+        for wallet in (result.from_wallet, result.to_wallet)
+    ]
+    balances = lock_wallets(*wallets)
+    # money of hot wallets is spent from wallet rows only
+    payers = {
+        result.from_wallet.pk: result.from_wallet
+        for result in results if isinstance(result, Transaction)
+    }
+    for pk, wallet in payers.items():
+        if wallet.shard_count:
+            balances[pk] += fold_shards(wallet)
+
+    snapshot = snapshot or rate_cache.snapshot()
+    for i, result in enumerate(results):
+        if not isinstance(result, Transaction):
+            continue
+        from_wallet, to_wallet = result.from_wallet, result.to_wallet
+        try:
+            apply_rates(result, transfers[i].snapshot or snapshot)
+        except ValueError as e:
+            results[i] = e
+            continue
+        if balances[from_wallet.pk] < result.from_amount:
+            username = from_wallet.user.get_username()
+            results[i] = NotEnoughMoneyException(
+                f"{username} hasn`t got {result.amount} {result.currency}"
+            )
+            continue
+        balances[from_wallet.pk] -= result.from_amount
+        balances[to_wallet.pk] += result.to_amount
+
+    errors = {
+        i: result for i, result in enumerate(results)
+        if isinstance(result, Exception)
+    }
+    if errors and all_or_nothing:
+        raise BatchPaymentException(errors)
+
+    transactions = [
+        result for result in results if isinstance(result, Transaction)
+    ]
+    if not transactions:
+        return results
+
+    changed = {
+        wallet.pk for result in transactions
+        for wallet in (result.from_wallet, result.to_wallet)
+    }
+    now = timezone.now()
+    Wallet.objects.bulk_update(
+        [
+            Wallet(pk=pk, amount=balances[pk], modified=now)
+            for pk in sorted(changed)
+        ],
+        ['amount', 'modified']
+    )
+    create_transactions(transactions, now)
+
+    for wallet in wallets:
+        wallet.amount = balances[wallet.pk]
+
+    return results
+
+
+@retry_atomic
+def make_payout(
+    from_wallet: Union[AbstractBaseUser, Wallet],
+    payouts: Sequence[Tuple[Union[AbstractBaseUser, Wallet], Decimal, str]],
+    snapshot: Optional[RateSnapshot] = None,
+) -> List[Transaction]:
+    """
+    Makes payments from one wallet to many wallets. Checks total debit of
+    `from_wallet` once and updates it with one statement, credits of all
+    recipients are applied with at most two more statements. Hot
+    recipients are credited through their shards.
+    Params:
+        from_wallet - `Wallet` or `User` that will pay
+        payouts - recipient(`Wallet` or `User`), amount and currency of
+                  every payment
+        snapshot - rates to use for conversion, latest rates by default
+    Raises:
+        AssertionError - if wrong currency or not positive amount has been
+                         passed
+        ValueError - if one of passed users hasn`t got wallet, or
+                     `from_wallet` is one of recipients
+        NotEnoughMoneyException - if from_wallet hasn`t got enough money to
+                                  make all payments
+    Returns:
+        list - `Transaction` of every payment in order of payouts
+    """
+    for _, amount, currency in payouts:
+        check_currency(currency)
+        assert amount > 0
+
+    from_wallet = get_wallet(from_wallet)
+    payouts = [
+        (get_wallet(to_wallet), amount, currency)
+        for to_wallet, amount, currency in payouts
+    ]
+    if not payouts:
+        return []
+    if from_wallet.pk in {to_wallet.pk for to_wallet, _, _ in payouts}:
+        raise ValueError("Payment to the same wallet isn`t allowed")
+
+    snapshot = snapshot or rate_cache.snapshot()
+    transactions = [
+        apply_rates(
+            Transaction(
+                from_wallet=from_wallet,
+                to_wallet=to_wallet,
+                amount=amount,
+                currency=currency
+            ),
+            snapshot
+        )
+        for to_wallet, amount, currency in payouts
+    ]
+    debit = sum((row.from_amount for row in transactions), Decimal("0"))
+    credits: Dict[int, Decimal] = defaultdict(Decimal)
+    for row in transactions:
+        credits[row.to_wallet.pk] += row.to_amount
+
+    # hot wallets are credited through their shards
+    to_wallets = {id(to_wallet): to_wallet for to_wallet, _, _ in payouts}
+    hot = {
+        to_wallet.pk: to_wallet for to_wallet in to_wallets.values()
+        if to_wallet.shard_count
+    }
+    for pk, to_wallet in hot.items():
+        credit_wallet(to_wallet, credits[pk])
+
+    # wallets are locked in order of primary keys as in `make_payment`,
+    # so payout can`t deadlock with payments between the same wallets
+    lower = [pk for pk in credits if pk < from_wallet.pk and pk not in hot]
+    higher = [pk for pk in credits if pk > from_wallet.pk and pk not in hot]
+    now = timezone.now()
+    credit_wallets(lower, credits, now)
+    if not debit_wallet(from_wallet, debit):
+        username = from_wallet.user.get_username()
+        raise NotEnoughMoneyException(
+            f"{username} hasn`t got enough money for {len(payouts)} payments"
+        )
+    credit_wallets(higher, credits, now)
+
+    # rows are already locked by updates, amounts are read instead of being
+    # shifted, so attempt rerun by `retry_atomic` doesn`t apply them twice
+    lock_wallets(from_wallet, *[
+        to_wallet for to_wallet in to_wallets.values()
+        if to_wallet.pk not in hot
+    ])
+
+    create_transactions(transactions, now)
+    return transactions
+
+
+def enqueue_payment(
+    from_wallet: Union[AbstractBaseUser, Wallet],
+    to_wallet: Union[AbstractBaseUser, Wallet],
+    amount: Decimal,
+    currency: str,
+    snapshot: Optional[RateSnapshot] = None,
+) -> PaymentIntent:
+    """
+    Accepts payment for asynchronous processing by `process_payment_intents`
+    Params:
+        from_wallet - `Wallet` or `User` that will pay
+        to_wallet - `Wallet` or `User` that will receive payment
+        amount - amount of payment
+        currency - currency of payment
+        snapshot - rates to make payment with, latest rates at processing
+                   by default
+    Raises:
+        AssertionError - if wrong currency or not positive amount has been
+                         passed
+        ValueError - if one of passed users hasn`t got wallet, or
+                     wallets are the same
+    Returns:
+        `PaymentIntent` - pending intent of payment
+    """
+    check_currency(currency)
+    assert amount > 0
+
+    from_wallet = get_wallet(from_wallet)
+    to_wallet = get_wallet(to_wallet)
+    if from_wallet.pk == to_wallet.pk:
+        raise ValueError("Payment to the same wallet isn`t allowed")
+
+    rates = ''
+    if snapshot is not None:
+        rates = json.dumps({
+            currency: str(rate)
+            for currency, rate in snapshot.rates.items()
+            if currency != BASE_CURRENCY
+        })
+
+    return PaymentIntent.objects.create(
         from_wallet=from_wallet,
         to_wallet=to_wallet,
         amount=amount,
-        currency=currency
+        currency=currency,
+        rates=rates
+    )
+
+
+@retry_atomic
+def process_payment_intents(limit: int) -> int:
+    """
+    Makes up to `limit` oldest pending payment intents as one batch: every
+    involved wallet is locked and updated once with net change of its
+    balance and transactions are inserted with one statement. Intents are
+    locked with SKIP LOCKED, so many workers could process queue
+    concurrently without waiting for each other.
+    Returns:
+        int - count of processed intents
+    """
+    intents = list(
+        PaymentIntent.objects.select_for_update(
+            skip_locked=True,
+            of=('self',)
+        ).select_related(
+            'from_wallet__user',
+            'to_wallet__user'
+        ).filter(
+            status=PaymentIntent.STATUS.pending
+        ).order_by('created', 'pk')[:limit]
+    )
+    if not intents:
+        return 0
+
+    transfers = []
+    for intent in intents:
+        snapshot = None
+        if intent.rates:
+            snapshot = RateSnapshot({
+                currency: Decimal(rate)
+                for currency, rate in json.loads(intent.rates).items()
+            })
+        transfers.append(Transfer(
+            intent.from_wallet,
+            intent.to_wallet,
+            intent.amount,
+            intent.currency,
+            snapshot
+        ))
+
+    results = make_payments(transfers, all_or_nothing=False)
+
+    now = timezone.now()
+    for intent, result in zip(intents, results):
+        if isinstance(result, Exception):
+            intent.status = PaymentIntent.STATUS.failed
+            intent.error = str(result)
+        else:
+            intent.status = PaymentIntent.STATUS.succeeded
+            intent.transaction = result
+        intent.modified = now
+
+    PaymentIntent.objects.bulk_update(
+        intents,
+        ['status', 'error', 'transaction', 'modified']
     )
+    return len(intents)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Callable, Dict, Optional, Union
+
+from django.utils import timezone
+
+from .models import PaymentIntent
+from .utils import process_payment_intents
+
+Stats = Dict[str, Union[int, float]]
+
+
+class PaymentWorker:
+    """
+    Groups pending payment intents into batches, so wallet that shows up
+    in many intents is locked and updated once per batch. Batch is made
+    when it is full or its oldest intent has waited for `max_latency`
+    seconds, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        max_latency: float,
+        poll_interval: float = 1.0,
+        report_interval: float = 60.0
+    ):
+        """
+        Params:
+            batch_size - max count of intents in batch
+            max_latency - max seconds that intent waits for batch to fill
+            poll_interval - max seconds between checks of queue
+            report_interval - min seconds between reports of stats
+        """
+        assert batch_size > 0
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+        self.batches = 0
+        self.intents = 0
+
+    def wait_time(self) -> Optional[float]:
+        """
+        Returns seconds to wait before next batch should be made,
+        None if queue is empty
+        """
+        created = list(
+            PaymentIntent.objects.filter(
+                status=PaymentIntent.STATUS.pending
+            ).order_by('created', 'pk').values_list(
+                'created',
+                flat=True
+            )[:self.batch_size]
+        )
+        if not created:
+            return None
+        if len(created) >= self.batch_size:
+            return 0.0
+
+        waited = (timezone.now() - created[0]).total_seconds()
+        return max(0.0, self.max_latency - waited)
+
+    def run_once(self) -> int:
+        """
+        Makes one batch of pending intents without waiting
+        Returns:
+            int - count of processed intents
+        """
+        count = process_payment_intents(self.batch_size)
+        if count:
+            self.batches += 1
+            self.intents += count
+        return count
+
+    def run(
+        self,
+        once: bool = False,
+        report: Optional[Callable[[Stats], None]] = None
+    ):
+        """
+        Makes batches of pending intents until queue is empty if `once`
+        has been passed, else forever. Stats of batches made since previous
+        report are passed to `report` every `report_interval` seconds.
+        """
+        reported_at = time.monotonic()
+        reported = (self.batches, self.intents)
+        while True:
+            wait = self.wait_time()
+            if wait is None:
+                if once:
+                    return
+                time.sleep(self.poll_interval)
+            elif wait > 0:
+                time.sleep(min(wait, self.poll_interval))
+            elif not self.run_once():
+                # pending intents are locked by other workers
+                if once:
+                    return
+                time.sleep(self.poll_interval)
+
+            now = time.monotonic()
+            if report is not None and now - reported_at >= self.report_interval:
+                report(self._stats(
+                    self.batches - reported[0],
+                    self.intents - reported[1]
+                ))
+                reported_at = now
+                reported = (self.batches, self.intents)
+
+    def stats(self) -> Stats:
+        """
+        Returns count of made batches and intents, and average fill ratio
+        of batches
+        """
+        return self._stats(self.batches, self.intents)
+
+    def _stats(self, batches: int, intents: int) -> Stats:
+        fill_ratio = 0.0
+        if batches:
+            fill_ratio = intents / (batches * self.batch_size)
+        return {
+            'batches': batches,
+            'intents': intents,
+            'fill_ratio': round(fill_ratio, 3),
+        }
@@ -3,6 +3,8 @@ from django.conf import settings
 from django.test import RequestFactory
 
 from billing_exness.users.tests.factories import UserFactory
+from billing_exness.billing.db import retry_stats
+from billing_exness.billing.rates import rate_cache
 
 
 @pytest.fixture(autouse=True)
@@ -10,6 +12,16 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def clear_rate_cache():
+    rate_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_retry_stats():
+    retry_stats.clear()
+
+
 @pytest.fixture
 def user() -> settings.AUTH_USER_MODEL:
     return UserFactory()
@@ -75,7 +75,7 @@ THIRD_PARTY_APPS = [
 
 LOCAL_APPS = [
     "billing_exness.users.apps.UsersConfig",
-    "billing_exness.billing",
+    "billing_exness.billing.apps.BillingConfig",
 ]
 # https://docs.djangoproject.com/en/dev/ref/settings/#installed-apps
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
@@ -280,3 +280,44 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
 }
+
+# Billing
+# ------------------------------------------------------------------------------
+# How often(in seconds) process checks that cached exchange rates are outdated
+BILLING_RATE_CACHE_CHECK_INTERVAL = env.float(
+    "BILLING_RATE_CACHE_CHECK_INTERVAL",
+    default=1.0
+)
+# How long(in seconds) quoted exchange rates could be used for payments
+BILLING_QUOTE_TTL = env.int("BILLING_QUOTE_TTL", default=30)
+# Pubsub for notifications about new exchange rates
+BILLING_PUBSUB = {
+    "BACKEND": "billing_exness.billing.pubsub.InMemoryPubSub",
+    "OPTIONS": {},
+}
+# Max time(in seconds) that rate stream request waits for new rates
+BILLING_STREAM_TIMEOUT = env.int("BILLING_STREAM_TIMEOUT", default=25)
+# Max count of payments that could be made with one batch request
+BILLING_PAYMENT_BATCH_SIZE = env.int("BILLING_PAYMENT_BATCH_SIZE", default=1000)
+# How long(in seconds) responses of requests with Idempotency-Key are kept
+BILLING_IDEMPOTENCY_KEY_TTL = env.int(
+    "BILLING_IDEMPOTENCY_KEY_TTL",
+    default=24 * 60 * 60
+)
+# Max count of payment intents that worker makes in one batch
+BILLING_WORKER_BATCH_SIZE = env.int("BILLING_WORKER_BATCH_SIZE", default=100)
+# Max time(in seconds) that payment intent waits for batch to fill
+BILLING_WORKER_MAX_LATENCY = env.float(
+    "BILLING_WORKER_MAX_LATENCY",
+    default=0.05
+)
+# How many times billing transaction is run when it is aborted by
+# serialization failure or deadlock
+BILLING_RETRY_ATTEMPTS = env.int("BILLING_RETRY_ATTEMPTS", default=5)
+# Delays(in seconds) between attempts grow exponentially from base to max
+BILLING_RETRY_BASE_DELAY = env.float("BILLING_RETRY_BASE_DELAY", default=0.01)
+BILLING_RETRY_MAX_DELAY = env.float("BILLING_RETRY_MAX_DELAY", default=0.5)
+# How old(in seconds) ledger entries and transactions should be to get into
+# balance checkpoints and reconciliation marks, rows of running transactions
+# could appear later
+BILLING_CHECKPOINT_LAG = env.int("BILLING_CHECKPOINT_LAG", default=60)
@@ -29,6 +29,15 @@ CACHES = {
     }
 }
 
+# BILLING
+# ------------------------------------------------------------------------------
+BILLING_PUBSUB = {
+    "BACKEND": "billing_exness.billing.pubsub.RedisPubSub",
+    "OPTIONS": {
+        "url": env("REDIS_URL"),
+    },
+}
+
 # SECURITY
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#secure-proxy-ssl-header